@@ -12,8 +12,9 @@ from datetime import datetime
 
 from .db import get_db
 from .models import Proxy, AccessToken, AdminUser
-from .auth import generate_token, hash_password, verify_password
+from .auth import generate_token, hash_password, verify_password, invalidate_access_token
 from .logic import log
+from .proxy_manager import invalidate_proxies, ProxyManager
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -106,9 +107,11 @@ def create_proxy(
     
     db.add(new_proxy)
     db.commit()
+    invalidate_proxies()
     db.refresh(new_proxy)
     
-    log(f"Created new proxy: {new_proxy.url}")
+    safe_host = ProxyManager.get_proxy_safe_host(new_proxy.url)
+    log(f"Created new proxy: {safe_host}", event="admin_audit", sample=False, action="proxy_created", proxy_id=new_proxy.id)
     
     return new_proxy
 
@@ -135,9 +138,11 @@ def update_proxy(
     proxy.note = proxy_data.note
     
     db.commit()
+    invalidate_proxies()
     db.refresh(proxy)
     
-    log(f"Updated proxy {proxy_id}: {proxy.url}")
+    safe_host = ProxyManager.get_proxy_safe_host(proxy.url)
+    log(f"Updated proxy {proxy_id}: {safe_host}", event="admin_audit", sample=False, action="proxy_updated", proxy_id=proxy_id)
     
     return proxy
 
@@ -160,8 +165,9 @@ def delete_proxy(
     
     db.delete(proxy)
     db.commit()
+    invalidate_proxies()
     
-    log(f"Deleted proxy {proxy_id}")
+    log(f"Deleted proxy {proxy_id}", event="admin_audit", sample=False, action="proxy_deleted", proxy_id=proxy_id)
     
     return {"message": "Proxy deleted successfully"}
 
@@ -184,9 +190,10 @@ def toggle_proxy(
     
     proxy.is_active = not proxy.is_active
     db.commit()
+    invalidate_proxies()
     
     status = "activated" if proxy.is_active else "deactivated"
-    log(f"Proxy {proxy_id} {status}")
+    log(f"Proxy {proxy_id} {status}", event="admin_audit", sample=False, action=f"proxy_{status}", proxy_id=proxy_id)
     
     return {"id": proxy.id, "is_active": proxy.is_active}
 
@@ -232,7 +239,10 @@ def create_access_token(
     db.commit()
     db.refresh(new_token)
     
-    log(f"Created new access token: {new_token.name or 'unnamed'}")
+    log(
+        f"Created new access token: {new_token.name or 'unnamed'}",
+        event="admin_audit", sample=False, action="access_token_created", token_id=new_token.id,
+    )
     
     return new_token
 
@@ -253,10 +263,12 @@ def delete_access_token(
     if not token:
         raise HTTPException(status_code=404, detail="Token not found")
     
+    token_value = token.token
     db.delete(token)
     db.commit()
+    invalidate_access_token(token_value)
     
-    log(f"Deleted access token {token_id}")
+    log(f"Deleted access token {token_id}", event="admin_audit", sample=False, action="access_token_deleted", token_id=token_id)
     
     return {"message": "Token deleted successfully"}
 
@@ -279,9 +291,10 @@ def toggle_access_token(
     
     token.is_active = not token.is_active
     db.commit()
+    invalidate_access_token(token.token)
     
     status = "activated" if token.is_active else "deactivated"
-    log(f"Access token {token_id} {status}")
+    log(f"Access token {token_id} {status}", event="admin_audit", sample=False, action=f"access_token_{status}", token_id=token_id)
     
     return {"id": token.id, "is_active": token.is_active}
 
@@ -308,7 +321,7 @@ def admin_login(
     # Генерируем токен сессии (в реальном приложении использовать JWT)
     session_token = generate_token()
     
-    log(f"Admin {credentials.username} logged in")
+    log(f"Admin {credentials.username} logged in", event="admin_audit", sample=False, action="admin_login", admin=credentials.username)
     
     return {
         "token": session_token,
@@ -343,6 +356,6 @@ def create_admin_user(
     db.add(new_user)
     db.commit()
     
-    log(f"Created new admin user: {username}")
+    log(f"Created new admin user: {username}", event="admin_audit", sample=False, action="admin_created", admin=username)
     
     return {"message": "Admin user created successfully"}
@@ -8,8 +8,9 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from sqlalchemy.orm import Session
 from .db import get_db
 from .models import Proxy, AccessToken, AdminUser
-from .auth import hash_password, verify_password, generate_token
+from .auth import hash_password, verify_password, generate_token, invalidate_access_token
 from .logic import log
+from .proxy_manager import invalidate_proxies, ProxyManager
 
 router = APIRouter(prefix="/admin", tags=["admin_ui"])
 
@@ -364,7 +365,7 @@ def admin_panel(request: Request):
 
 
 @router.post("/add-proxy")
-async def add_proxy_form(
+def add_proxy_form(
     proxy_url: str = Form(...),
     proxy_type: str = Form("http"),
     db: Session = Depends(get_db)
@@ -386,17 +387,19 @@ async def add_proxy_form(
         
         db.add(new_proxy)
         db.commit()
+        invalidate_proxies()
         
-        log(f"Created new proxy: {proxy_url}")
+        safe_host = ProxyManager.get_proxy_safe_host(proxy_url)
+        log(f"Created new proxy: {safe_host}", event="admin_audit", sample=False, action="proxy_created", proxy_id=new_proxy.id)
         return RedirectResponse(url="/admin?success=Proxy added", status_code=303)
     
     except Exception as e:
-        log(f"Error adding proxy: {e}")
+        log(f"Error adding proxy: {e}", level="error", event="admin_error", action="proxy_created")
         return RedirectResponse(url="/admin?error=Error adding proxy", status_code=303)
 
 
 @router.post("/create-token")
-async def create_token_form(
+def create_token_form(
     token_name: str = Form(...),
     db: Session = Depends(get_db)
 ):
@@ -417,18 +420,21 @@ async def create_token_form(
         db.commit()
         db.refresh(new_token)
         
-        log(f"Created new access token: {token_name}")
+        log(
+            f"Created new access token: {token_name}",
+            event="admin_audit", sample=False, action="access_token_created", token_id=new_token.id,
+        )
         
         # Перенаправляем обратно с токеном в URL (для отображения)
         return RedirectResponse(url=f"/admin?token={token_value}&name={token_name}", status_code=303)
     
     except Exception as e:
-        log(f"Error creating token: {e}")
+        log(f"Error creating token: {e}", level="error", event="admin_error", action="access_token_created")
         return RedirectResponse(url="/admin?error=Error creating token", status_code=303)
 
 
 @router.get("/api/tokens")
-async def get_tokens_api(db: Session = Depends(get_db)):
+def get_tokens_api(db: Session = Depends(get_db)):
     """
     API для получения списка токенов (для JavaScript).
     """
@@ -447,7 +453,7 @@ async def get_tokens_api(db: Session = Depends(get_db)):
 
 
 @router.get("/api/proxies")
-async def get_proxies_api(db: Session = Depends(get_db)):
+def get_proxies_api(db: Session = Depends(get_db)):
     """
     API для получения списка прокси (для JavaScript).
     """
@@ -466,7 +472,7 @@ async def get_proxies_api(db: Session = Depends(get_db)):
 
 
 @router.delete("/api/token/{token_id}")
-async def delete_token_api(token_id: int, db: Session = Depends(get_db)):
+def delete_token_api(token_id: int, db: Session = Depends(get_db)):
     """
     API для удаления токена (для JavaScript).
     """
@@ -474,15 +480,17 @@ async def delete_token_api(token_id: int, db: Session = Depends(get_db)):
     if not token:
         raise HTTPException(status_code=404, detail="Token not found")
     
+    token_value = token.token
     db.delete(token)
     db.commit()
+    invalidate_access_token(token_value)
     
-    log(f"Deleted access token {token_id}")
+    log(f"Deleted access token {token_id}", event="admin_audit", sample=False, action="access_token_deleted", token_id=token_id)
     return {"message": "Token deleted"}
 
 
 @router.delete("/api/proxy/{proxy_id}")
-async def delete_proxy_api(proxy_id: int, db: Session = Depends(get_db)):
+def delete_proxy_api(proxy_id: int, db: Session = Depends(get_db)):
     """
     API для удаления прокси (для JavaScript).
     """
@@ -492,6 +500,7 @@ async def delete_proxy_api(proxy_id: int, db: Session = Depends(get_db)):
     
     db.delete(proxy)
     db.commit()
+    invalidate_proxies()
     
-    log(f"Deleted proxy {proxy_id}")
+    log(f"Deleted proxy {proxy_id}", event="admin_audit", sample=False, action="proxy_deleted", proxy_id=proxy_id)
     return {"message": "Proxy deleted"}
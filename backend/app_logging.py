@@ -0,0 +1,232 @@
+# backend/app_logging.py
+"""
+Неблокирующий структурированный лог.
+
+log() не пишет в stdout сам: запись кладётся в ограниченную очередь,
+а форматирует и печатает её отдельный поток (QueueListener). Если очередь
+переполнена, запись отбрасывается, и запрос не ждёт stdout.
+
+- Уровни: debug / info / warning / error (LOG_LEVEL, по умолчанию info).
+  Запись ниже уровня отсекается до создания LogRecord.
+- Формат: JSON-строка на запись (LOG_FORMAT=json) или старый
+  «[HH:MM:SS] сообщение» (LOG_FORMAT=text) для локальной разработки.
+- Семплирование: не больше LOG_RATE_LIMIT записей одного типа за
+  LOG_RATE_WINDOW секунд. Тип — event (и площадка, если передано поле
+  venue), а без event — место вызова log() (файл:строка): в тексте
+  сообщения обычно подставлены значения, и каждая запись была бы уникальной.
+  Лимиты отдельных типов задаются в LOG_RATE_LIMITS="proxy_pick=1,upstream_error=5".
+  Первая запись после паузы несёт поле suppressed — сколько было пропущено.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info").upper()
+# json или text
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Сколько записей ждут печати; сверх этого записи отбрасываются
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Семплирование: не больше LOG_RATE_LIMIT записей одного типа за окно
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", "10"))
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "20"))
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """"proxy_pick=1,upstream_error=5" -> {"proxy_pick": 1, "upstream_error": 5}"""
+    limits = {}
+    for part in value.split(","):
+        name, _, limit = part.partition("=")
+        if name.strip() and limit.strip().isdigit():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+LOG_RATE_LIMITS = _parse_limits(os.environ.get("LOG_RATE_LIMITS", ""))
+
+_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись -> одна JSON-строка: ts, level, msg, event и поля вызова."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "msg": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            data["event"] = event
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            data.setdefault(key, value)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний вид лога: [HH:MM:SS] сообщение key=value."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        ts = datetime.fromtimestamp(record.created, timezone.utc).strftime("%H:%M:%S")
+        line = f"[{ts}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который при полной очереди считает потерю, а не падает."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Форматирует поток-слушатель, здесь запись только кладём в очередь
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSampler:
+    """Окно на тип записи: (начало окна, выпущено, пропущено)."""
+
+    def __init__(self, window: float = LOG_RATE_WINDOW, limit: int = LOG_RATE_LIMIT, limits: Optional[Dict[str, int]] = None):
+        self.window = window
+        self.limit = limit
+        self.limits = limits or {}
+        self._windows: Dict[str, Tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def allow(self, key: str, event: Optional[str] = None) -> Optional[int]:
+        """
+        None — запись пропускаем. Иначе число пропущенных записей этого
+        типа с прошлого окна (0, если не было). Лимит ищется по event.
+        """
+        limit = self.limits.get(event or key, self.limit)
+        if limit <= 0 or self.window <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            started, emitted, skipped = self._windows.get(key, (now, 0, 0))
+            carried = 0
+            if now - started >= self.window:
+                started, emitted, carried = now, 0, skipped
+                skipped = 0
+            if emitted >= limit:
+                self._windows[key] = (started, emitted, skipped + 1)
+                self.suppressed += 1
+                return None
+            if len(self._windows) > 10000:
+                self._prune(now)
+            self._windows[key] = (started, emitted + 1, skipped)
+            return carried
+
+    def _prune(self, now: float) -> None:
+        """Убрать закрытые окна без пропусков, чтобы словарь не рос бесконечно."""
+        stale = [
+            k for k, (started, _, skipped) in self._windows.items()
+            if now - started >= self.window and not skipped
+        ]
+        for k in stale:
+            del self._windows[k]
+
+
+logger = logging.getLogger("hydra")
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+logger.propagate = False
+
+_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_handler = DroppingQueueHandler(_queue)
+_stream = logging.StreamHandler(sys.stdout)
+_stream.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+_listener = QueueListener(_queue, _stream)
+sampler = LogSampler(limits=LOG_RATE_LIMITS)
+_started = False
+
+
+def setup_logging() -> None:
+    """Подключить очередь и запустить поток печати (один раз, при импорте)."""
+    global _started
+    if _started:
+        return
+    logger.addHandler(_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+    _started = True
+
+
+def stop_logging() -> None:
+    """Допечатать очередь и остановить поток (при выходе процесса)."""
+    global _started
+    if not _started:
+        return
+    _started = False
+    logger.removeHandler(_handler)
+    _listener.stop()
+
+
+def log(
+    msg: str,
+    level: str = "info",
+    event: Optional[str] = None,
+    exc_info: bool = False,
+    sample: bool = True,
+    **fields,
+) -> None:
+    """
+    Записать сообщение. event — тип записи для семплирования и поиска,
+    fields — дополнительные поля JSON-записи (venue, proxy, status, ...).
+    sample=False — запись не семплируется (действия в админке).
+    """
+    levelno = _LEVELS.get(level, logging.INFO)
+    if not logger.isEnabledFor(levelno):
+        return
+    if sample:
+        if event is None:
+            caller = sys._getframe(1)
+            key = f"{caller.f_code.co_filename}:{caller.f_lineno}"
+        else:
+            key = f"{event}:{fields.get('venue', '')}"
+        suppressed = sampler.allow(key, event)
+        if suppressed is None:
+            return
+        if suppressed:
+            fields["suppressed"] = suppressed
+    logger.log(levelno, msg, exc_info=exc_info, extra={"event": event, "fields": fields})
+
+
+def stats() -> Dict[str, int]:
+    return {
+        "queued": _queue.qsize(),
+        "dropped": _handler.dropped,
+        "suppressed": sampler.suppressed,
+    }
+
+
+setup_logging()
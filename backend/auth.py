@@ -1,19 +1,43 @@
 # backend/auth.py
 """
 Модуль для аутентификации и работы с токенами доступа.
+
+Проверенные токены кэшируются в памяти процесса на ACCESS_TOKEN_CACHE_TTL
+секунд. Кэш у каждого воркера свой: invalidate_access_token из админки
+очищает только воркер, обработавший запрос, остальные увидят выключенный
+токен не позже чем через TTL — поэтому TTL держим коротким.
 """
 
+import asyncio
+import os
 import secrets
 import hashlib
-from datetime import datetime
-from typing import Optional
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Tuple
 from fastapi import HTTPException, Depends, Header
+from sqlalchemy import update, bindparam, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from .models import AccessToken, AdminUser
-from .db import get_db
+from .db import get_db, get_async_db, SessionLocal
 from .logic import log
 
 
+# Сколько секунд проверенный токен живёт в кэше (столько же выключенный
+# в админке токен ещё принимают другие воркеры)
+ACCESS_TOKEN_CACHE_TTL = float(os.environ.get("ACCESS_TOKEN_CACHE_TTL", "10"))
+# Как часто сбрасываем last_used_at в БД (секунды)
+LAST_USED_FLUSH_INTERVAL = float(os.environ.get("LAST_USED_FLUSH_INTERVAL", "30"))
+
+# token -> (AccessToken без сессии, время истечения)
+_TOKEN_CACHE: Dict[str, Tuple[AccessToken, float]] = {}
+# access_tokens.id -> последнее время использования, ещё не записанное в БД
+_PENDING_LAST_USED: Dict[int, datetime] = {}
+# Оба словаря меняются на event loop (verify_access_token асинхронная);
+# из потоков админки — только одиночные pop/clear кэша, они атомарны под GIL
+
+
 def generate_token(length: int = 32) -> str:
     """Генерировать случайный токен доступа."""
     return "hydra_" + secrets.token_urlsafe(length)
@@ -29,13 +53,14 @@ def verify_password(password: str, password_hash: str) -> bool:
     return hash_password(password) == password_hash
 
 
-def verify_access_token(
+async def verify_access_token(
     authorization: Optional[str] = Header(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> AccessToken:
     """
     Зависимость FastAPI для проверки токена доступа.
     Используется в защищенных эндпоинтах.
+    Асинхронная: попадание в кэш не трогает БД, промах идёт через AsyncSession.
     
     Ожидает заголовок: Authorization: Bearer {token}
     """
@@ -48,23 +73,98 @@ def verify_access_token(
         raise HTTPException(status_code=401, detail="Invalid authorization header format")
     
     token = parts[1]
-    
-    # Ищем токен в БД
-    db_token = db.query(AccessToken).filter(
-        AccessToken.token == token,
-        AccessToken.is_active == True
-    ).first()
-    
-    if not db_token:
-        raise HTTPException(status_code=401, detail="Invalid or inactive token")
-    
-    # Обновляем время последнего использования
-    db_token.last_used_at = datetime.utcnow()
-    db.commit()
-    
+    now = time.monotonic()
+
+    # Сначала смотрим в кэш проверенных токенов
+    cached = _TOKEN_CACHE.get(token)
+    if cached is not None and cached[1] > now:
+        db_token = cached[0]
+    else:
+        # Ищем токен в БД
+        result = await db.execute(
+            select(AccessToken).where(
+                AccessToken.token == token,
+                AccessToken.is_active == True
+            )
+        )
+        db_token = result.scalars().first()
+
+        if not db_token:
+            raise HTTPException(status_code=401, detail="Invalid or inactive token")
+
+        # Отвязываем от сессии, чтобы объект можно было отдавать из кэша
+        db.expunge(db_token)
+        _TOKEN_CACHE[token] = (db_token, now + ACCESS_TOKEN_CACHE_TTL)
+
+    # Время последнего использования пишем пачкой в flush_last_used()
+    _PENDING_LAST_USED[db_token.id] = datetime.now(timezone.utc)
+
     return db_token
 
 
+def invalidate_access_token(token: Optional[str] = None) -> None:
+    """
+    Убрать токен из кэша (после выключения или удаления в админке).
+    Без аргумента очищает весь кэш.
+    """
+    if token is None:
+        _TOKEN_CACHE.clear()
+    else:
+        _TOKEN_CACHE.pop(token, None)
+
+
+def _write_last_used(pending: Dict[int, datetime]) -> int:
+    """Пакетный UPDATE last_used_at (синхронно, зовётся через asyncio.to_thread)."""
+    db = SessionLocal()
+    try:
+        # Core UPDATE: удалённые за это время токены просто не обновятся
+        table = AccessToken.__table__
+        db.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(last_used_at=bindparam("b_ts")),
+            [{"b_id": token_id, "b_ts": ts} for token_id, ts in pending.items()],
+        )
+        db.commit()
+        return len(pending)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def flush_last_used() -> int:
+    """
+    Записать накопленные last_used_at одним пакетным UPDATE.
+    Накопленное забираем на event loop, сам UPDATE идёт в потоке.
+    Если UPDATE не прошёл, значения возвращаются в очередь до следующего
+    сброса (более свежие, накопленные за это время, не затираются).
+    Возвращает количество обновлённых токенов.
+    """
+    global _PENDING_LAST_USED
+    if not _PENDING_LAST_USED:
+        return 0
+    pending, _PENDING_LAST_USED = _PENDING_LAST_USED, {}
+    try:
+        return await asyncio.to_thread(_write_last_used, pending)
+    except Exception as e:
+        for token_id, ts in pending.items():
+            _PENDING_LAST_USED.setdefault(token_id, ts)
+        log(f"Error flushing last_used_at: {e}", level="error", event="last_used_flush_error")
+        return 0
+
+
+async def last_used_flush_loop() -> None:
+    """Периодически сбрасывать last_used_at в БД. Запускается в startup_event."""
+    while True:
+        await asyncio.sleep(LAST_USED_FLUSH_INTERVAL)
+        try:
+            await flush_last_used()
+        except Exception as e:
+            log(f"Error in last_used_at flush loop: {e}", level="error")
+
+
 def verify_admin(
     authorization: Optional[str] = Header(None),
     db: Session = Depends(get_db)
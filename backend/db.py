@@ -1,5 +1,7 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # В Render мы положим переменную окружения DATABASE_URL.
@@ -34,3 +36,47 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ============= Асинхронный доступ к БД (горячий путь /api/prices) =============
+
+def _make_async_url(url: str):
+    """
+    postgres:// / postgresql:// / postgresql+psycopg2:// -> postgresql+asyncpg://
+    sslmode asyncpg не понимает — переносим его в connect_args["ssl"].
+    sqlite:// -> sqlite+aiosqlite:// (локальная разработка).
+    """
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    parsed = make_url(url)
+    connect_args = {}
+    if parsed.get_backend_name() == "postgresql":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+        sslmode = parsed.query.get("sslmode")
+        if sslmode:
+            parsed = parsed.difference_update_query(["sslmode"])
+            connect_args["ssl"] = sslmode
+    elif parsed.get_backend_name() == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed, connect_args
+
+
+_async_url, _async_connect_args = _make_async_url(DATABASE_URL)
+
+async_engine = create_async_engine(
+    _async_url,
+    pool_pre_ping=True,
+    connect_args=_async_connect_args,
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+async def get_async_db():
+    """FastAPI зависимость с AsyncSession — не блокирует event loop."""
+    async with AsyncSessionLocal() as db:
+        yield db
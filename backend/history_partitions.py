@@ -0,0 +1,282 @@
+# backend/history_partitions.py
+"""
+Партиционирование price_history по времени (только PostgreSQL).
+
+Таблица price_history — PARTITION BY RANGE (created_at), партиция на сутки
+(или на час, PRICE_HISTORY_PARTITION_INTERVAL=hour) с именем
+price_history_pYYYYMMDD / price_history_pYYYYMMDDHH.
+
+- Партиции создаются заранее на PRICE_HISTORY_PARTITIONS_AHEAD интервалов вперёд.
+- Очистка старых данных — DROP целой партиции, а не DELETE по строкам:
+  без раздувания таблицы и индексов и без долгих блокировок.
+- Строки вне созданных диапазонов (сдвиг часов, опоздавшее создание партиций)
+  попадают в DEFAULT-партицию и не роняют пакетную запись истории; при создании
+  партиции они переносятся в неё.
+- Старая (непартиционированная) таблица один раз переносится при старте.
+- DDL партиций выполняется под pg_advisory_xact_lock: воркеры не мешают друг другу.
+
+На других СУБД (SQLite в локальной разработке) остаётся обычный DELETE.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .logic import log
+from .models import PriceHistory
+
+
+PRICE_HISTORY_TABLE = PriceHistory.__tablename__
+# "day" или "hour"
+PRICE_HISTORY_PARTITION_INTERVAL = os.environ.get("PRICE_HISTORY_PARTITION_INTERVAL", "day")
+# Сколько партиций держим созданными наперёд
+PRICE_HISTORY_PARTITIONS_AHEAD = int(os.environ.get("PRICE_HISTORY_PARTITIONS_AHEAD", "3"))
+# Сколько часов храним сырую историю
+PRICE_HISTORY_RETENTION_HOURS = float(os.environ.get("PRICE_HISTORY_RETENTION_HOURS", "48"))
+
+DEFAULT_PARTITION = f"{PRICE_HISTORY_TABLE}_default"
+# Ключ pg_advisory_xact_lock для DDL партиций (миграции при старте — см. migrations.SCHEMA_LOCK_KEY)
+PARTITIONS_LOCK_KEY = 0x48594401
+
+
+def _step() -> timedelta:
+    return timedelta(hours=1) if PRICE_HISTORY_PARTITION_INTERVAL == "hour" else timedelta(days=1)
+
+
+def _name_format() -> str:
+    return "%Y%m%d%H" if PRICE_HISTORY_PARTITION_INTERVAL == "hour" else "%Y%m%d"
+
+
+def _floor(ts: datetime) -> datetime:
+    """Начало интервала партиции (UTC), в который попадает ts."""
+    ts = ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    if PRICE_HISTORY_PARTITION_INTERVAL == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{PRICE_HISTORY_TABLE}_p{start.strftime(_name_format())}"
+
+
+def parse_partition_name(name: str) -> Optional[datetime]:
+    """price_history_p20260101 -> начало интервала, None для чужих имён."""
+    prefix = f"{PRICE_HISTORY_TABLE}_p"
+    if not name.startswith(prefix):
+        return None
+    suffix = name[len(prefix):]
+    for fmt in ("%Y%m%d%H", "%Y%m%d"):
+        if len(suffix) == len(datetime(2000, 1, 1).strftime(fmt)):
+            try:
+                return datetime.strptime(suffix, fmt).replace(tzinfo=timezone.utc)
+            except ValueError:
+                return None
+    return None
+
+
+def is_postgres(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def _relkind(conn, table: str) -> Optional[str]:
+    """'p' — партиционированная, 'r' — обычная таблица, None — нет таблицы."""
+    return conn.execute(
+        text(
+            "SELECT c.relkind FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = :name AND n.nspname = current_schema()"
+        ),
+        {"name": table},
+    ).scalar()
+
+
+def list_partitions(conn) -> List[str]:
+    return list(conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :parent AND c.relkind = 'r' ORDER BY c.relname"
+        ),
+        {"parent": PRICE_HISTORY_TABLE},
+    ).scalars())
+
+
+def _lock_partitions(conn) -> None:
+    """Один DDL партиций за раз на всю БД (до конца транзакции)."""
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITIONS_LOCK_KEY})
+
+
+def _ensure_default_partition(conn) -> bool:
+    if _relkind(conn, DEFAULT_PARTITION):
+        return False
+    conn.execute(text(
+        f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PRICE_HISTORY_TABLE}" DEFAULT'
+    ))
+    return True
+
+
+def _create_partition(conn, start: datetime) -> bool:
+    name = partition_name(start)
+    end = start + _step()
+    exists = _relkind(conn, name)
+    if exists:
+        return False
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    params = {"start": start, "end": end}
+    in_default = _relkind(conn, DEFAULT_PARTITION) and conn.execute(
+        text(
+            f'SELECT 1 FROM "{DEFAULT_PARTITION}" '
+            "WHERE created_at >= :start AND created_at < :end LIMIT 1"
+        ),
+        params,
+    ).scalar()
+    if not in_default:
+        conn.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{PRICE_HISTORY_TABLE}" {bounds}'))
+        return True
+
+    # PostgreSQL не создаст партицию, пока пересекающиеся строки лежат в DEFAULT:
+    # создаём таблицу отдельно, переносим строки и подключаем её
+    conn.execute(text(f'CREATE TABLE "{name}" (LIKE "{PRICE_HISTORY_TABLE}" INCLUDING DEFAULTS)'))
+    moved = conn.execute(
+        text(
+            f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" '
+            "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            f'INSERT INTO "{name}" SELECT * FROM moved'
+        ),
+        params,
+    ).rowcount
+    conn.execute(text(f'ALTER TABLE "{PRICE_HISTORY_TABLE}" ATTACH PARTITION "{name}" {bounds}'))
+    log(f"Price history partitions: moved {moved} rows from {DEFAULT_PARTITION} to {name}")
+    return True
+
+
+def ensure_partitions(engine: Engine, since: Optional[datetime] = None) -> int:
+    """
+    Создать партиции от since (по умолчанию — текущий интервал)
+    до PRICE_HISTORY_PARTITIONS_AHEAD интервалов вперёд.
+    Возвращает число созданных партиций.
+    """
+    if not is_postgres(engine):
+        return 0
+    now = _floor(datetime.now(timezone.utc))
+    start = _floor(since) if since is not None else now
+    end = now + _step() * PRICE_HISTORY_PARTITIONS_AHEAD
+    created = 0
+    with engine.begin() as conn:
+        if _relkind(conn, PRICE_HISTORY_TABLE) != "p":
+            return 0
+        _lock_partitions(conn)
+        _ensure_default_partition(conn)
+        while start <= end:
+            if _create_partition(conn, start):
+                created += 1
+            start += _step()
+    if created:
+        log(f"Price history partitions: created {created}")
+    return created
+
+
+def drop_old_partitions(engine: Engine, retention_hours: float = PRICE_HISTORY_RETENTION_HOURS) -> List[str]:
+    """
+    Удалить партиции, все строки которых старше retention_hours
+    (и такие же строки из DEFAULT-партиции). Возвращает имена удалённых партиций.
+    """
+    if not is_postgres(engine):
+        return []
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=retention_hours)
+    dropped = []
+    with engine.begin() as conn:
+        if _relkind(conn, PRICE_HISTORY_TABLE) != "p":
+            return []
+        _lock_partitions(conn)
+        if _relkind(conn, DEFAULT_PARTITION):
+            conn.execute(
+                text(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at < :cutoff'),
+                {"cutoff": cutoff},
+            )
+        for name in list_partitions(conn):
+            start = parse_partition_name(name)
+            if start is None:
+                continue
+            # Конец интервала берём по длине суффикса: у часовых партиций он длиннее
+            suffix_len = len(name) - len(f"{PRICE_HISTORY_TABLE}_p")
+            end = start + (timedelta(hours=1) if suffix_len == 10 else timedelta(days=1))
+            if end <= cutoff:
+                conn.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+                dropped.append(name)
+    if dropped:
+        log(f"Price history partitions: dropped {', '.join(dropped)}")
+    return dropped
+
+
+def migrate_to_partitions(engine: Engine) -> bool:
+    """
+    Перевести существующую обычную price_history на партиции.
+    Вызывается до create_all. Данные (не старше срока хранения) копируются,
+    старая таблица удаляется. Возвращает True, если миграция была.
+    """
+    if not is_postgres(engine):
+        return False
+    with engine.begin() as conn:
+        _lock_partitions(conn)
+        # Проверяем под блокировкой: таблицу мог уже перенести другой воркер
+        if _relkind(conn, PRICE_HISTORY_TABLE) != "r":
+            return False
+
+        legacy = f"{PRICE_HISTORY_TABLE}_legacy"
+        log("Price history partitions: migrating price_history to partitioned table")
+        conn.execute(text(f'ALTER TABLE "{PRICE_HISTORY_TABLE}" RENAME TO "{legacy}"'))
+        # Индексы и PK старой таблицы освобождают имена для новой
+        for (index_name,) in conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :t AND schemaname = current_schema()"),
+            {"t": legacy},
+        ).all():
+            conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+
+        # Последовательность id тоже переименовываем — новая таблица создаст свою
+        sequence = conn.execute(
+            text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": legacy}
+        ).scalar()
+        if sequence:
+            conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO \"{legacy}_id_seq\""))
+
+        PriceHistory.__table__.create(conn)
+
+        bounds: Tuple[Optional[datetime], Optional[datetime]] = conn.execute(
+            text(f'SELECT min(created_at), max(created_at) FROM "{legacy}"')
+        ).one()
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=PRICE_HISTORY_RETENTION_HOURS)
+        start = _floor(max(bounds[0], cutoff)) if bounds[0] is not None else _floor(cutoff)
+        end = _floor(datetime.now(timezone.utc)) + _step() * PRICE_HISTORY_PARTITIONS_AHEAD
+        if bounds[1] is not None:
+            end = max(end, _floor(bounds[1]))
+        while start <= end:
+            _create_partition(conn, start)
+            start += _step()
+        _ensure_default_partition(conn)
+
+        columns = ", ".join(c.name for c in PriceHistory.__table__.columns)
+        copied = conn.execute(
+            text(
+                f'INSERT INTO "{PRICE_HISTORY_TABLE}" ({columns}) '
+                f'SELECT {columns} FROM "{legacy}" WHERE created_at >= :cutoff'
+            ),
+            {"cutoff": cutoff},
+        ).rowcount
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{PRICE_HISTORY_TABLE}', 'id'), "
+            f'COALESCE((SELECT max(id) FROM "{PRICE_HISTORY_TABLE}"), 0) + 1, false)'
+        ))
+        conn.execute(text(f'DROP TABLE "{legacy}"'))
+    log(f"Price history partitions: migrated {copied} rows")
+    return True
+
+
+def maintain_partitions(engine: Engine) -> None:
+    """Создать партиции наперёд и удалить устаревшие (раз в час из main.py)."""
+    ensure_partitions(engine)
+    drop_old_partitions(engine)
@@ -0,0 +1,207 @@
+# backend/http_pool.py
+"""
+Пул httpx.AsyncClient, по одному клиенту на каждый прокси.
+
+Клиенты переиспользуют TCP/TLS (и SOCKS) соединения между запросами,
+поэтому каждая котировка больше не платит за новый handshake.
+Пул создаётся при старте приложения и закрывается при остановке.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import httpx
+
+from .logic import log
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Настройки пула (можно переопределить через переменные окружения)
+HTTP_POOL_MAX_CLIENTS = int(os.environ.get("HTTP_POOL_MAX_CLIENTS", "64"))
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP_POOL_IDLE_TTL = float(os.environ.get("HTTP_POOL_IDLE_TTL", "300"))
+# Сколько секунд вытесненный клиент ещё живёт до закрытия: запросы, уже
+# получившие его, успевают завершиться (больше любого таймаута запроса)
+HTTP_POOL_CLOSE_GRACE = float(os.environ.get("HTTP_POOL_CLOSE_GRACE", "60"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "10"))
+
+# Ключ для прямого соединения без прокси
+DIRECT = ""
+
+
+class HttpClientPool:
+    """
+    Пул клиентов, ключ — URL прокси.
+
+    - keep-alive и HTTP/2 (если установлен пакет h2),
+    - ограничение числа соединений на клиент,
+    - ограничение числа клиентов (вытесняется самый давно неиспользуемый),
+    - закрытие клиентов, простаивающих дольше idle_ttl.
+
+    Вытесненный клиент не закрывается сразу — им может пользоваться запрос,
+    который уже в полёте. Он уходит в список retired и закрывается через
+    close_grace секунд.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = HTTP_POOL_MAX_CLIENTS,
+        idle_ttl: float = HTTP_POOL_IDLE_TTL,
+        close_grace: float = HTTP_POOL_CLOSE_GRACE,
+    ):
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.close_grace = close_grace
+        # proxy_url -> (client, last_used_monotonic)
+        self._clients: "OrderedDict[str, Tuple[httpx.AsyncClient, float]]" = OrderedDict()
+        # Вытесненные клиенты: (client, когда вытеснен) — закрываются после close_grace
+        self._retired: List[Tuple[httpx.AsyncClient, float]] = []
+        self._closed = False
+        self._evict_task: Optional[asyncio.Task] = None
+
+    def _create_client(self, proxy_url: Optional[str]) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+        )
+        return httpx.AsyncClient(
+            proxy=proxy_url or None,
+            timeout=HTTP_TIMEOUT,
+            limits=limits,
+            http2=HTTP2_AVAILABLE,
+        )
+
+    def get_client(self, proxy_url: Optional[str] = None) -> httpx.AsyncClient:
+        """
+        Получить клиента для прокси (или для прямого соединения).
+        Клиент принадлежит пулу — закрывать его нельзя.
+        """
+        if self._closed:
+            raise RuntimeError("HTTP client pool is closed")
+
+        key = proxy_url or DIRECT
+        now = time.monotonic()
+
+        entry = self._clients.get(key)
+        if entry is not None:
+            client = entry[0]
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            return client
+
+        client = self._create_client(proxy_url)
+        self._clients[key] = (client, now)
+
+        # Ограничиваем размер пула: вытесняем самых старых (закроются позже)
+        while len(self._clients) > self.max_clients:
+            _, (old_client, _) = self._clients.popitem(last=False)
+            self._retired.append((old_client, now))
+
+        return client
+
+    async def _close_retired(self, now: float) -> int:
+        """Закрыть вытесненных клиентов, у которых вышел close_grace."""
+        expired = [client for client, retired_at in self._retired if now - retired_at >= self.close_grace]
+        if not expired:
+            return 0
+        self._retired = [item for item in self._retired if now - item[1] < self.close_grace]
+        for client in expired:
+            try:
+                await client.aclose()
+            except Exception as e:
+                log(f"HTTP pool: close error: {e}", level="warning")
+        return len(expired)
+
+    async def evict_idle(self) -> int:
+        """
+        Вытеснить клиентов, которые простаивают дольше idle_ttl,
+        и закрыть ранее вытесненных, у которых вышел close_grace.
+        """
+        now = time.monotonic()
+        stale = [
+            key for key, (_, last_used) in self._clients.items()
+            if now - last_used > self.idle_ttl
+        ]
+        for key in stale:
+            client, _ = self._clients.pop(key)
+            self._retired.append((client, now))
+        if stale:
+            log(f"HTTP pool: evicted {len(stale)} idle clients")
+        await self._close_retired(now)
+        return len(stale)
+
+    def start(self) -> None:
+        """Запустить фоновое вытеснение простаивающих клиентов."""
+        async def evict_loop():
+            while True:
+                await asyncio.sleep(max(min(self.idle_ttl / 2, self.close_grace), 1.0))
+                try:
+                    await self.evict_idle()
+                except Exception as e:
+                    log(f"HTTP pool: evict error: {e}", level="error")
+
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(evict_loop())
+
+    async def close(self) -> None:
+        """Закрыть все клиенты пула."""
+        self._closed = True
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+        clients = [client for client, _ in self._clients.values()]
+        clients += [client for client, _ in self._retired]
+        self._clients.clear()
+        self._retired = []
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                log(f"HTTP pool: close error: {e}", level="warning")
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+_POOL: Optional[HttpClientPool] = None
+
+
+def init_http_pool() -> HttpClientPool:
+    """Создать глобальный пул (вызывается в startup_event)."""
+    global _POOL
+    if _POOL is None:
+        _POOL = HttpClientPool()
+        _POOL.start()
+        log(f"HTTP pool: started (http2={HTTP2_AVAILABLE})")
+    return _POOL
+
+
+def get_http_pool() -> HttpClientPool:
+    """
+    Получить глобальный пул.
+    Если приложение стартовало без startup_event (скрипты, тесты) — создаём лениво.
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = HttpClientPool()
+    return _POOL
+
+
+async def close_http_pool() -> None:
+    """Закрыть глобальный пул (вызывается в shutdown_event)."""
+    global _POOL
+    if _POOL is not None:
+        await _POOL.close()
+        _POOL = None
+        log("HTTP pool: closed")
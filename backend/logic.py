@@ -1,15 +1,23 @@
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Iterable, Tuple
 
-from datetime import datetime
+from datetime import datetime, timezone
 
 import cloudscraper
+from sqlalchemy import func, insert
 
-
-def log(msg: str) -> None:
-    """Простой лог — увидишь его в LOGS на Render."""
-    ts = datetime.utcnow().strftime("%H:%M:%S")
-    print(f"[{ts}] {msg}", flush=True)
+from .db import SessionLocal
+from .models import CoinGeckoCoin, Token
+from .rate_limiter import venue_scheduler, set_background_priority
+from .metrics import observe_upstream, upstream_outcome
+# log() живёт в app_logging; отсюда его импортируют остальные модули
+from .app_logging import log
 
 
 # === HTTP клиент с cloudscraper, как в core.py ===
@@ -22,6 +30,41 @@ http_client = cloudscraper.create_scraper(
     }
 )
 
+def scheduled_get(venue: str, url: str, **kwargs):
+    """
+    GET через cloudscraper с ожиданием токена площадки в venue_scheduler
+    и отчётом о коде ответа (429/Retry-After урезают лимит) и в метрики.
+    """
+    venue_scheduler.acquire_blocking(venue)
+    started = time.monotonic()
+    try:
+        r = http_client.get(url, **kwargs)
+    except Exception:
+        observe_upstream(venue, time.monotonic() - started, "error")
+        raise
+    observe_upstream(venue, time.monotonic() - started, upstream_outcome(r.status_code))
+    venue_scheduler.feedback(venue, r.status_code, r.headers.get("Retry-After"))
+    return r
+
+
+# Блокирующие вызовы cloudscraper не должны занимать event loop и общий
+# пул потоков Starlette — у них свой ограниченный пул
+BLOCKING_HTTP_WORKERS = int(os.environ.get("BLOCKING_HTTP_WORKERS", "8"))
+blocking_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_HTTP_WORKERS, thread_name_prefix="blocking-http"
+)
+
+
+async def run_blocking(fn, *args):
+    """
+    Выполнить синхронную функцию (cloudscraper и т.п.) в blocking_executor.
+    Контекст (приоритет запроса для venue_scheduler) передаётся в поток.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_executor, functools.partial(ctx.run, fn, *args))
+
+
 # === Dataclass для конфигурации L/M ===
 
 
@@ -31,114 +74,299 @@ class PairConfigLM:
     cg_id: Optional[str] = None
 
 
-# === Работа с CoinGecko (кэш списка монет) ===
+# === Работа с CoinGecko (список монет в БД + индекс по символу) ===
 
-_CG_COINS_LIST = []
+# Как часто обновляем список монет и через сколько повторяем после ошибки (секунды)
+CG_COINS_REFRESH_INTERVAL = float(os.environ.get("CG_COINS_REFRESH_INTERVAL", "86400"))
+CG_COINS_RETRY_INTERVAL = float(os.environ.get("CG_COINS_RETRY_INTERVAL", "300"))
+
+# SYMBOL -> id монет с этим символом, лучший кандидат первым
+_CG_SYMBOL_INDEX: Dict[str, List[str]] = {}
 _CG_LIST_LOADED = False
-_CG_SYMBOL_INDEX: Dict[str, str] = {}
 
+_CG_BAD_WORDS = (
+    "wrapped", "bridge", "bridged", "staked",
+    "wormhole", "peg", "binance", "binance-peg",
+    "weth", "leveraged", "bull", "bear",
+)
+
+
+def _score_cg_candidate(symbol: str, cid: str, name: str) -> float:
+    """Оценка кандидата для символа — логика похожа на твою в core.py."""
+    sym_lower = symbol.lower()
+    cid_l = cid.lower()
+    name_l = name.lower()
+
+    score = 0.0
 
-def _ensure_cg_coins_list() -> None:
-    """Один раз за запуск грузим полный список CoinGecko."""
-    global _CG_COINS_LIST, _CG_LIST_LOADED
+    if cid_l == sym_lower:
+        score += 100.0
 
-    if _CG_LIST_LOADED:
-        return
+    if name_l == sym_lower:
+        score += 50.0
 
+    if name_l.startswith(sym_lower):
+        score += 25.0
+
+    if "-" not in cid and " " not in cid:
+        score += 10.0
+
+    if any(w in cid_l for w in _CG_BAD_WORDS) or any(
+        w in name_l for w in _CG_BAD_WORDS
+    ):
+        score -= 30.0
+
+    score -= len(cid) * 0.01
+    return score
+
+
+def _build_cg_index(coins: Iterable[Tuple[str, str, str]]) -> Dict[str, List[str]]:
+    """(id, symbol, name) -> {SYMBOL: [id лучшего кандидата, ...]}"""
+    scored: Dict[str, List[Tuple[float, str]]] = {}
+    for cid, sym, name in coins:
+        sym = (sym or "").upper()
+        if not cid or not sym:
+            continue
+        scored.setdefault(sym, []).append(
+            (_score_cg_candidate(sym, cid, name or ""), cid)
+        )
+    return {
+        sym: [cid for _, cid in sorted(items, key=lambda x: x[0], reverse=True)]
+        for sym, items in scored.items()
+    }
+
+
+def load_cg_coins_from_db() -> Optional[datetime]:
+    """
+    Построить индекс из таблицы coingecko_coins.
+    Возвращает время последнего обновления списка (None, если таблица пуста).
+    """
+    global _CG_SYMBOL_INDEX, _CG_LIST_LOADED
+
+    db = SessionLocal()
     try:
-        resp = http_client.get(
+        rows = db.query(
+            CoinGeckoCoin.id, CoinGeckoCoin.symbol, CoinGeckoCoin.name
+        ).all()
+        updated_at = db.query(func.max(CoinGeckoCoin.updated_at)).scalar()
+    finally:
+        db.close()
+
+    # SQLite (и часть драйверов) отдают время без зоны — в БД оно в UTC
+    if updated_at is not None and updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+
+    if rows:
+        _CG_SYMBOL_INDEX = _build_cg_index(rows)
+        _CG_LIST_LOADED = True
+        log(f"CoinGecko list: {len(rows)} coins from DB", event="cg_list_loaded", source="db", coins=len(rows))
+    return updated_at
+
+
+def refresh_cg_coins_list() -> bool:
+    """
+    Скачать полный список CoinGecko, сохранить в БД и пересобрать индекс.
+    Выполняется в фоне (в потоке), запросы к API его не ждут.
+    При ошибке старый список остаётся в силе.
+    """
+    global _CG_SYMBOL_INDEX, _CG_LIST_LOADED
+
+    try:
+        resp = scheduled_get(
+            "coingecko",
             "https://api.coingecko.com/api/v3/coins/list",
             timeout=20.0,
         )
         if resp.status_code != 200:
-            log(f"CoinGecko list: HTTP {resp.status_code}: {str(resp.text)[:150]}")
-            _CG_COINS_LIST = []
-            _CG_LIST_LOADED = True
-            return
+            log(
+                f"CoinGecko list: HTTP {resp.status_code}: {str(resp.text)[:150]}",
+                level="warning", event="coingecko_http_error", status=resp.status_code,
+            )
+            return False
 
         data = resp.json()
-        if isinstance(data, list):
-            _CG_COINS_LIST = data
-        else:
-            _CG_COINS_LIST = []
-        _CG_LIST_LOADED = True
-        log(f"CoinGecko list: loaded {len(_CG_COINS_LIST)} coins")
+        if not isinstance(data, list) or not data:
+            log("CoinGecko list: empty response", level="warning", event="coingecko_empty")
+            return False
     except Exception as e:
-        log(f"CoinGecko list: error: {e}")
-        _CG_COINS_LIST = []
-        _CG_LIST_LOADED = True
+        log(f"CoinGecko list: error: {e}", level="warning", event="coingecko_error")
+        return False
+
+    coins = {}
+    for item in data:
+        cid = str(item.get("id") or "")
+        if cid:
+            coins[cid] = (
+                cid,
+                str(item.get("symbol") or "")[:128],
+                str(item.get("name") or "")[:512],
+            )
 
+    db = SessionLocal()
+    try:
+        db.query(CoinGeckoCoin).delete()
+        db.execute(
+            insert(CoinGeckoCoin),
+            [{"id": cid, "symbol": sym, "name": name} for cid, sym, name in coins.values()],
+        )
+        db.commit()
+    except Exception as e:
+        log(f"CoinGecko list: DB save error: {e}", level="error", event="cg_list_db_error")
+        db.rollback()
+    finally:
+        db.close()
 
-def _pick_coingecko_id_for_symbol(symbol: str) -> Optional[str]:
-    """Подбор id по символу — логика похожа на твою в core.py."""
-    global _CG_SYMBOL_INDEX
+    _CG_SYMBOL_INDEX = _build_cg_index(coins.values())
+    _CG_LIST_LOADED = True
+    log(f"CoinGecko list: loaded {len(coins)} coins", event="cg_list_loaded", source="api", coins=len(coins))
+    return True
 
-    symbol = (symbol or "").strip().upper()
-    if not symbol:
-        return None
 
-    if symbol in _CG_SYMBOL_INDEX:
-        return _CG_SYMBOL_INDEX[symbol]
+async def cg_coins_refresh_loop() -> None:
+    """
+    Фоновое обновление списка монет. Запускается в startup_event.
+    Сначала поднимаем индекс из БД, из сети качаем только если список устарел.
+    """
+    set_background_priority()
+    try:
+        updated_at = await asyncio.to_thread(load_cg_coins_from_db)
+    except Exception as e:
+        log(f"CoinGecko list: DB load error: {e}", level="error", event="cg_list_db_error")
+        updated_at = None
 
-    _ensure_cg_coins_list()
-    if not _CG_COINS_LIST:
-        return None
+    delay = 0.0
+    if updated_at is not None:
+        try:
+            age = (datetime.now(timezone.utc) - updated_at).total_seconds()
+            delay = max(CG_COINS_REFRESH_INTERVAL - age, 0.0)
+        except (TypeError, ValueError) as e:
+            # Непонятное время обновления — просто обновляем список сразу
+            log(f"CoinGecko list: bad updated_at {updated_at!r}: {e}", level="warning", event="cg_list_db_error")
+            delay = 0.0
 
-    sym_lower = symbol.lower()
-    best_id: Optional[str] = None
-    best_score: Optional[float] = None
+    while True:
+        await asyncio.sleep(delay)
+        ok = await run_blocking(refresh_cg_coins_list)
+        delay = CG_COINS_REFRESH_INTERVAL if ok else CG_COINS_RETRY_INTERVAL
 
-    bad_words = (
-        "wrapped", "bridge", "bridged", "staked",
-        "wormhole", "peg", "binance", "binance-peg",
-        "weth", "leveraged", "bull", "bear",
-    )
 
-    for item in _CG_COINS_LIST:
-        try:
-            sym = str(item.get("symbol") or "").upper()
-            if sym != symbol:
-                continue
+def _pick_coingecko_id_for_symbol(symbol: str) -> Optional[str]:
+    """
+    Подбор id по символу — O(1) по готовому индексу.
+    Пока индекс не загружен, возвращаем None (не блокируем запрос).
+    """
+    symbol = (symbol or "").strip().upper()
+    if not symbol:
+        return None
 
-            cid = str(item.get("id") or "")
-            name = str(item.get("name") or "")
-            cid_l = cid.lower()
-            name_l = name.lower()
+    candidates = _CG_SYMBOL_INDEX.get(symbol)
+    if candidates:
+        return candidates[0]
 
-            score = 0.0
+    if not _CG_LIST_LOADED:
+        log(f"CoinGecko: list not loaded yet, no id for {symbol}", level="debug", event="cg_list_not_loaded")
+    return None
 
-            if cid_l == sym_lower:
-                score += 100.0
 
-            if name_l == sym_lower:
-                score += 50.0
+# === Пакетное обновление капитализаций CoinGecko ===
 
-            if name_l.startswith(sym_lower):
-                score += 25.0
+# Как часто обновляем капитализации всех отслеживаемых токенов (секунды)
+CG_MARKETS_REFRESH_INTERVAL = float(os.environ.get("CG_MARKETS_REFRESH_INTERVAL", "300"))
+# Сколько секунд капитализация из общего кэша считается актуальной
+CG_MARKET_CAP_MAX_AGE = float(os.environ.get("CG_MARKET_CAP_MAX_AGE", "900"))
+# /coins/markets принимает до 250 id за запрос
+CG_MARKETS_CHUNK = 250
 
-            if "-" not in cid and " " not in cid:
-                score += 10.0
+# cg_id -> (market_cap, время получения)
+_CG_MARKET_CAPS: Dict[str, Tuple[float, float]] = {}
 
-            if any(w in cid_l for w in bad_words) or any(
-                w in name_l for w in bad_words
-            ):
-                score -= 30.0
 
-            score -= len(cid) * 0.01
+def get_cached_market_cap(cg_id: str) -> Optional[float]:
+    """Капитализация из общего кэша, если она не старше CG_MARKET_CAP_MAX_AGE."""
+    entry = _CG_MARKET_CAPS.get((cg_id or "").lower())
+    if entry is None or time.monotonic() - entry[1] > CG_MARKET_CAP_MAX_AGE:
+        return None
+    return entry[0]
 
-            if best_score is None or score > best_score:
-                best_score = score
-                best_id = cid
-        except Exception:
+
+def fetch_cg_market_caps(cg_ids: Iterable[str]) -> int:
+    """
+    Получить капитализации пачками по CG_MARKETS_CHUNK id за запрос
+    и положить в общий кэш. Возвращает число полученных монет.
+    """
+    ids = sorted({(cid or "").strip().lower() for cid in cg_ids if cid})
+    fetched = 0
+    for i in range(0, len(ids), CG_MARKETS_CHUNK):
+        chunk = ids[i:i + CG_MARKETS_CHUNK]
+        try:
+            r = scheduled_get(
+                "coingecko",
+                "https://api.coingecko.com/api/v3/coins/markets",
+                params={
+                    "vs_currency": "usd",
+                    "ids": ",".join(chunk),
+                    "per_page": CG_MARKETS_CHUNK,
+                },
+                timeout=20.0,
+            )
+            if r.status_code != 200:
+                log(
+                    f"CoinGecko M batch: HTTP {r.status_code} for {len(chunk)} ids: "
+                    f"{str(r.text)[:150]}",
+                    level="warning", event="coingecko_http_error", status=r.status_code,
+                )
+                continue
+            data = r.json()
+        except Exception as e:
+            log(f"CoinGecko M batch: error for {len(chunk)} ids: {e}", level="warning", event="coingecko_error")
             continue
 
-    if best_id:
-        _CG_SYMBOL_INDEX[symbol] = best_id
-        log(f"CoinGecko: {symbol} -> id={best_id}")
-    else:
-        log(f"CoinGecko: no id for symbol {symbol}")
+        now = time.monotonic()
+        for item in data if isinstance(data, list) else []:
+            try:
+                _CG_MARKET_CAPS[str(item["id"]).lower()] = (
+                    float(item.get("market_cap") or 0.0), now
+                )
+                fetched += 1
+            except Exception:
+                continue
+    return fetched
+
 
-    return best_id
+def collect_tracked_cg_ids() -> List[str]:
+    """
+    Все CoinGecko id отслеживаемых токенов: Token.cg_id,
+    а для токенов без него — id, подобранный по символу.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(Token.cg_id, Token.base).filter(Token.is_active == True).all()
+    finally:
+        db.close()
+
+    ids = set()
+    for cg_id, base in rows:
+        cid = cg_id or _pick_coingecko_id_for_symbol(base)
+        if cid:
+            ids.add(cid.lower())
+    return sorted(ids)
+
+
+async def cg_market_caps_refresh_loop() -> None:
+    """Фоновое пакетное обновление капитализаций. Запускается в startup_event."""
+    set_background_priority()
+    while True:
+        try:
+            ids = await asyncio.to_thread(collect_tracked_cg_ids)
+            if ids:
+                fetched = await run_blocking(fetch_cg_market_caps, ids)
+                log(
+                    f"CoinGecko M batch: {fetched}/{len(ids)} market caps refreshed",
+                    event="cg_market_caps_refreshed", fetched=fetched, tracked=len(ids),
+                )
+        except Exception as e:
+            log(f"CoinGecko M batch: refresh error: {e}", level="error", event="cg_market_caps_error")
+        await asyncio.sleep(CG_MARKETS_REFRESH_INTERVAL)
 
 
 def fetch_L_M_for_pair(pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
@@ -165,45 +393,59 @@ def fetch_L_M_for_pair(pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
 
     # ------ MEXC futures: тикер BASE_USDT ------
     symbol_fut = f"{base}_USDT"
-    try:
-        r = http_client.get(
-            "https://contract.mexc.com/api/v1/contract/ticker",
-            params={"symbol": symbol_fut},
-            timeout=10.0,
-        )
-        if r.status_code != 200:
-            log(
-                f"MEXC L/M futures: HTTP {r.status_code} for {symbol_fut}: "
-                f"{str(r.text)[:200]}"
+    # Сначала — снимок всех фьючерсных тикеров MEXC (один запрос на всех)
+    from .mexc_snapshot import mexc_snapshot
+    ticker = mexc_snapshot.get_futures(symbol_fut)
+    if ticker is not None:
+        price_mexc, L = ticker
+    else:
+        try:
+            r = scheduled_get(
+                "mexc_futures",
+                "https://contract.mexc.com/api/v1/contract/ticker",
+                params={"symbol": symbol_fut},
+                timeout=10.0,
             )
-        else:
-            data = r.json()
-            if data.get("success"):
-                t = data.get("data") or {}
-                try:
-                    price_mexc = float(t.get("lastPrice") or 0.0)
-                except Exception:
-                    price_mexc = None
-                try:
-                    L = float(t.get("amount24") or 0.0)
-                except Exception:
-                    L = None
-            else:
+            if r.status_code != 200:
                 log(
-                    f"MEXC L/M futures: code={data.get('code')} "
-                    f"msg={data.get('message')} for {symbol_fut}"
+                    f"MEXC L/M futures: HTTP {r.status_code} for {symbol_fut}: "
+                    f"{str(r.text)[:200]}",
+                    level="warning", event="mexc_futures_http_error", status=r.status_code,
                 )
-    except Exception as e:
-        log(f"MEXC L/M futures: error for {symbol_fut}: {e}")
+            else:
+                data = r.json()
+                if data.get("success"):
+                    t = data.get("data") or {}
+                    try:
+                        price_mexc = float(t.get("lastPrice") or 0.0)
+                    except Exception:
+                        price_mexc = None
+                    try:
+                        L = float(t.get("amount24") or 0.0)
+                    except Exception:
+                        L = None
+                else:
+                    log(
+                        f"MEXC L/M futures: code={data.get('code')} "
+                        f"msg={data.get('message')} for {symbol_fut}",
+                        level="warning", event="mexc_futures_api_error",
+                    )
+        except Exception as e:
+            log(f"MEXC L/M futures: error for {symbol_fut}: {e}", level="warning", event="mexc_futures_error")
 
     # ------ CoinGecko: капитализация M ------
     cg_id = getattr(pair_cfg, "cg_id", None)
     if not cg_id:
         cg_id = _pick_coingecko_id_for_symbol(base) or base.lower()
 
+    # Сначала смотрим в общий кэш пакетного обновления капитализаций
     if cg_id:
+        M = get_cached_market_cap(cg_id)
+
+    if cg_id and M is None:
         try:
-            r = http_client.get(
+            r = scheduled_get(
+                "coingecko",
                 "https://api.coingecko.com/api/v3/coins/markets",
                 params={"vs_currency": "usd", "ids": cg_id},
                 timeout=10.0,
@@ -211,7 +453,8 @@ def fetch_L_M_for_pair(pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
             if r.status_code != 200:
                 log(
                     f"CoinGecko M: HTTP {r.status_code} for {cg_id}: "
-                    f"{str(r.text)[:150]}"
+                    f"{str(r.text)[:150]}",
+                    level="warning", event="coingecko_http_error", status=r.status_code,
                 )
             else:
                 data = r.json()
@@ -219,10 +462,11 @@ def fetch_L_M_for_pair(pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
                     item = data[0]
                     try:
                         M = float(item.get("market_cap") or 0.0)
+                        _CG_MARKET_CAPS[cg_id.lower()] = (M, time.monotonic())
                     except Exception:
                         M = None
         except Exception as e:
-            log(f"CoinGecko M: error for {cg_id}: {e}")
+            log(f"CoinGecko M: error for {cg_id}: {e}", level="warning", event="coingecko_error")
 
     if price_mexc is None and L is None and M is None:
         return None
@@ -233,3 +477,153 @@ def fetch_L_M_for_pair(pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
         "M": M,
         "cg_id": cg_id,
     }
+
+
+# === Кэш L/M: TTL + stale-while-revalidate + single-flight ===
+
+# Сколько секунд результат L/M считается свежим
+LM_CACHE_TTL = float(os.environ.get("LM_CACHE_TTL", "60"))
+# До какого возраста отдаём устаревший результат, обновляя его фоном
+LM_CACHE_STALE_TTL = float(os.environ.get("LM_CACHE_STALE_TTL", "900"))
+# Сколько секунд держим пустой/неполный результат (например, после 429 CoinGecko)
+LM_CACHE_ERROR_TTL = float(os.environ.get("LM_CACHE_ERROR_TTL", "5"))
+
+
+def _lm_complete(value: Optional[Dict[str, float]]) -> bool:
+    """Все три значения на месте — такой результат можно держать полный TTL."""
+    return value is not None and all(value.get(k) is not None for k in ("price_mexc", "L", "M"))
+
+
+class LMCache:
+    """
+    Кэш результатов fetch_L_M_for_pair по (base, cg_id).
+
+    - свежий результат отдаётся сразу;
+    - устаревший (до LM_CACHE_STALE_TTL) тоже отдаётся сразу,
+      а обновление запускается фоном;
+    - одновременные промахи по одному ключу ждут один запрос к API;
+    - пустой или неполный результат живёт LM_CACHE_ERROR_TTL и не
+      вытесняет прежний полный (тот отдаётся как устаревший).
+
+    Живёт на event loop: ожидающие ждут общую задачу, в пул потоков
+    (run_blocking) уходит только сам fetch_L_M_for_pair лидера.
+    """
+
+    def __init__(
+        self,
+        ttl: float = LM_CACHE_TTL,
+        stale_ttl: float = LM_CACHE_STALE_TTL,
+        error_ttl: float = LM_CACHE_ERROR_TTL,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.error_ttl = min(error_ttl, ttl)
+        # ключ -> (результат, свежий до, отдаём устаревшим до) — по time.monotonic()
+        self._entries: Dict[Tuple[str, str], Tuple[Optional[Dict[str, float]], float, float]] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(pair_cfg: PairConfigLM) -> Tuple[str, str]:
+        base = (getattr(pair_cfg, "base", "") or "").upper().strip()
+        cg_id = (getattr(pair_cfg, "cg_id", None) or "").strip().lower()
+        return base, cg_id
+
+    def _store(self, key: Tuple[str, str], value: Optional[Dict[str, float]]) -> None:
+        now = time.monotonic()
+        if _lm_complete(value):
+            self._entries[key] = (value, now + self.ttl, now + self.stale_ttl)
+            return
+        previous = self._entries.get(key)
+        if previous is not None and _lm_complete(previous[0]) and now < previous[2]:
+            # Прежний полный результат остаётся; повторим запрос через error_ttl
+            self._entries[key] = (previous[0], now + self.error_ttl, previous[2])
+            return
+        self._entries[key] = (value, now + self.error_ttl, now + self.error_ttl)
+
+    async def _load(self, key: Tuple[str, str], pair_cfg: PairConfigLM, background: bool) -> Optional[Dict[str, float]]:
+        """Сходить в API (в пуле потоков) и положить результат в кэш."""
+        if background:
+            # Фоновое обновление — с фоновым приоритетом в планировщике
+            set_background_priority()
+        try:
+            value = await run_blocking(fetch_L_M_for_pair, pair_cfg)
+        except Exception as e:
+            log(f"L/M cache: error for {key[0]}: {e}", level="error", event="lm_cache_error")
+            self.errors += 1
+            self._store(key, None)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        self.refreshes += 1
+        self._store(key, value)
+        return value
+
+    def _start(self, key: Tuple[str, str], pair_cfg: PairConfigLM, background: bool) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, pair_cfg, background))
+        self._inflight[key] = task
+        # Ошибку фонового обновления уже залогировали — не оставляем её «неполученной»
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def get(self, pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
+        key = self._key(pair_cfg)
+        if not key[0]:
+            return None
+
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.hits += 1
+                return value
+            if now < stale_until:
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._start(key, pair_cfg, background=True)
+                return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._start(key, pair_cfg, background=False)
+        else:
+            self.coalesced += 1
+        # Отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def invalidate(self, base: Optional[str] = None) -> None:
+        if base is None:
+            self._entries.clear()
+        else:
+            base = base.upper().strip()
+            for key in [k for k in self._entries if k[0] == base]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+lm_cache = LMCache()
+
+
+async def get_L_M_cached(pair_cfg: PairConfigLM) -> Optional[Dict[str, float]]:
+    """fetch_L_M_for_pair через кэш (см. LMCache)."""
+    return await lm_cache.get(pair_cfg)
@@ -1,23 +1,48 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import asyncio
 import logging
+import os
+import secrets
 
-from .db import Base, engine, get_db
+from .db import engine, async_engine
 from .models import Token, Proxy, AccessToken, AdminUser, PriceHistory
-from .logic import fetch_L_M_for_pair, PairConfigLM, log
-from .auth import verify_access_token
+from .logic import (
+    get_L_M_cached,
+    lm_cache,
+    PairConfigLM,
+    log,
+    cg_coins_refresh_loop,
+    cg_market_caps_refresh_loop,
+)
+from .auth import verify_access_token, last_used_flush_loop, flush_last_used
+from .http_pool import init_http_pool, close_http_pool
+from .price_poller import price_poller_loop
+from .mexc_snapshot import mexc_snapshot_loop
+from .mexc_ws import mexc_ws_loop
+from .price_history import history_writer
+from .token_registry import token_registry
+from .rate_limiter import venue_scheduler
+from .proxy_manager import proxy_pool
+from . import metrics, app_logging
+from .price_rollups import price_rollup_loop, ROLLUPS_ENABLED
+from .migrations import migrate_schema, MIGRATE_ON_STARTUP
+from .history_partitions import (
+    maintain_partitions,
+    is_postgres,
+    PRICE_HISTORY_RETENTION_HOURS,
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Создаём таблицы в БД при старте
-Base.metadata.create_all(bind=engine)
+# Создаём таблицы в БД при старте (под advisory lock, см. migrations.py)
+if MIGRATE_ON_STARTUP:
+    migrate_schema(engine)
 
 app = FastAPI(
     title="HYDRA backend",
@@ -33,6 +58,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики: задержка по маршрутам и время SQL-запросов
+if metrics.METRICS_ENABLED:
+    if not metrics.METRICS_TOKEN:
+        logger.warning("METRICS_TOKEN is not set: /metrics will answer 503")
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine, "sync")
+    metrics.instrument_engine(async_engine.sync_engine, "async")
+
 from .prices_api import router as prices_router
 from .admin_api import router as admin_router
 from .admin_ui import router as admin_ui_router
@@ -46,15 +79,21 @@ app.include_router(admin_ui_router)
 
 async def cleanup_old_price_history():
     """
-    Удалить записи истории цен старше 2 дней.
+    Очистка истории цен старше PRICE_HISTORY_RETENTION_HOURS (по умолчанию 2 дня).
     Запускается каждый час.
+
+    В PostgreSQL удаляются целые партиции (и заранее создаются новые),
+    на других СУБД — обычный DELETE.
     """
+    if is_postgres(engine):
+        await asyncio.to_thread(maintain_partitions, engine)
+        return
+
     from .db import SessionLocal
     
     db = SessionLocal()
     try:
-        # Удаляем записи старше 2 дней
-        cutoff_time = datetime.utcnow() - timedelta(days=2)
+        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=PRICE_HISTORY_RETENTION_HOURS)
         
         deleted = db.query(PriceHistory).filter(
             PriceHistory.created_at < cutoff_time
@@ -63,7 +102,7 @@ async def cleanup_old_price_history():
         db.commit()
         
         if deleted > 0:
-            logger.info(f"Deleted {deleted} old price history records (older than 2 days)")
+            logger.info(f"Deleted {deleted} old price history records (older than {PRICE_HISTORY_RETENTION_HOURS}h)")
     
     except Exception as e:
         logger.error(f"Error cleaning up price history: {e}")
@@ -77,6 +116,15 @@ async def cleanup_old_price_history():
 async def startup_event():
     """Запустить background task при старте сервера."""
     logger.info("Starting HYDRA backend server...")
+
+    # Общий пул HTTP-клиентов для запросов к биржам
+    init_http_pool()
+
+    # Буферизованная запись истории цен
+    history_writer.start()
+
+    # Реестр торговых пар: /api/prices берёт id токена без запросов к БД
+    await token_registry.ensure_loaded()
     
     # Запускаем cleanup task каждый час
     async def cleanup_loop():
@@ -92,11 +140,40 @@ async def startup_event():
     # Запускаем в фоне
     asyncio.create_task(cleanup_loop())
 
+    # Пакетная запись last_used_at токенов доступа
+    asyncio.create_task(last_used_flush_loop())
+
+    # Список монет CoinGecko: из БД сразу, из сети — фоном по расписанию
+    asyncio.create_task(cg_coins_refresh_loop())
+
+    # Капитализации всех отслеживаемых токенов пачками по 250 id
+    asyncio.create_task(cg_market_caps_refresh_loop())
+
+    # Снимок всех тикеров MEXC (спот + фьючерсы) одним запросом за цикл
+    if os.environ.get("MEXC_SNAPSHOT_ENABLED", "1") == "1":
+        asyncio.create_task(mexc_snapshot_loop())
+
+    # Живые котировки MEXC по WebSocket (опционально)
+    if os.environ.get("MEXC_WS_ENABLED", "0") == "1":
+        asyncio.create_task(mexc_ws_loop())
+
+    # Свёртка истории в минутные/15-минутные/часовые агрегаты
+    if ROLLUPS_ENABLED:
+        asyncio.create_task(price_rollup_loop())
+
+    # Фоновый сборщик цен по всем активным токенам
+    if os.environ.get("PRICE_POLLER_ENABLED", "1") == "1":
+        asyncio.create_task(price_poller_loop())
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Логирование при остановке сервера."""
+    """Остановка сервера: дописываем историю, last_used_at и закрываем пул HTTP-клиентов."""
     logger.info("Shutting down HYDRA backend server...")
+    await history_writer.stop()
+    await flush_last_used()
+    await close_http_pool()
+    await async_engine.dispose()
 
 
 @app.get("/api/health")
@@ -110,6 +187,38 @@ def health():
     }
 
 
+def _collect_runtime_metrics() -> None:
+    """Значения «на момент опроса» для /metrics: очереди истории и лога, лимиты площадок, прокси."""
+    metrics.history_queue_depth.set(history_writer.qsize())
+    for result in ("written", "dropped", "skipped"):
+        metrics.history_rows.set(getattr(history_writer, result), result)
+    for stats in venue_scheduler.snapshot():
+        labels = (stats["venue"], stats["proxy"] or "direct")
+        metrics.venue_rate_limit.set(stats["rate"], *labels)
+        metrics.venue_queue_depth.set(stats["queued"], *labels)
+        metrics.venue_throttled.set(stats["throttled"], *labels)
+    metrics.proxy_pool_size.set(proxy_pool.size())
+    log_stats = app_logging.stats()
+    metrics.log_queue_depth.set(log_stats["queued"])
+    metrics.log_records.set(log_stats["dropped"], "dropped")
+    metrics.log_records.set(log_stats["suppressed"], "suppressed")
+
+
+metrics.registry.on_collect(_collect_runtime_metrics)
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics(authorization: Optional[str] = Header(None)):
+    """Метрики в текстовом формате Prometheus."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    if not metrics.METRICS_TOKEN:
+        raise HTTPException(status_code=503, detail="METRICS_TOKEN is not configured")
+    if not secrets.compare_digest(authorization or "", f"Bearer {metrics.METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+
 class LMRequest(BaseModel):
     base: str
     cg_id: Optional[str] = None
@@ -124,9 +233,8 @@ class LMResponse(BaseModel):
 
 
 @app.post("/api/lm", response_model=LMResponse)
-def get_lm(
+async def get_lm(
     data: LMRequest,
-    db: Session = Depends(get_db),
     token = Depends(verify_access_token)
 ):
     """
@@ -140,7 +248,8 @@ def get_lm(
     }
     """
     cfg = PairConfigLM(base=data.base, cg_id=data.cg_id)
-    result = fetch_L_M_for_pair(cfg, db=db)
+    # Кэш и объединение запросов — на event loop, cloudscraper — в пуле потоков
+    result = await get_L_M_cached(cfg)
     if result is None:
         raise HTTPException(status_code=404, detail="No data for this symbol")
 
@@ -151,3 +260,9 @@ def get_lm(
         L=result.get("L"),
         M=result.get("M"),
     )
+
+
+@app.get("/api/lm/cache")
+def get_lm_cache_stats(token = Depends(verify_access_token)):
+    """Счётчики кэша L/M (попадания, промахи, объединённые запросы)."""
+    return lm_cache.stats()
@@ -0,0 +1,386 @@
+# backend/metrics.py
+"""
+Метрики в текстовом формате Prometheus (GET /metrics) без внешних зависимостей.
+
+- задержка запросов к API по маршрутам (MetricsMiddleware);
+- задержка и исходы запросов к площадкам — по площадке и по прокси
+  (proxied_get / scheduled_get зовут observe_upstream);
+- время SQL-запросов (instrument_engine вешает события на engine);
+- глубина очереди записи истории и прочие значения «на момент опроса» —
+  через колбэки on_collect, их регистрирует main.py.
+
+Запись метрики — поиск в словаре и bisect под threading.Lock, поэтому
+метрики можно держать включёнными всегда. METRICS_ENABLED=0 отключает
+middleware, события БД и эндпоинт.
+"""
+
+import bisect
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# /metrics требует Authorization: Bearer {METRICS_TOKEN}; без токена эндпоинт
+# не отдаёт ничего (в метриках адреса прокси)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+# Префиксы путей без гистограммы задержки: потоки (SSE/WebSocket) живут часами
+METRICS_EXCLUDE_PATHS = tuple(
+    p.strip()
+    for p in os.environ.get("METRICS_EXCLUDE_PATHS", "/api/prices/stream").split(",")
+    if p.strip()
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self._header()
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Значение «на момент опроса». kind="counter" — для счётчиков, которые
+    ведутся в другом месте (history_writer.written и т.п.) и только копируются сюда.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+
+    def set(self, value: Optional[float], *labels: str) -> None:
+        if value is None:
+            return
+        with self._lock:
+            self._values[labels] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._values.items()]
+        lines = self._header()
+        bounds = self.buckets + (float("inf"),)
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Все метрики процесса и колбэки, обновляющие gauges перед выдачей."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, labelnames, kind))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def on_collect(self, fn: Callable[[], None]) -> None:
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                from .logic import log
+                log(f"Metrics: collector {getattr(fn, '__name__', fn)} failed: {e}", level="error")
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр процесса
+registry = MetricsRegistry()
+
+http_request_seconds = registry.histogram(
+    "hydra_http_request_duration_seconds",
+    "Latency of API requests by route",
+    ("method", "route", "status"),
+    HTTP_BUCKETS,
+)
+upstream_request_seconds = registry.histogram(
+    "hydra_upstream_request_duration_seconds",
+    "Latency of requests to exchanges and data providers",
+    ("venue",),
+    UPSTREAM_BUCKETS,
+)
+upstream_requests = registry.counter(
+    "hydra_upstream_requests_total",
+    "Requests to exchanges and data providers by outcome",
+    ("venue", "outcome"),
+)
+proxy_request_seconds = registry.histogram(
+    "hydra_proxy_request_duration_seconds",
+    "Latency of upstream requests by proxy",
+    ("proxy", "venue"),
+    UPSTREAM_BUCKETS,
+)
+proxy_requests = registry.counter(
+    "hydra_proxy_requests_total",
+    "Upstream requests by proxy and outcome",
+    ("proxy", "venue", "outcome"),
+)
+db_query_seconds = registry.histogram(
+    "hydra_db_query_duration_seconds",
+    "SQL statement execution time",
+    ("engine", "statement"),
+    DB_BUCKETS,
+)
+db_query_errors = registry.counter(
+    "hydra_db_query_errors_total",
+    "Failed SQL statements",
+    ("engine", "statement"),
+)
+
+# Заполняются колбэком из main.py при каждом опросе /metrics
+history_queue_depth = registry.gauge(
+    "hydra_history_queue_depth",
+    "Price history rows waiting to be written",
+)
+history_rows = registry.gauge(
+    "hydra_history_rows_total",
+    "Price history rows by result (written, dropped, skipped as unchanged)",
+    ("result",),
+    kind="counter",
+)
+venue_rate_limit = registry.gauge(
+    "hydra_venue_rate_limit",
+    "Current adaptive rate limit per IP, requests per second",
+    ("venue", "proxy"),
+)
+venue_queue_depth = registry.gauge(
+    "hydra_venue_queue_depth",
+    "Requests waiting for a venue rate-limit token",
+    ("venue", "proxy"),
+)
+venue_throttled = registry.gauge(
+    "hydra_venue_throttled_total",
+    "Throttling responses (429/418/Retry-After) per venue and exit IP",
+    ("venue", "proxy"),
+    kind="counter",
+)
+log_records = registry.gauge(
+    "hydra_log_records_total",
+    "Log records not written: dropped on a full queue or suppressed by sampling",
+    ("result",),
+    kind="counter",
+)
+log_queue_depth = registry.gauge(
+    "hydra_log_queue_depth",
+    "Log records waiting to be written to stdout",
+)
+proxy_pool_size = registry.gauge(
+    "hydra_proxy_pool_size",
+    "Active proxies loaded in the pool",
+)
+
+
+# ------ площадки ------
+
+def upstream_outcome(status_code: int) -> str:
+    if status_code in (418, 429):
+        return "throttled"
+    if status_code >= 400:
+        return "http_error"
+    return "ok"
+
+
+def observe_upstream(venue: str, seconds: float, outcome: str, proxy_host: Optional[str] = None) -> None:
+    """Записать один запрос к площадке (и к прокси, если он был)."""
+    upstream_request_seconds.observe(seconds, venue)
+    upstream_requests.inc(venue, outcome)
+    if proxy_host:
+        proxy_request_seconds.observe(seconds, proxy_host, venue)
+        proxy_requests.inc(proxy_host, venue, outcome)
+
+
+# ------ БД ------
+
+_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+def _statement_kind(statement: str) -> str:
+    head = statement.lstrip()[:6].upper()
+    return head if head in _STATEMENTS else "OTHER"
+
+
+def instrument_engine(engine: Engine, label: str) -> None:
+    """
+    Замерять каждый SQL-запрос engine (для AsyncEngine передавать .sync_engine).
+    Время кладём в conn.info — соединение не используется двумя запросами сразу.
+    """
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if started:
+            db_query_seconds.observe(time.perf_counter() - started.pop(), label, _statement_kind(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        conn = context.connection
+        started = conn.info.get("metrics_started") if conn is not None else None
+        if started:
+            started.pop()
+        db_query_errors.inc(label, _statement_kind(context.statement or ""))
+
+
+# ------ HTTP ------
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: задержка каждого HTTP-запроса по шаблону маршрута
+    ("/api/prices/{token_name}/history"), а не по реальному пути —
+    иначе число рядов метрики растёт с каждой парой.
+    Пути из METRICS_EXCLUDE_PATHS (потоки цен) не учитываются.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._routes.get(endpoint)
+        if path is None:
+            path = scope.get("path", "unknown")
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            self._routes[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(METRICS_EXCLUDE_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_seconds.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                self._route_path(scope),
+                str(status[0]),
+            )
+
+
+def render_metrics() -> str:
+    return registry.render()
+
@@ -0,0 +1,146 @@
+# backend/mexc_snapshot.py
+"""
+Снимок всех тикеров MEXC одним запросом.
+
+Вместо запроса bookTicker / contract/ticker на каждый символ раз в
+MEXC_SNAPSHOT_INTERVAL секунд забираем полные таблицы спота и фьючерсов
+и раскладываем их по нормализованному символу (AAA_USDT).
+get_mexc_price и fetch_L_M_for_pair читают отсюда, как из словаря.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional, Dict, Tuple
+
+from .logic import log
+from .rate_limiter import set_background_priority
+from .price_logic import proxied_get, normalize_mexc_symbol
+
+
+# Интервал обновления снимка (секунды)
+MEXC_SNAPSHOT_INTERVAL = float(os.environ.get("MEXC_SNAPSHOT_INTERVAL", "2"))
+# Сколько секунд снимок считается свежим
+MEXC_SNAPSHOT_MAX_AGE = float(os.environ.get("MEXC_SNAPSHOT_MAX_AGE", "10"))
+
+MEXC_SPOT_BOOK_URL = "https://api.mexc.com/api/v3/ticker/bookTicker"
+MEXC_FUTURES_TICKER_URL = "https://contract.mexc.com/api/v1/contract/ticker"
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MexcSnapshot:
+    """
+    Последние таблицы тикеров MEXC.
+    Словари заменяются целиком, поэтому читать их можно из любого потока.
+    """
+
+    def __init__(self):
+        # AAA_USDT -> (bid, ask)
+        self.spot: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        # AAA_USDT -> (lastPrice, amount24)
+        self.futures: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        self.spot_updated_at = 0.0
+        self.futures_updated_at = 0.0
+
+        # Живые значения из WebSocket (mexc_ws.py); действуют, пока поток подключён
+        self.live_spot: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        self.live_futures: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        self.live_spot_connected = False
+        self.live_futures_connected = False
+
+    def get_book(self, symbol: str, max_age: float = MEXC_SNAPSHOT_MAX_AGE):
+        """
+        (bid, ask) спота: из WebSocket-потока, если он подключён,
+        иначе из снимка. None, если снимок устарел/символа нет.
+        """
+        symbol = normalize_mexc_symbol(symbol)
+        if self.live_spot_connected:
+            live = self.live_spot.get(symbol)
+            if live is not None:
+                return live
+        if time.monotonic() - self.spot_updated_at > max_age:
+            return None
+        return self.spot.get(symbol)
+
+    def get_futures(self, symbol: str, max_age: float = MEXC_SNAPSHOT_MAX_AGE):
+        """(lastPrice, amount24) фьючерса: из WebSocket-потока или из снимка."""
+        symbol = normalize_mexc_symbol(symbol)
+        if self.live_futures_connected:
+            live = self.live_futures.get(symbol)
+            if live is not None:
+                return live
+        if time.monotonic() - self.futures_updated_at > max_age:
+            return None
+        return self.futures.get(symbol)
+
+    async def refresh_spot(self, use_proxy: bool = True) -> int:
+        r = await proxied_get("mexc", MEXC_SPOT_BOOK_URL, use_proxy, timeout=10)
+        if r.status_code != 200:
+            log(f"MEXC snapshot spot: HTTP {r.status_code}: {str(r.text)[:200]}", level="warning")
+            return 0
+
+        book = {}
+        for item in r.json():
+            symbol = str(item.get("symbol") or "").upper()
+            if not symbol.endswith("USDT"):
+                continue
+            book[normalize_mexc_symbol(symbol)] = (
+                _to_float(item.get("bidPrice")),
+                _to_float(item.get("askPrice")),
+            )
+        self.spot = book
+        self.spot_updated_at = time.monotonic()
+        return len(book)
+
+    async def refresh_futures(self, use_proxy: bool = True) -> int:
+        r = await proxied_get("mexc_futures", MEXC_FUTURES_TICKER_URL, use_proxy, timeout=10)
+        if r.status_code != 200:
+            log(f"MEXC snapshot futures: HTTP {r.status_code}: {str(r.text)[:200]}", level="warning")
+            return 0
+
+        data = r.json()
+        if not data.get("success"):
+            log(f"MEXC snapshot futures: code={data.get('code')} msg={data.get('message')}", level="warning")
+            return 0
+
+        tickers = {}
+        for item in data.get("data") or []:
+            symbol = str(item.get("symbol") or "").upper()
+            if not symbol.endswith("_USDT"):
+                continue
+            tickers[normalize_mexc_symbol(symbol)] = (
+                _to_float(item.get("lastPrice")),
+                _to_float(item.get("amount24")),
+            )
+        self.futures = tickers
+        self.futures_updated_at = time.monotonic()
+        return len(tickers)
+
+
+# Глобальный снимок процесса
+mexc_snapshot = MexcSnapshot()
+
+
+async def mexc_snapshot_loop() -> None:
+    """Фоновое обновление снимка MEXC. Запускается в startup_event."""
+    log(f"MEXC snapshot: started, interval={MEXC_SNAPSHOT_INTERVAL}s")
+    set_background_priority()
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        results = await asyncio.gather(
+            mexc_snapshot.refresh_spot(),
+            mexc_snapshot.refresh_futures(),
+            return_exceptions=True,
+        )
+        for name, result in zip(("spot", "futures"), results):
+            if isinstance(result, Exception):
+                log(f"MEXC snapshot {name}: error: {result}", level="warning")
+        elapsed = loop.time() - started
+        await asyncio.sleep(max(MEXC_SNAPSHOT_INTERVAL - elapsed, 0.0))
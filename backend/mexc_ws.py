@@ -0,0 +1,310 @@
+# backend/mexc_ws.py
+"""
+Живые котировки MEXC через WebSocket (опциональный режим, MEXC_WS_ENABLED=1).
+
+Держим постоянные подписки спота (bookTicker) и фьючерсов (ticker) для всех
+активных пар из таблицы tokens и складываем обновления в mexc_snapshot.live_*.
+get_mexc_price и fetch_L_M_for_pair читают оттуда верх стакана без запросов.
+При обрыве — переподключение с экспоненциальной паузой; пока поток лежит,
+его символы убираются из live-словарей и работает REST-снимок.
+Флаги mexc_snapshot.live_*_connected поднимаются только после того, как
+сервер подтвердил подписку, и опускаются при обрыве соединения.
+
+Адреса задаются через MEXC_WS_SPOT_URL / MEXC_WS_FUTURES_URL, поэтому
+ингестор можно гонять против локального тестового WebSocket-сервера
+(scripts/mexc_ws_standin.py).
+"""
+
+import asyncio
+import json
+import os
+import random
+from typing import Optional, Dict, List, Tuple, Callable, Iterable
+
+import websockets
+
+from .db import SessionLocal
+from .models import Token
+from .logic import log
+from .price_logic import normalize_mexc_symbol
+from .mexc_snapshot import mexc_snapshot, _to_float
+
+
+MEXC_WS_SPOT_URL = os.environ.get("MEXC_WS_SPOT_URL", "wss://wbs.mexc.com/ws")
+MEXC_WS_FUTURES_URL = os.environ.get("MEXC_WS_FUTURES_URL", "wss://contract.mexc.com/edge")
+# Сколько символов подписываем на одно соединение (у MEXC спота лимит 30)
+MEXC_WS_MAX_SUBS = int(os.environ.get("MEXC_WS_MAX_SUBS", "30"))
+# Как часто шлём ping на уровне протокола MEXC (секунды)
+MEXC_WS_PING_INTERVAL = float(os.environ.get("MEXC_WS_PING_INTERVAL", "15"))
+# Пауза переподключения: от BASE до MAX секунд, удваивается
+MEXC_WS_BACKOFF_BASE = float(os.environ.get("MEXC_WS_BACKOFF_BASE", "1"))
+MEXC_WS_BACKOFF_MAX = float(os.environ.get("MEXC_WS_BACKOFF_MAX", "60"))
+# Как часто перечитываем список пар из БД (секунды)
+MEXC_WS_SYMBOLS_REFRESH = float(os.environ.get("MEXC_WS_SYMBOLS_REFRESH", "60"))
+
+
+# ------ Протокол спота ------
+
+def spot_subscribe_messages(symbols: Iterable[str]) -> List[dict]:
+    """AAA_USDT -> подписка на spot@public.bookTicker.v3.api@AAAUSDT"""
+    params = [
+        f"spot@public.bookTicker.v3.api@{s.replace('_', '')}" for s in symbols
+    ]
+    return [{"method": "SUBSCRIPTION", "params": params}]
+
+
+def parse_spot_ack(msg: dict) -> Optional[bool]:
+    """
+    Ответ на SUBSCRIPTION: {"id": 0, "code": 0, "msg": "spot@public..."}.
+    None — не ответ на подписку; False — MEXC отказал ("Not Subscribed ...").
+    """
+    if "code" not in msg or "msg" not in msg or "d" in msg:
+        return None
+    # Ответ на PING приходит в том же формате
+    if str(msg.get("msg")).upper() == "PONG":
+        return None
+    return msg.get("code") == 0 and "not subscribed" not in str(msg.get("msg")).lower()
+
+
+def parse_spot_message(msg: dict) -> Optional[Tuple[str, Tuple[Optional[float], Optional[float]]]]:
+    """{"s": "AAAUSDT", "d": {"b": bid, "a": ask}} -> ("AAA_USDT", (bid, ask))"""
+    data = msg.get("d")
+    symbol = msg.get("s")
+    if not isinstance(data, dict) or not symbol:
+        return None
+    return normalize_mexc_symbol(symbol), (_to_float(data.get("b")), _to_float(data.get("a")))
+
+
+# ------ Протокол фьючерсов ------
+
+def futures_subscribe_messages(symbols: Iterable[str]) -> List[dict]:
+    return [{"method": "sub.ticker", "param": {"symbol": s}} for s in symbols]
+
+
+def parse_futures_ack(msg: dict) -> Optional[bool]:
+    """Ответ на sub.ticker: {"channel": "rs.sub.ticker", "data": "success"} или rs.error."""
+    channel = msg.get("channel")
+    if channel == "rs.sub.ticker":
+        return msg.get("data") == "success"
+    if channel == "rs.error":
+        return False
+    return None
+
+
+def parse_futures_message(msg: dict) -> Optional[Tuple[str, Tuple[Optional[float], Optional[float]]]]:
+    """{"channel": "push.ticker", "data": {...}} -> ("AAA_USDT", (lastPrice, amount24))"""
+    if msg.get("channel") != "push.ticker":
+        return None
+    data = msg.get("data")
+    if not isinstance(data, dict) or not data.get("symbol"):
+        return None
+    return normalize_mexc_symbol(data["symbol"]), (
+        _to_float(data.get("lastPrice")),
+        _to_float(data.get("amount24")),
+    )
+
+
+class MexcWsFeed:
+    """Одно WebSocket-соединение с подписками на набор символов."""
+
+    def __init__(
+        self,
+        url: str,
+        symbols: List[str],
+        target: Dict[str, Tuple[Optional[float], Optional[float]]],
+        subscribe: Callable[[Iterable[str]], List[dict]],
+        parse: Callable[[dict], Optional[tuple]],
+        ping_message: dict,
+        name: str = "mexc-ws",
+        parse_ack: Optional[Callable[[dict], Optional[bool]]] = None,
+        on_state: Optional[Callable[[], None]] = None,
+    ):
+        self.url = url
+        self.symbols = symbols
+        self.target = target
+        self.subscribe = subscribe
+        self.parse = parse
+        self.ping_message = ping_message
+        self.name = name
+        self.parse_ack = parse_ack
+        # Зовётся при смене connected (ингестор пересчитывает флаги снимка)
+        self.on_state = on_state
+        # True только после подтверждения подписки и до обрыва
+        self.connected = False
+        self.messages = 0
+        self.reconnects = 0
+
+    def _set_connected(self, connected: bool) -> None:
+        if self.connected == connected:
+            return
+        self.connected = connected
+        if self.on_state is not None:
+            self.on_state()
+
+    def _drop_symbols(self) -> None:
+        """Соединение потеряно — его значения больше не живые."""
+        for symbol in self.symbols:
+            self.target.pop(symbol, None)
+
+    async def _ping_loop(self, ws) -> None:
+        while True:
+            await asyncio.sleep(MEXC_WS_PING_INTERVAL)
+            await ws.send(json.dumps(self.ping_message))
+
+    async def _session(self) -> None:
+        async with websockets.connect(self.url, ping_interval=None, close_timeout=5) as ws:
+            messages = self.subscribe(self.symbols)
+            for message in messages:
+                await ws.send(json.dumps(message))
+            # Ждём ответ на каждое сообщение подписки; хватит одного успешного
+            # (у фьючерсов отдельные символы MEXC может не знать)
+            acks_left = len(messages)
+            subscribed = False
+
+            ping_task = asyncio.create_task(self._ping_loop(ws))
+            try:
+                async for raw in ws:
+                    try:
+                        msg = json.loads(raw)
+                    except (TypeError, ValueError):
+                        continue
+                    if not isinstance(msg, dict):
+                        continue
+                    ack = self.parse_ack(msg) if self.parse_ack is not None else None
+                    if ack is not None:
+                        acks_left -= 1
+                        subscribed = subscribed or ack
+                        if not ack:
+                            log(f"{self.name}: subscription rejected: {str(msg)[:200]}", level="warning")
+                        if acks_left <= 0 and subscribed and not self.connected:
+                            self._set_connected(True)
+                            log(f"{self.name}: subscribed, {len(self.symbols)} symbols")
+                        continue
+                    update = self.parse(msg)
+                    if update is None:
+                        continue
+                    # Данные по подписке — тоже подтверждение
+                    if not self.connected:
+                        self._set_connected(True)
+                        log(f"{self.name}: subscribed, {len(self.symbols)} symbols")
+                    symbol, values = update
+                    self.target[symbol] = values
+                    self.messages += 1
+            finally:
+                ping_task.cancel()
+
+    async def run(self) -> None:
+        """Держать соединение, переподключаясь с экспоненциальной паузой."""
+        backoff = MEXC_WS_BACKOFF_BASE
+        while True:
+            try:
+                await self._session()
+                # Сервер закрыл соединение штатно — переподключаемся сразу
+                backoff = MEXC_WS_BACKOFF_BASE
+            except asyncio.CancelledError:
+                self._drop_symbols()
+                self._set_connected(False)
+                raise
+            except Exception as e:
+                log(f"{self.name}: connection error: {e}", level="warning")
+            finally:
+                if self.connected:
+                    backoff = MEXC_WS_BACKOFF_BASE
+                self._drop_symbols()
+                self._set_connected(False)
+
+            self.reconnects += 1
+            delay = backoff * (0.5 + random.random() / 2)
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, MEXC_WS_BACKOFF_MAX)
+
+
+class MexcWsIngestor:
+    """Набор соединений спота и фьючерсов для всех активных пар."""
+
+    def __init__(
+        self,
+        spot_url: str = MEXC_WS_SPOT_URL,
+        futures_url: str = MEXC_WS_FUTURES_URL,
+        max_subs: int = MEXC_WS_MAX_SUBS,
+    ):
+        self.spot_url = spot_url
+        self.futures_url = futures_url
+        self.max_subs = max_subs
+        self.symbols: List[str] = []
+        self.feeds: List[MexcWsFeed] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def _build_feeds(self, symbols: List[str]) -> List[MexcWsFeed]:
+        feeds = []
+        for i in range(0, len(symbols), self.max_subs):
+            chunk = symbols[i:i + self.max_subs]
+            feeds.append(MexcWsFeed(
+                self.spot_url, chunk, mexc_snapshot.live_spot,
+                spot_subscribe_messages, parse_spot_message,
+                {"method": "PING"}, name=f"MEXC WS spot#{i // self.max_subs}",
+                parse_ack=parse_spot_ack, on_state=self._sync_flags,
+            ))
+            feeds.append(MexcWsFeed(
+                self.futures_url, chunk, mexc_snapshot.live_futures,
+                futures_subscribe_messages, parse_futures_message,
+                {"method": "ping"}, name=f"MEXC WS futures#{i // self.max_subs}",
+                parse_ack=parse_futures_ack, on_state=self._sync_flags,
+            ))
+        return feeds
+
+    def _sync_flags(self) -> None:
+        """Живой режим включён, пока подписано хотя бы одно соединение этого вида."""
+        mexc_snapshot.live_spot_connected = any(
+            f.connected for f in self.feeds if f.target is mexc_snapshot.live_spot
+        )
+        mexc_snapshot.live_futures_connected = any(
+            f.connected for f in self.feeds if f.target is mexc_snapshot.live_futures
+        )
+
+    async def set_symbols(self, symbols: Iterable[str]) -> None:
+        """Переподписаться, если набор пар изменился."""
+        symbols = sorted({normalize_mexc_symbol(s) for s in symbols if s})
+        if symbols == self.symbols:
+            return
+        await self.stop_feeds()
+        self.symbols = symbols
+        self.feeds = self._build_feeds(symbols)
+        self._tasks = [asyncio.create_task(feed.run()) for feed in self.feeds]
+        log(f"MEXC WS: {len(symbols)} symbols over {len(self.feeds)} connections")
+
+    async def stop_feeds(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.feeds = []
+        mexc_snapshot.live_spot_connected = False
+        mexc_snapshot.live_futures_connected = False
+
+
+def _load_active_bases() -> List[str]:
+    db = SessionLocal()
+    try:
+        return [base for (base,) in db.query(Token.base).filter(Token.is_active == True).all()]
+    finally:
+        db.close()
+
+
+async def mexc_ws_loop(ingestor: Optional[MexcWsIngestor] = None) -> None:
+    """
+    Фоновая задача WebSocket-режима. Запускается в startup_event,
+    если MEXC_WS_ENABLED=1. Раз в MEXC_WS_SYMBOLS_REFRESH перечитывает пары.
+    """
+    ingestor = ingestor or MexcWsIngestor()
+    try:
+        while True:
+            try:
+                bases = await asyncio.to_thread(_load_active_bases)
+                await ingestor.set_symbols(bases)
+            except Exception as e:
+                log(f"MEXC WS: symbols refresh error: {e}", level="warning")
+            await asyncio.sleep(MEXC_WS_SYMBOLS_REFRESH)
+    finally:
+        await ingestor.stop_feeds()
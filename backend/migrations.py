@@ -0,0 +1,86 @@
+# backend/migrations.py
+"""
+Идемпотентные миграции схемы, которые выполняются при старте
+(Alembic в проекте нет, create_all существующие таблицы не меняет).
+
+migrate_schema() держит pg_advisory_lock, поэтому несколько воркеров
+uvicorn/gunicorn выполняют миграции по очереди, а не одновременно.
+Можно выключить их при старте (MIGRATE_ON_STARTUP=0) и запускать
+отдельным шагом деплоя:
+
+    python -m backend.migrations
+"""
+
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .db import Base
+from .logic import log
+from .models import PriceHistory
+from .history_partitions import is_postgres, migrate_to_partitions, ensure_partitions
+
+
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "1") == "1"
+# Ключ сессионного pg_advisory_lock на время миграций
+SCHEMA_LOCK_KEY = 0x48594400
+
+
+# Одиночный индекс по token_id полностью покрывается составным
+_OBSOLETE_PRICE_HISTORY_INDEXES = ("ix_price_history_token_id", "ix_price_history_id")
+
+
+def ensure_price_history_indexes(engine: Engine) -> None:
+    """
+    Добавить составной индекс (token_id, created_at) и убрать лишние одиночные.
+    На партиционированной таблице индекс создаётся на всех партициях сразу.
+    """
+    table = PriceHistory.__table__
+    with engine.begin() as conn:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+        if engine.dialect.name != "postgresql":
+            return
+        for name in _OBSOLETE_PRICE_HISTORY_INDEXES:
+            exists = conn.execute(
+                text("SELECT 1 FROM pg_indexes WHERE indexname = :name AND schemaname = current_schema()"),
+                {"name": name},
+            ).scalar()
+            if exists:
+                conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+                log(f"Migrations: dropped index {name}")
+
+
+@contextmanager
+def schema_lock(engine: Engine):
+    """Сессионный pg_advisory_lock: пока он взят, другие воркеры ждут."""
+    if not is_postgres(engine):
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+
+def migrate_schema(engine: Engine) -> None:
+    """
+    Все миграции при старте: старую price_history переводим на партиции,
+    создаём таблицы и индексы, потом партиции наперёд.
+    """
+    with schema_lock(engine):
+        migrate_to_partitions(engine)
+        Base.metadata.create_all(bind=engine)
+        ensure_price_history_indexes(engine)
+        ensure_partitions(engine)
+
+
+if __name__ == "__main__":
+    from .db import engine
+
+    migrate_schema(engine)
+    log("Migrations: done")
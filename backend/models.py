@@ -1,7 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float
+import os
+
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Index
 from sqlalchemy.sql import func
 
-from .db import Base
+from .db import Base, engine
+
+# Партиции истории есть только в PostgreSQL (SQLite — локальная разработка)
+_PARTITIONED_HISTORY = engine.dialect.name == "postgresql"
 
 
 class Token(Base):
@@ -81,16 +86,41 @@ class AdminUser(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
+# Покрывающий индекс истории: цены лежат прямо в индексе (index-only scan),
+# ценой почти двойного объёма. Включается PRICE_HISTORY_COVERING_INDEX=1.
+PRICE_HISTORY_COVERING_INDEX = os.environ.get("PRICE_HISTORY_COVERING_INDEX", "0") == "1"
+PRICE_HISTORY_INCLUDE = (
+    ["mexc_bid", "mexc_ask", "matcha_price", "pancake_price", "spread"]
+    if PRICE_HISTORY_COVERING_INDEX else []
+)
+
+
 class PriceHistory(Base):
     """
     Таблица истории цен для каждой пары токенов.
     Сохраняет исторические данные цен, чтобы показывать графики.
     Данные сохраняются при каждом запросе цены из приложения.
+
+    В PostgreSQL таблица партиционирована по created_at (см. history_partitions.py),
+    поэтому created_at входит в первичный ключ. SQLite не умеет autoincrement
+    в составном ключе — там ключ только id.
+
+    Все запросы истории — «token_id = ? AND created_at >= ? ORDER BY created_at»,
+    их обслуживает составной индекс (token_id, created_at).
     """
     __tablename__ = "price_history"
-
-    id = Column(Integer, primary_key=True, index=True)
-    token_id = Column(Integer, nullable=False, index=True)  # ссылка на tokens.id
+    __table_args__ = (
+        Index(
+            "ix_price_history_token_id_created_at",
+            "token_id",
+            "created_at",
+            postgresql_include=PRICE_HISTORY_INCLUDE,
+        ),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    token_id = Column(Integer, nullable=False)  # ссылка на tokens.id
     
     # Цены с разных источников
     mexc_bid = Column(Float, nullable=True)
@@ -102,4 +132,59 @@ class PriceHistory(Base):
     spread = Column(Float, nullable=True)  # спред между bid и ask
     
     # Время создания записи
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    created_at = Column(
+        DateTime(timezone=True),
+        primary_key=_PARTITIONED_HISTORY,
+        server_default=func.now(),
+        index=True,
+    )
+
+
+# ============= Агрегаты истории (см. price_rollups.py) =============
+
+ROLLUP_PRICE_COLUMNS = ("mexc_bid", "mexc_ask", "matcha_price", "pancake_price", "spread")
+ROLLUP_AGGREGATES = ("first", "min", "max", "avg", "last")
+
+
+class PriceRollupMixin:
+    """
+    Общие колонки таблиц-агрегатов: корзина времени по паре и для каждой
+    цены first/min/max/avg/last (<колонка>_<агрегат>), samples — сколько
+    сырых записей попало в корзину.
+    """
+    token_id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # начало корзины (UTC)
+    samples = Column(Integer, nullable=False, default=0)
+
+
+for _column in ROLLUP_PRICE_COLUMNS:
+    for _aggregate in ROLLUP_AGGREGATES:
+        setattr(PriceRollupMixin, f"{_column}_{_aggregate}", Column(Float, nullable=True))
+
+
+class PriceHistory1m(PriceRollupMixin, Base):
+    """Минутные агрегаты истории цен."""
+    __tablename__ = "price_history_1m"
+
+
+class PriceHistory15m(PriceRollupMixin, Base):
+    """15-минутные агрегаты истории цен."""
+    __tablename__ = "price_history_15m"
+
+
+class PriceHistory1h(PriceRollupMixin, Base):
+    """Часовые агрегаты истории цен."""
+    __tablename__ = "price_history_1h"
+
+
+class CoinGeckoCoin(Base):
+    """
+    Локальная копия списка монет CoinGecko (/coins/list).
+    Обновляется фоном, чтобы не качать ~15k записей на каждом старте.
+    """
+    __tablename__ = "coingecko_coins"
+
+    id = Column(String(256), primary_key=True)  # CoinGecko id
+    symbol = Column(String(128), nullable=False, index=True)
+    name = Column(String(512), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
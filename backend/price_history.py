@@ -3,13 +3,62 @@
 Модуль для сохранения и получения истории цен.
 """
 
-from typing import Optional, List
-from datetime import datetime, timedelta
+import asyncio
+import math
+import os
+import time
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, func, Float
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
+from .db import SessionLocal
 from .models import PriceHistory, Token
 from .logic import log
 
 
+# Настройки буферизованной записи истории
+HISTORY_FLUSH_ROWS = int(os.environ.get("HISTORY_FLUSH_ROWS", "500"))
+HISTORY_FLUSH_INTERVAL_MS = int(os.environ.get("HISTORY_FLUSH_INTERVAL_MS", "500"))
+HISTORY_QUEUE_MAX = int(os.environ.get("HISTORY_QUEUE_MAX", "20000"))
+
+# Дедупликация: строку не пишем, если ни одна цена не сдвинулась больше чем
+# на HISTORY_DEDUP_EPSILON (относительно, 0 — только точное совпадение),
+# но не реже чем раз в HISTORY_HEARTBEAT_SECONDS. HISTORY_DEDUP=0 — писать всё.
+HISTORY_DEDUP = os.environ.get("HISTORY_DEDUP", "1") == "1"
+HISTORY_DEDUP_EPSILON = float(os.environ.get("HISTORY_DEDUP_EPSILON", "0"))
+HISTORY_HEARTBEAT_SECONDS = float(os.environ.get("HISTORY_HEARTBEAT_SECONDS", "60"))
+
+# Ценовые колонки истории, которые агрегируем в OHLC
+PRICE_COLUMNS = ("mexc_bid", "mexc_ask", "matcha_price", "pancake_price", "spread")
+# Сколько строк за раз читаем серверным курсором при потоковой выдаче
+HISTORY_STREAM_CHUNK = int(os.environ.get("HISTORY_STREAM_CHUNK", "2000"))
+
+
+def calc_spread(mexc_bid: Optional[float], mexc_ask: Optional[float]) -> Optional[float]:
+    """Спред между bid и ask на MEXC в процентах."""
+    if mexc_bid is not None and mexc_ask is not None and mexc_bid > 0:
+        return ((mexc_ask - mexc_bid) / mexc_bid) * 100
+    return None
+
+
+def prices_moved(
+    previous: Tuple[Optional[float], ...],
+    current: Tuple[Optional[float], ...],
+    epsilon: float = HISTORY_DEDUP_EPSILON,
+) -> bool:
+    """Сдвинулась ли хоть одна цена больше чем на epsilon (относительно)."""
+    for a, b in zip(previous, current):
+        if a is None or b is None:
+            if a is not b:
+                return True
+            continue
+        if abs(a - b) > epsilon * max(abs(a), abs(b)):
+            return True
+    return False
+
+
 def save_price_history(
     db: Session,
     token_id: int,
@@ -33,18 +82,13 @@ def save_price_history(
         Созданная запись PriceHistory или None при ошибке
     """
     try:
-        # Вычисляем спред если есть bid и ask
-        spread = None
-        if mexc_bid is not None and mexc_ask is not None and mexc_bid > 0:
-            spread = ((mexc_ask - mexc_bid) / mexc_bid) * 100
-        
         history = PriceHistory(
             token_id=token_id,
             mexc_bid=mexc_bid,
             mexc_ask=mexc_ask,
             matcha_price=matcha_price,
             pancake_price=pancake_price,
-            spread=spread
+            spread=calc_spread(mexc_bid, mexc_ask)
         )
         
         db.add(history)
@@ -54,16 +98,204 @@ def save_price_history(
         return history
     
     except Exception as e:
-        log(f"Error saving price history: {e}")
+        log(f"Error saving price history: {e}", level="error")
         db.rollback()
         return None
 
 
+class PriceHistoryWriter:
+    """
+    Буферизованная запись истории цен.
+
+    Строки копятся в очереди и пишутся одним многострочным INSERT
+    каждые HISTORY_FLUSH_ROWS строк или HISTORY_FLUSH_INTERVAL_MS мс.
+    Если очередь заполнена — add() ждёт (backpressure).
+    При остановке идущая запись доводится до конца, остаток очереди
+    дописывается в БД, а add() после stop() ничего не делает.
+
+    Для каждого token_id помним последние записанные цены: повтор тех же
+    цен не пишется, кроме «пульса» раз в HISTORY_HEARTBEAT_SECONDS.
+    Цены запоминаются при постановке в очередь; если пачка не записалась,
+    память по её токенам сбрасывается, и следующая котировка пишется заново.
+    """
+
+    def __init__(
+        self,
+        flush_rows: int = HISTORY_FLUSH_ROWS,
+        flush_interval_ms: int = HISTORY_FLUSH_INTERVAL_MS,
+        queue_max: int = HISTORY_QUEUE_MAX,
+    ):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.queue_max = queue_max
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        # Текущая запись в потоке; stop() её не отменяет, а дожидается
+        self._write: Optional[asyncio.Future] = None
+        self._stopped = False
+        self.written = 0
+        self.dropped = 0
+        self.skipped = 0
+        # token_id -> (цены последней записанной строки, когда записана)
+        self._last_written: Dict[int, Tuple[Tuple[Optional[float], ...], float]] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def qsize(self) -> int:
+        """Сколько строк ждёт записи."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._batch)
+
+    def start(self) -> None:
+        """Запустить фоновую запись (вызывается в startup_event)."""
+        if self._task is None:
+            self._stopped = False
+            self._queue = asyncio.Queue(maxsize=self.queue_max)
+            self._task = asyncio.create_task(self._run())
+
+    def _should_write(self, token_id: int, prices: Tuple[Optional[float], ...]) -> bool:
+        """Проверка дедупликации; при положительном ответе запоминает цены."""
+        if not HISTORY_DEDUP:
+            return True
+        now = time.monotonic()
+        last = self._last_written.get(token_id)
+        if (
+            last is not None
+            and now - last[1] < HISTORY_HEARTBEAT_SECONDS
+            and not prices_moved(last[0], prices)
+        ):
+            self.skipped += 1
+            return False
+        self._last_written[token_id] = (prices, now)
+        return True
+
+    async def add(
+        self,
+        token_id: int,
+        mexc_bid: Optional[float] = None,
+        mexc_ask: Optional[float] = None,
+        matcha_price: Optional[float] = None,
+        pancake_price: Optional[float] = None,
+    ) -> bool:
+        """
+        Поставить строку истории в очередь на запись.
+        Если writer не запущен (скрипты, тесты) — пишем сразу.
+        Неизменившиеся цены пропускаются (см. HISTORY_DEDUP) —
+        тогда возвращает False. После stop() строки не принимаются
+        (тоже False).
+        """
+        if self._stopped:
+            return False
+        if not self._should_write(token_id, (mexc_bid, mexc_ask, matcha_price, pancake_price)):
+            return False
+
+        row = {
+            "token_id": token_id,
+            "mexc_bid": mexc_bid,
+            "mexc_ask": mexc_ask,
+            "matcha_price": matcha_price,
+            "pancake_price": pancake_price,
+            "spread": calc_spread(mexc_bid, mexc_ask),
+            "created_at": datetime.now(timezone.utc),
+        }
+        if self._queue is None:
+            await asyncio.to_thread(self._write_rows, [row])
+            return True
+        await self._queue.put(row)
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.flush_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            rows, self._batch = self._batch, []
+            # shield: отмена _run не прерывает запись, stop() её дождётся
+            self._write = asyncio.ensure_future(asyncio.to_thread(self._write_rows, rows))
+            await asyncio.shield(self._write)
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """Записать пачку строк одним INSERT (выполняется в потоке)."""
+        if not rows:
+            return
+        db = SessionLocal()
+        try:
+            db.execute(insert(PriceHistory), rows)
+            db.commit()
+            self.written += len(rows)
+        except Exception as e:
+            log(f"Error bulk saving price history ({len(rows)} rows): {e}", level="error")
+            db.rollback()
+            self.dropped += len(rows)
+            # Эти цены в БД не попали — не считаем их записанными
+            for row in rows:
+                self._last_written.pop(row["token_id"], None)
+        finally:
+            db.close()
+
+    async def stop(self) -> None:
+        """Остановить запись и дописать всё, что осталось в очереди."""
+        if self._task is None:
+            return
+        self._stopped = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._write is not None:
+            await self._write
+            self._write = None
+
+        # add(), ждавшие места в полной очереди, докладывают строки по мере
+        # её опустошения — забираем, пока очередь не останется пустой
+        drained = 0
+        rows, self._batch = self._batch, []
+        while True:
+            while not self._queue.empty():
+                rows.append(self._queue.get_nowait())
+            if not rows:
+                break
+            for i in range(0, len(rows), self.flush_rows):
+                await asyncio.to_thread(self._write_rows, rows[i:i + self.flush_rows])
+            drained += len(rows)
+            rows = []
+        self._queue = None
+        if drained:
+            log(f"Price history writer: drained {drained} rows on shutdown")
+
+
+# Глобальный writer процесса
+history_writer = PriceHistoryWriter()
+
+
+def _history_query(db: Session, token_id: int):
+    """Только нужные колонки, без ORM-объектов (см. индекс token_id, created_at)."""
+    return db.query(
+        PriceHistory.created_at,
+        *(getattr(PriceHistory, name) for name in PRICE_COLUMNS),
+    ).filter(PriceHistory.token_id == token_id)
+
+
 def get_price_history(
     db: Session,
     token_id: int,
     hours: int = 24
-) -> List[PriceHistory]:
+) -> List[Row]:
     """
     Получить историю цен за последние N часов.
     
@@ -73,27 +305,27 @@ def get_price_history(
         hours: Количество часов истории (по умолчанию 24)
     
     Returns:
-        Список записей PriceHistory, отсортированный по времени
+        Строки (created_at, mexc_bid, mexc_ask, matcha_price, pancake_price,
+        spread), отсортированные по времени
     """
     try:
-        since = datetime.utcnow() - timedelta(hours=hours)
+        since = datetime.now(timezone.utc) - timedelta(hours=hours)
         
-        history = db.query(PriceHistory).filter(
-            PriceHistory.token_id == token_id,
+        history = _history_query(db, token_id).filter(
             PriceHistory.created_at >= since
         ).order_by(PriceHistory.created_at.asc()).all()
         
         return history
     
     except Exception as e:
-        log(f"Error getting price history: {e}")
+        log(f"Error getting price history: {e}", level="error")
         return []
 
 
 def get_price_history_all(
     db: Session,
     token_id: int
-) -> List[PriceHistory]:
+) -> List[Row]:
     """
     Получить всю историю цен для токена.
     
@@ -102,17 +334,140 @@ def get_price_history_all(
         token_id: ID токена
     
     Returns:
-        Список всех записей PriceHistory, отсортированный по времени
+        Строки (created_at, mexc_bid, ...), отсортированные по времени
     """
     try:
-        history = db.query(PriceHistory).filter(
-            PriceHistory.token_id == token_id
-        ).order_by(PriceHistory.created_at.asc()).all()
+        history = _history_query(db, token_id).order_by(
+            PriceHistory.created_at.asc()
+        ).all()
         
         return history
     
     except Exception as e:
-        log(f"Error getting all price history: {e}")
+        log(f"Error getting all price history: {e}", level="error")
+        return []
+
+
+def iter_price_history_rows(
+    db: Session,
+    token_id: int,
+    hours: Optional[int] = None,
+    chunk_size: int = HISTORY_STREAM_CHUNK,
+) -> Iterator[Tuple]:
+    """
+    Читать историю цен серверным курсором, по chunk_size строк за раз.
+
+    Отдаёт кортежи (created_at, mexc_bid, mexc_ask, matcha_price,
+    pancake_price, spread) без ORM-объектов — память не растёт
+    с размером истории.
+    """
+    query = _history_query(db, token_id)
+    if hours is not None:
+        since = datetime.now(timezone.utc) - timedelta(hours=hours)
+        query = query.filter(PriceHistory.created_at >= since)
+
+    yield from query.order_by(PriceHistory.created_at.asc()).yield_per(chunk_size)
+
+
+def pick_bucket_seconds(
+    db: Session,
+    token_id: int,
+    hours: Optional[int] = None,
+    resolution: Optional[int] = None,
+    max_points: Optional[int] = None,
+) -> int:
+    """
+    Подобрать размер корзины (секунды) для агрегации истории.
+
+    resolution — желаемый размер корзины; max_points — ограничение числа
+    точек, по нему корзина увеличивается так, чтобы весь диапазон
+    уложился в max_points корзин.
+    """
+    bucket = max(int(resolution or 1), 1)
+    if not max_points:
+        return bucket
+
+    if hours is not None:
+        span = hours * 3600
+    else:
+        first, last = db.query(
+            func.min(PriceHistory.created_at),
+            func.max(PriceHistory.created_at),
+        ).filter(PriceHistory.token_id == token_id).one()
+        if first is None or last is None:
+            return bucket
+        span = (last - first).total_seconds()
+
+    return max(bucket, int(math.ceil(span / max(max_points, 1))))
+
+
+def _first_value(col, ascending: bool = True):
+    """Первое (или последнее) непустое значение колонки в корзине по времени."""
+    order = PriceHistory.created_at.asc() if ascending else PriceHistory.created_at.desc()
+    return func.array_agg(
+        aggregate_order_by(col, order), type_=ARRAY(Float)
+    ).filter(col.isnot(None))[1]
+
+
+def get_price_history_buckets(
+    db: Session,
+    token_id: int,
+    bucket_seconds: int,
+    hours: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Получить историю цен, агрегированную в OHLC-корзины на стороне Postgres.
+
+    Args:
+        db: Сессия БД
+        token_id: ID токена
+        bucket_seconds: Размер корзины в секундах
+        hours: Количество часов истории (None — вся история)
+
+    Returns:
+        Список словарей {"timestamp", "count", <колонка>: {open, high, low, close}},
+        отсортированный по времени
+    """
+    try:
+        bucket = func.floor(
+            func.extract("epoch", PriceHistory.created_at) / bucket_seconds
+        ).label("bucket")
+
+        columns = [bucket, func.count().label("count")]
+        for name in PRICE_COLUMNS:
+            col = getattr(PriceHistory, name)
+            columns += [
+                _first_value(col, ascending=True).label(f"{name}_open"),
+                func.max(col).label(f"{name}_high"),
+                func.min(col).label(f"{name}_low"),
+                _first_value(col, ascending=False).label(f"{name}_close"),
+            ]
+
+        query = db.query(*columns).filter(PriceHistory.token_id == token_id)
+        if hours is not None:
+            since = datetime.now(timezone.utc) - timedelta(hours=hours)
+            query = query.filter(PriceHistory.created_at >= since)
+        rows = query.group_by(bucket).order_by(bucket.asc()).all()
+
+        result = []
+        for row in rows:
+            item: Dict[str, Any] = {
+                "timestamp": datetime.fromtimestamp(int(row.bucket) * bucket_seconds, tz=timezone.utc),
+                "count": row.count,
+            }
+            for name in PRICE_COLUMNS:
+                ohlc = {
+                    "open": getattr(row, f"{name}_open"),
+                    "high": getattr(row, f"{name}_high"),
+                    "low": getattr(row, f"{name}_low"),
+                    "close": getattr(row, f"{name}_close"),
+                }
+                item[name] = ohlc if ohlc["close"] is not None else None
+            result.append(item)
+        return result
+
+    except Exception as e:
+        log(f"Error getting bucketed price history: {e}", level="error")
         return []
 
 
@@ -132,7 +487,7 @@ def get_token_by_name(db: Session, token_name: str) -> Optional[Token]:
         return token
     
     except Exception as e:
-        log(f"Error getting token by name: {e}")
+        log(f"Error getting token by name: {e}", level="error")
         return None
 
 
@@ -179,6 +534,6 @@ def create_or_get_token(
         return token
     
     except Exception as e:
-        log(f"Error creating/getting token: {e}")
+        log(f"Error creating/getting token: {e}", level="error")
         db.rollback()
         return None
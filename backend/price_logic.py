@@ -1,23 +1,90 @@
+import asyncio
+import os
+import time
 import cloudscraper
 import httpx
 from datetime import datetime
-from typing import Optional, Tuple
-from sqlalchemy.orm import Session
+from typing import Optional, Tuple, Dict, Any
 
 from .logic import log
-from .proxy_manager import ProxyManager
+from .proxy_manager import ProxyManager, proxy_pool
+from .http_pool import get_http_pool
+from .single_flight import venue_flight
+from .rate_limiter import venue_scheduler
+from .metrics import observe_upstream, upstream_outcome
 
 
-def get_http_client_with_proxy(proxy_dict: dict):
+# Общий дедлайн на опрос всех площадок в одном запросе (секунды)
+PRICES_DEADLINE = float(os.environ.get("PRICES_DEADLINE", "8"))
+
+
+def get_http_client_with_proxy(proxy_dict: dict) -> httpx.AsyncClient:
     """
-    Создать httpx AsyncClient с прокси.
+    Получить httpx AsyncClient с прокси из общего пула.
+    Клиент переиспользуется между запросами — закрывать его не нужно.
     """
+    proxy_url = None
     if proxy_dict:
         # Берем первый прокси из словаря (они одинаковые для http и https)
-        proxy_url = list(proxy_dict.values())[0] if proxy_dict else None
-        return httpx.AsyncClient(proxy=proxy_url, timeout=10)
-    else:
-        return httpx.AsyncClient(timeout=10)
+        proxy_url = list(proxy_dict.values())[0]
+    return get_http_pool().get_client(proxy_url)
+
+
+async def proxied_get(
+    venue: str,
+    url: str,
+    use_proxy: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """
+    GET через прокси, выбранный по здоровью для этой площадки.
+    Результат (успех/ошибка и задержка) сообщаем в пул прокси.
+
+    use_proxy=False — запрос напрямую, без пула прокси.
+
+    Прокси выбирается до ожидания лимита (предпочтительно тот, у кого в
+    ведре venue_scheduler есть токен), затем ждём токен именно этого IP,
+    после — сообщаем ему код ответа.
+    Задержка и исход запроса уходят в метрики (по площадке и по прокси).
+    """
+    proxy_url = None
+    if use_proxy:
+        # Список прокси перечитывается в потоке, выбор — в памяти
+        await proxy_pool.ensure_loaded()
+        proxy_url = proxy_pool.choose(venue=venue)
+        ProxyManager.log_proxy_usage(proxy_url)
+    proxy_host = ProxyManager.get_proxy_safe_host(proxy_url) if proxy_url else None
+    limiter = venue_scheduler.get(venue, proxy_host)
+    await limiter.acquire()
+
+    http_client = get_http_client_with_proxy(
+        {"http://": proxy_url, "https://": proxy_url} if proxy_url else {}
+    )
+
+    started = time.monotonic()
+    ok = False
+    # Отмена по дедлайну запроса — не ошибка площадки
+    outcome = "cancelled"
+    try:
+        r = await http_client.get(url, **kwargs)
+        limiter.feedback(r.status_code, r.headers.get("Retry-After"))
+        # 403/429 и 5xx — проблема прокси/лимитов, а не данных
+        ok = r.status_code < 500 and r.status_code not in (403, 429)
+        outcome = upstream_outcome(r.status_code)
+        return r
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        if use_proxy:
+            proxy_pool.report(proxy_url, venue, ok, elapsed)
+        observe_upstream(
+            venue,
+            elapsed,
+            outcome,
+            proxy_host,
+        )
 
 
 # ... MEXC UTILS ---
@@ -52,11 +119,11 @@ def normalize_mexc_symbol(token: str) -> str:
 
 
 # ... MEXC ---
-def get_mexc_price(
+async def get_mexc_price(
     base: str,
     quote: str = "USDT",
     price_scale: int = 0,
-    db: Optional[Session] = None
+    use_proxy: bool = False
 ) -> Tuple[Optional[float], Optional[float]]:
     """
     Получить цену с MEXC через прокси.
@@ -65,46 +132,57 @@ def get_mexc_price(
         base: Базовая монета (SOL, BTC и т.д.)
         quote: Котируемая монета (USDT по умолчанию)
         price_scale: Количество знаков после запятой
-        db: Сессия БД для получения прокси
+        use_proxy: Ходить через пул прокси
 
     Returns:
         (bid_price, ask_price) или (None, None) при ошибке
+
+    Одинаковые одновременные запросы уходят наружу один раз (venue_flight).
     """
     # КРИТИЧНО: Нормализуем символ перед отправкой на MEXC
     normalized_base = normalize_mexc_symbol(base)
     if not normalized_base:
-        log(f"MEXC error: Invalid base symbol: {base}")
+        log(f"MEXC error: Invalid base symbol: {base}", level="warning", event="mexc_bad_symbol")
         return None, None
 
+    # Сначала — снимок всех тикеров MEXC (один запрос на всех)
+    if quote.upper() == "USDT":
+        from .mexc_snapshot import mexc_snapshot
+        book = mexc_snapshot.get_book(normalized_base)
+        if book is not None and None not in book:
+            bid, ask = book
+            if price_scale:
+                bid = round(bid, price_scale)
+                ask = round(ask, price_scale)
+            return bid, ask
+
+    symbol = f"{normalized_base}_{quote.upper()}"
+    return await venue_flight.do(
+        ("mexc", symbol, price_scale or 0),
+        lambda: _fetch_mexc_price(symbol, price_scale, use_proxy),
+    )
+
+
+async def _fetch_mexc_price(
+    symbol: str,
+    price_scale: int = 0,
+    use_proxy: bool = False
+) -> Tuple[Optional[float], Optional[float]]:
+    """Запрос bookTicker к MEXC (без объединения, см. get_mexc_price)."""
     try:
-        # Получаем прокси из БД
-        proxy_dict = {}
-        proxy_url = None
-        if db:
-            proxy_manager = ProxyManager(db)
-            proxy_url = proxy_manager.get_random_proxy()
-            # ИСПРАВЛЕНО: Передаём proxy_url в log_proxy_usage
-            proxy_manager.log_proxy_usage(proxy_url)
-            if proxy_url:
-                proxy_dict = {
-                    "http://": proxy_url,
-                    "https://": proxy_url
-                }
-
-        # Создаём клиент с прокси
-        http_client = get_http_client_with_proxy(proxy_dict)
-
-        # ИСПРАВЛЕНО: Используем нормализованный символ
-        symbol = f"{normalized_base}_{quote.upper()}"
-
-        r = http_client.get(
+        r = await proxied_get(
+            "mexc",
             "https://api.mexc.com/api/v3/ticker/bookTicker",
+            use_proxy,
             params={"symbol": symbol},
             timeout=10,
         )
 
         if r.status_code != 200:
-            log(f"MEXC HTTP {r.status_code} для {symbol}: {str(r.text)[:200]}")
+            log(
+                f"MEXC HTTP {r.status_code} для {symbol}: {str(r.text)[:200]}",
+                level="warning", event="upstream_http_error", venue="mexc", status=r.status_code,
+            )
             return None, None
 
         j = r.json()
@@ -118,43 +196,40 @@ def get_mexc_price(
         return bid, ask
 
     except Exception as e:
-        log(f"MEXC error: {e}")
+        log(f"MEXC error: {e}", level="warning", event="upstream_error", venue="mexc")
         return None, None
 
 
 # --- Matcha (0x) ---
-def get_matcha_price_usdt(
+async def get_matcha_price_usdt(
     addr: str,
     decimals: int,
-    db: Optional[Session] = None
+    use_proxy: bool = False
 ) -> Optional[float]:
     """
     Получить цену токена в USDT через Matcha (0x) через прокси.
     """
-    addr = (addr or "").strip()
+    addr = (addr or "").strip().lower()
     if not addr:
         return None
 
+    return await venue_flight.do(
+        ("matcha", addr, decimals),
+        lambda: _fetch_matcha_price(addr, decimals, use_proxy),
+    )
+
+
+async def _fetch_matcha_price(
+    addr: str,
+    decimals: int,
+    use_proxy: bool = False
+) -> Optional[float]:
+    """Запрос цены к Matcha (без объединения, см. get_matcha_price_usdt)."""
     try:
-        # Получаем прокси из БД
-        proxy_dict = {}
-        proxy_url = None
-        if db:
-            proxy_manager = ProxyManager(db)
-            proxy_url = proxy_manager.get_random_proxy()
-            # ИСПРАВЛЕНО: Передаём proxy_url в log_proxy_usage
-            proxy_manager.log_proxy_usage(proxy_url)
-            if proxy_url:
-                proxy_dict = {
-                    "http://": proxy_url,
-                    "https://": proxy_url
-                }
-
-        # Создаём клиент с прокси
-        http_client = get_http_client_with_proxy(proxy_dict)
-
-        r = http_client.get(
+        r = await proxied_get(
+            "matcha",
             "https://api.matcha.xyz/api/gasless/price",
+            use_proxy,
             params={
                 "sellTokenAddress": addr,
                 "buyTokenAddress": "0xfde4c96c8593536e31f229ea8f37b2ada2699bb2",  # USDT
@@ -165,7 +240,10 @@ def get_matcha_price_usdt(
         )
 
         if r.status_code != 200:
-            log(f"Matcha: HTTP {r.status_code} для {addr}")
+            log(
+                f"Matcha: HTTP {r.status_code} для {addr}",
+                level="warning", event="upstream_http_error", venue="matcha", status=r.status_code,
+            )
             return None
 
         j = r.json()
@@ -173,47 +251,46 @@ def get_matcha_price_usdt(
         return price if price > 0 else None
 
     except Exception as e:
-        log(f"Matcha error: {e}")
+        log(f"Matcha error: {e}", level="warning", event="upstream_error", venue="matcha")
         return None
 
 
 # --- PancakeSwap (BSC) ---
-def get_pancake_price_usdt(
+async def get_pancake_price_usdt(
     addr: str,
-    db: Optional[Session] = None
+    use_proxy: bool = False
 ) -> Optional[float]:
     """
     Получить цену токена в USDT через PancakeSwap (BSC) через прокси.
     """
-    addr = (addr or "").strip()
+    addr = (addr or "").strip().lower()
     if not addr:
         return None
 
+    return await venue_flight.do(
+        ("pancake", addr, None),
+        lambda: _fetch_pancake_price(addr, use_proxy),
+    )
+
+
+async def _fetch_pancake_price(
+    addr: str,
+    use_proxy: bool = False
+) -> Optional[float]:
+    """Запрос цены к DexScreener (без объединения, см. get_pancake_price_usdt)."""
     try:
-        # Получаем прокси из БД
-        proxy_dict = {}
-        proxy_url = None
-        if db:
-            proxy_manager = ProxyManager(db)
-            proxy_url = proxy_manager.get_random_proxy()
-            # ИСПРАВЛЕНО: Передаём proxy_url в log_proxy_usage
-            proxy_manager.log_proxy_usage(proxy_url)
-            if proxy_url:
-                proxy_dict = {
-                    "http://": proxy_url,
-                    "https://": proxy_url
-                }
-
-        # Создаём клиент с прокси
-        http_client = get_http_client_with_proxy(proxy_dict)
-
-        r = http_client.get(
+        r = await proxied_get(
+            "pancake",
             "https://api.dexscreener.com/latest/dex/tokens/bsc/" + addr,
+            use_proxy,
             timeout=10,
         )
 
         if r.status_code != 200:
-            log(f"PancakeSwap: HTTP {r.status_code} для {addr}")
+            log(
+                f"PancakeSwap: HTTP {r.status_code} для {addr}",
+                level="warning", event="upstream_http_error", venue="pancake", status=r.status_code,
+            )
             return None
 
         j = r.json()
@@ -230,5 +307,114 @@ def get_pancake_price_usdt(
         return price if price > 0 else None
 
     except Exception as e:
-        log(f"PancakeSwap error: {e}")
+        log(f"PancakeSwap error: {e}", level="warning", event="upstream_error", venue="pancake")
         return None
+
+
+# --- Параллельный опрос всех площадок ---
+# Лимит одновременных запросов к одной площадке при пакетном опросе
+VENUE_CONCURRENCY = int(os.environ.get("VENUE_CONCURRENCY", "10"))
+
+VENUES = ("mexc", "matcha", "pancake")
+
+
+def make_venue_semaphores(limit: int = VENUE_CONCURRENCY) -> Dict[str, asyncio.Semaphore]:
+    """Семафоры по площадкам для пакетного опроса многих пар."""
+    return {venue: asyncio.Semaphore(limit) for venue in VENUES}
+
+
+async def _venue_call(
+    coro,
+    deadline: float,
+    semaphore: Optional[asyncio.Semaphore] = None,
+):
+    """
+    Вызов одной площадки до дедлайна deadline (время loop.time()).
+    Ожидание семафора входит в дедлайн: пара из хвоста пакета не ждёт
+    дольше, чем весь пакет.
+    """
+    remaining = deadline - asyncio.get_running_loop().time()
+    if remaining <= 0:
+        coro.close()
+        raise asyncio.TimeoutError()
+
+    async def call():
+        try:
+            if semaphore is None:
+                return await coro
+            async with semaphore:
+                return await coro
+        finally:
+            # Дедлайн наступил ещё в очереди семафора — запрос так и не начат
+            coro.close()
+
+    return await asyncio.wait_for(call(), remaining)
+
+
+async def fetch_venue_prices(
+    base: str,
+    price_scale: int = 0,
+    matcha_addr: Optional[str] = None,
+    matcha_decimals: Optional[int] = None,
+    pancake_addr: Optional[str] = None,
+    use_proxy: bool = False,
+    timeout: Optional[float] = None,
+    semaphores: Optional[Dict[str, asyncio.Semaphore]] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Опросить MEXC, Matcha и PancakeSwap одновременно с общим дедлайном.
+
+    Задержка равна самой медленной площадке, а не сумме всех трёх.
+    Если какая-то площадка не успела к дедлайну — её цена будет None,
+    остальные цены всё равно возвращаются.
+
+    semaphores: лимиты по площадкам (см. make_venue_semaphores) для
+    пакетного опроса. deadline: общий дедлайн пакета (loop.time() + timeout),
+    ожидание семафора в него входит; без него дедлайн — timeout от вызова.
+
+    Returns:
+        {"mexc_bid", "mexc_ask", "matcha_price", "pancake_price"}
+    """
+    if timeout is None:
+        timeout = PRICES_DEADLINE
+    if deadline is None:
+        deadline = asyncio.get_running_loop().time() + timeout
+    semaphores = semaphores or {}
+
+    calls = {
+        "mexc": get_mexc_price(base, "USDT", price_scale, use_proxy=use_proxy),
+    }
+    if matcha_addr:
+        calls["matcha"] = get_matcha_price_usdt(matcha_addr, matcha_decimals or 18, use_proxy=use_proxy)
+    if pancake_addr:
+        calls["pancake"] = get_pancake_price_usdt(pancake_addr, use_proxy=use_proxy)
+
+    outcomes = await asyncio.gather(
+        *(
+            _venue_call(coro, deadline, semaphores.get(venue))
+            for venue, coro in calls.items()
+        ),
+        return_exceptions=True,
+    )
+
+    results: Dict[str, Any] = {}
+    for venue, outcome in zip(calls, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            log(
+                f"{venue}: не уложились в дедлайн {timeout}s для {base}",
+                level="warning", event="venue_deadline", venue=venue,
+            )
+            outcome = None
+        elif isinstance(outcome, BaseException):
+            log(f"{venue}: error for {base}: {outcome}", level="error", event="venue_error", venue=venue)
+            outcome = None
+        results[venue] = outcome
+
+    mexc_bid, mexc_ask = results.get("mexc") or (None, None)
+    return {
+        "mexc_bid": mexc_bid,
+        "mexc_ask": mexc_ask,
+        "matcha_price": results.get("matcha"),
+        "pancake_price": results.get("pancake"),
+    }
@@ -0,0 +1,101 @@
+# backend/price_poller.py
+"""
+Фоновый сборщик цен.
+
+Раз в PRICE_POLL_INTERVAL секунд опрашивает все активные токены из таблицы
+tokens, кладёт результат в quote_store и пишет историю. /api/prices отдаёт
+свежие котировки из хранилища, не дёргая биржи на каждый запрос клиента.
+"""
+
+import asyncio
+import os
+
+from .db import SessionLocal
+from .models import Token
+from .logic import log
+from .rate_limiter import set_background_priority
+from .price_logic import fetch_venue_prices
+from .price_history import history_writer
+from .quote_store import Quote, quote_store
+
+
+# Интервал опроса (секунды)
+PRICE_POLL_INTERVAL = float(os.environ.get("PRICE_POLL_INTERVAL", "5"))
+# Сколько секунд котировка из хранилища считается свежей
+PRICE_QUOTE_MAX_AGE = float(os.environ.get("PRICE_QUOTE_MAX_AGE", "10"))
+# Сколько токенов опрашиваем одновременно
+PRICE_POLL_CONCURRENCY = int(os.environ.get("PRICE_POLL_CONCURRENCY", "20"))
+
+
+async def poll_token(token: Token) -> Quote:
+    """Опросить все площадки для одного токена и положить результат в хранилище."""
+    prices = await fetch_venue_prices(
+        token.base,
+        price_scale=token.mexc_price_scale or 0,
+        matcha_addr=token.matcha_address,
+        matcha_decimals=token.matcha_decimals,
+        pancake_addr=token.bsc_address,
+        use_proxy=True,
+    )
+    quote = Quote(
+        name=token.name,
+        mexc_price_scale=token.mexc_price_scale,
+        matcha_address=token.matcha_address,
+        bsc_address=token.bsc_address,
+        **prices,
+    )
+    quote_store.put(quote)
+    return quote
+
+
+async def poll_all_tokens() -> int:
+    """
+    Один цикл опроса всех активных токенов.
+    Возвращает количество опрошенных токенов.
+    """
+    db = SessionLocal()
+    try:
+        tokens = await asyncio.to_thread(
+            lambda: db.query(Token).filter(Token.is_active == True).all()
+        )
+    finally:
+        db.close()
+    if not tokens:
+        return 0
+
+    semaphore = asyncio.Semaphore(PRICE_POLL_CONCURRENCY)
+
+    async def poll_one(token: Token):
+        async with semaphore:
+            try:
+                quote = await poll_token(token)
+            except Exception as e:
+                log(f"Price poller: error for {token.name}: {e}", level="warning")
+                return
+            await history_writer.add(
+                token_id=token.id,
+                mexc_bid=quote.mexc_bid,
+                mexc_ask=quote.mexc_ask,
+                matcha_price=quote.matcha_price,
+                pancake_price=quote.pancake_price,
+            )
+
+    await asyncio.gather(*(poll_one(t) for t in tokens))
+    return len(tokens)
+
+
+async def price_poller_loop() -> None:
+    """Бесконечный цикл опроса. Запускается в startup_event."""
+    log(f"Price poller: started, interval={PRICE_POLL_INTERVAL}s")
+    set_background_priority()
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        try:
+            await poll_all_tokens()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"Price poller: cycle error: {e}", level="error")
+        elapsed = loop.time() - started
+        await asyncio.sleep(max(PRICE_POLL_INTERVAL - elapsed, 0.0))
@@ -0,0 +1,364 @@
+# backend/price_rollups.py
+"""
+Многоуровневое хранение истории цен (только PostgreSQL).
+
+Сырые записи price_history живут PRICE_HISTORY_RETENTION_HOURS (2 дня),
+а фоновая задача сворачивает их в агрегаты:
+
+    price_history    -> price_history_1m   (хранится ROLLUP_1M_RETENTION_HOURS)
+    price_history_1m -> price_history_15m  (ROLLUP_15M_RETENTION_HOURS)
+    price_history_15m -> price_history_1h  (ROLLUP_1H_RETENTION_HOURS)
+
+Каждый уровень пересчитывается от своей последней (возможно неполной)
+корзины до текущего момента через INSERT ... ON CONFLICT DO UPDATE,
+поэтому запуск идемпотентен и догоняет пропуски после простоя.
+
+Запросы истории берут самый дешёвый уровень, который покрывает нужный
+период (pick_rollup_tier): сырые строки, пока их хватает, дальше — агрегаты.
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Type
+
+from sqlalchemy import func, select, delete, Float
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal, engine
+from .logic import log
+from .models import (
+    PriceHistory,
+    PriceHistory1m,
+    PriceHistory15m,
+    PriceHistory1h,
+    ROLLUP_PRICE_COLUMNS,
+)
+from .history_partitions import is_postgres, PRICE_HISTORY_RETENTION_HOURS
+from .price_history import pick_bucket_seconds
+
+
+# Агрегаты работают только в PostgreSQL; ROLLUPS_ENABLED=0 — всё из сырых данных
+ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "1") == "1" and is_postgres(engine)
+# Как часто сворачиваем свежие данные (секунды)
+ROLLUP_INTERVAL = float(os.environ.get("ROLLUP_INTERVAL", "60"))
+ROLLUP_1M_RETENTION_HOURS = float(os.environ.get("ROLLUP_1M_RETENTION_HOURS", str(14 * 24)))
+ROLLUP_15M_RETENTION_HOURS = float(os.environ.get("ROLLUP_15M_RETENTION_HOURS", str(90 * 24)))
+ROLLUP_1H_RETENTION_HOURS = float(os.environ.get("ROLLUP_1H_RETENTION_HOURS", str(730 * 24)))
+
+
+@dataclass(frozen=True)
+class RollupTier:
+    name: str
+    model: Type
+    seconds: int
+    retention_hours: float
+    source: Optional[Type]  # None — сырые price_history
+
+
+ROLLUP_TIERS: Tuple[RollupTier, ...] = (
+    RollupTier("1m", PriceHistory1m, 60, ROLLUP_1M_RETENTION_HOURS, None),
+    RollupTier("15m", PriceHistory15m, 900, ROLLUP_15M_RETENTION_HOURS, PriceHistory1m),
+    RollupTier("1h", PriceHistory1h, 3600, ROLLUP_1H_RETENTION_HOURS, PriceHistory15m),
+)
+
+
+def _bucket_expr(ts, seconds: int):
+    """Начало корзины: to_timestamp(floor(epoch / seconds) * seconds)."""
+    return func.to_timestamp(
+        func.floor(func.extract("epoch", ts) / seconds) * seconds
+    )
+
+
+def _ordered_first(col, order):
+    """Первое непустое значение колонки по заданному порядку."""
+    return func.array_agg(
+        aggregate_order_by(col, order), type_=ARRAY(Float)
+    ).filter(col.isnot(None))[1]
+
+
+def _aggregate_columns(tier: RollupTier) -> List:
+    """SELECT-часть для свёртки источника в корзины уровня tier."""
+    if tier.source is None:
+        src = PriceHistory
+        ts = PriceHistory.created_at
+        columns = [func.count().label("samples")]
+        for name in ROLLUP_PRICE_COLUMNS:
+            col = getattr(src, name)
+            columns += [
+                _ordered_first(col, ts.asc()).label(f"{name}_first"),
+                func.min(col).label(f"{name}_min"),
+                func.max(col).label(f"{name}_max"),
+                func.avg(col).label(f"{name}_avg"),
+                _ordered_first(col, ts.desc()).label(f"{name}_last"),
+            ]
+        return columns
+
+    src = tier.source
+    ts = src.bucket
+    columns = [func.sum(src.samples).label("samples")]
+    for name in ROLLUP_PRICE_COLUMNS:
+        avg = getattr(src, f"{name}_avg")
+        has_avg = avg.isnot(None)
+        columns += [
+            _ordered_first(getattr(src, f"{name}_first"), ts.asc()).label(f"{name}_first"),
+            func.min(getattr(src, f"{name}_min")).label(f"{name}_min"),
+            func.max(getattr(src, f"{name}_max")).label(f"{name}_max"),
+            # Среднее, взвешенное числом сырых записей в корзинах источника
+            (
+                func.sum(avg * src.samples).filter(has_avg)
+                / func.nullif(func.sum(src.samples).filter(has_avg), 0)
+            ).label(f"{name}_avg"),
+            _ordered_first(getattr(src, f"{name}_last"), ts.desc()).label(f"{name}_last"),
+        ]
+    return columns
+
+
+def rollup_tier(db: Session, tier: RollupTier) -> int:
+    """
+    Пересчитать корзины уровня от последней сохранённой до текущего момента.
+    Возвращает число записанных корзин.
+    """
+    model = tier.model
+    last_bucket = db.query(func.max(model.bucket)).scalar()
+    if tier.source is None:
+        src_ts = PriceHistory.created_at
+        src_token = PriceHistory.token_id
+    else:
+        src_ts = tier.source.bucket
+        src_token = tier.source.token_id
+
+    if last_bucket is None:
+        start = db.query(func.min(src_ts)).scalar()
+        if start is None:
+            return 0
+    else:
+        start = last_bucket
+
+    bucket = _bucket_expr(src_ts, tier.seconds).label("bucket")
+    query = (
+        select(src_token.label("token_id"), bucket, *_aggregate_columns(tier))
+        .where(src_ts >= start)
+        .group_by(src_token, bucket)
+    )
+
+    names = [c.name for c in model.__table__.columns]
+    stmt = pg_insert(model).from_select(names, query)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.token_id, model.bucket],
+        set_={name: stmt.excluded[name] for name in names if name not in ("token_id", "bucket")},
+    )
+    written = db.execute(stmt).rowcount
+    db.commit()
+    return written
+
+
+def drop_expired_rollups(db: Session) -> Dict[str, int]:
+    """Удалить корзины старше срока хранения своего уровня (таблицы небольшие)."""
+    removed = {}
+    now = datetime.now(timezone.utc)
+    for tier in ROLLUP_TIERS:
+        cutoff = now - timedelta(hours=tier.retention_hours)
+        removed[tier.name] = db.execute(
+            delete(tier.model).where(tier.model.bucket < cutoff)
+        ).rowcount
+    db.commit()
+    return removed
+
+
+def run_rollups() -> Dict[str, int]:
+    """Один проход по всем уровням (в потоке). Возвращает число корзин по уровням."""
+    db = SessionLocal()
+    try:
+        written = {}
+        for tier in ROLLUP_TIERS:
+            written[tier.name] = rollup_tier(db, tier)
+        return written
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def price_rollup_loop() -> None:
+    """Фоновая свёртка истории. Запускается в startup_event (только PostgreSQL)."""
+    if not ROLLUPS_ENABLED:
+        log("Price rollups: disabled")
+        return
+    log(f"Price rollups: started, interval={ROLLUP_INTERVAL}s")
+    last_cleanup: Optional[float] = None
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await asyncio.to_thread(run_rollups)
+            if last_cleanup is None or loop.time() - last_cleanup >= 3600:
+                db = SessionLocal()
+                try:
+                    removed = await asyncio.to_thread(drop_expired_rollups, db)
+                finally:
+                    db.close()
+                if any(removed.values()):
+                    log(f"Price rollups: expired {removed}")
+                last_cleanup = loop.time()
+        except Exception as e:
+            log(f"Price rollups: error: {e}", level="error")
+        await asyncio.sleep(ROLLUP_INTERVAL)
+
+
+# ============= Выбор уровня и чтение =============
+
+def _covering_tier(hours: float) -> RollupTier:
+    """Самый подробный уровень, срок хранения которого покрывает период."""
+    for tier in ROLLUP_TIERS:
+        if tier.retention_hours >= hours:
+            return tier
+    # Периода длиннее не покрывает никто — берём самое долгое хранение
+    return max(ROLLUP_TIERS, key=lambda t: t.retention_hours)
+
+
+def pick_rollup_tier(
+    hours: Optional[float],
+    bucket_seconds: Optional[int] = None,
+) -> Optional[RollupTier]:
+    """
+    Самый дешёвый уровень для запроса. None — читать сырые price_history.
+
+    Без bucket_seconds (сырые точки): сырые строки, пока период укладывается
+    в их срок хранения, иначе самый подробный агрегат, покрывающий период.
+
+    С bucket_seconds (OHLC-корзины): если сырой истории не хватает —
+    самый подробный уровень, покрывающий период (корзину ответа потом
+    округляют вверх до кратной ему, см. plan_history_buckets). Дальше
+    берём самый крупный уровень, из корзин которого целиком складывается
+    корзина ответа и который тоже покрывает период.
+    Без hours (вся история) — сырые строки, как и у /history/all без корзин.
+    """
+    if not ROLLUPS_ENABLED or hours is None:
+        return None
+    if bucket_seconds is None:
+        if hours <= PRICE_HISTORY_RETENTION_HOURS:
+            return None
+        return _covering_tier(hours)
+
+    best = None
+    if hours > PRICE_HISTORY_RETENTION_HOURS:
+        best = _covering_tier(hours)
+        bucket_seconds = -(-bucket_seconds // best.seconds) * best.seconds
+    for tier in ROLLUP_TIERS:
+        if best is not None and tier.seconds <= best.seconds:
+            continue
+        if bucket_seconds % tier.seconds or tier.retention_hours < hours:
+            continue
+        best = tier
+    return best
+
+
+def plan_history_buckets(
+    db: Session,
+    token_id: int,
+    hours: Optional[float] = None,
+    resolution: Optional[int] = None,
+    max_points: Optional[int] = None,
+) -> Tuple[Optional[RollupTier], int]:
+    """
+    Уровень хранения и размер корзины (секунды) для OHLC-истории.
+    Корзина кратна ширине выбранного уровня, поэтому max_points
+    соблюдается и на агрегатах.
+    """
+    bucket = pick_bucket_seconds(
+        db, token_id, hours=hours, resolution=resolution, max_points=max_points,
+    )
+    tier = pick_rollup_tier(hours, bucket)
+    if tier is not None:
+        bucket = -(-bucket // tier.seconds) * tier.seconds
+    return tier, bucket
+
+
+def iter_rollup_rows(
+    db: Session,
+    token_id: int,
+    tier: RollupTier,
+    hours: Optional[float] = None,
+    chunk_size: int = 2000,
+) -> Iterator[Tuple]:
+    """
+    Точки уровня в формате iter_price_history_rows:
+    (bucket, mexc_bid, mexc_ask, matcha_price, pancake_price, spread) —
+    значения цен на конец корзины (last).
+    """
+    model = tier.model
+    query = db.query(
+        model.bucket.label("created_at"),
+        *(getattr(model, f"{name}_last").label(name) for name in ROLLUP_PRICE_COLUMNS),
+    ).filter(model.token_id == token_id)
+    if hours is not None:
+        since = datetime.now(timezone.utc) - timedelta(hours=hours)
+        query = query.filter(model.bucket >= since)
+    yield from query.order_by(model.bucket.asc()).yield_per(chunk_size)
+
+
+def get_rollup_history(
+    db: Session,
+    token_id: int,
+    tier: RollupTier,
+    hours: Optional[float] = None,
+) -> List[Tuple]:
+    """Как get_price_history, но из таблицы-агрегата."""
+    try:
+        return list(iter_rollup_rows(db, token_id, tier, hours=hours))
+    except Exception as e:
+        log(f"Error getting rollup history ({tier.name}): {e}", level="error")
+        return []
+
+
+def get_rollup_buckets(
+    db: Session,
+    token_id: int,
+    tier: RollupTier,
+    bucket_seconds: int,
+    hours: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Как get_price_history_buckets, но OHLC собирается из корзин уровня tier."""
+    try:
+        model = tier.model
+        bucket = func.floor(func.extract("epoch", model.bucket) / bucket_seconds).label("bucket")
+
+        columns = [bucket, func.sum(model.samples).label("count")]
+        for name in ROLLUP_PRICE_COLUMNS:
+            columns += [
+                _ordered_first(getattr(model, f"{name}_first"), model.bucket.asc()).label(f"{name}_open"),
+                func.max(getattr(model, f"{name}_max")).label(f"{name}_high"),
+                func.min(getattr(model, f"{name}_min")).label(f"{name}_low"),
+                _ordered_first(getattr(model, f"{name}_last"), model.bucket.desc()).label(f"{name}_close"),
+            ]
+
+        query = db.query(*columns).filter(model.token_id == token_id)
+        if hours is not None:
+            since = datetime.now(timezone.utc) - timedelta(hours=hours)
+            query = query.filter(model.bucket >= since)
+        rows = query.group_by(bucket).order_by(bucket.asc()).all()
+
+        result = []
+        for row in rows:
+            item: Dict[str, Any] = {
+                "timestamp": datetime.fromtimestamp(int(row.bucket) * bucket_seconds, tz=timezone.utc),
+                "count": int(row.count or 0),
+            }
+            for name in ROLLUP_PRICE_COLUMNS:
+                ohlc = {
+                    "open": getattr(row, f"{name}_open"),
+                    "high": getattr(row, f"{name}_high"),
+                    "low": getattr(row, f"{name}_low"),
+                    "close": getattr(row, f"{name}_close"),
+                }
+                item[name] = ohlc if ohlc["close"] is not None else None
+            result.append(item)
+        return result
+
+    except Exception as e:
+        log(f"Error getting rollup buckets ({tier.name}): {e}", level="error")
+        return []
+
@@ -1,26 +1,45 @@
 # backend/prices_api.py
-from fastapi import APIRouter, Depends
+import asyncio
+import json
+import os
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Union
 from sqlalchemy.orm import Session
 from datetime import datetime
 
-from .db import get_db
+from .db import get_db, SessionLocal, AsyncSessionLocal
 from .auth import verify_access_token
-from .price_logic import (
-    get_mexc_price,
-    get_matcha_price_usdt,
-    get_pancake_price_usdt,
+from .price_logic import fetch_venue_prices, make_venue_semaphores, PRICES_DEADLINE
+from .quote_store import Quote, quote_store
+from .price_poller import PRICE_QUOTE_MAX_AGE
+from .price_rollups import (
+    RollupTier,
+    pick_rollup_tier,
+    plan_history_buckets,
+    iter_rollup_rows,
+    get_rollup_history,
+    get_rollup_buckets,
 )
 from .price_history import (
-    save_price_history,
+    history_writer,
     get_price_history,
     get_price_history_all,
-    create_or_get_token,
+    get_price_history_buckets,
+    iter_price_history_rows,
+    PRICE_COLUMNS,
+    HISTORY_STREAM_CHUNK,
 )
+from .token_registry import token_registry
 
 router = APIRouter()
 
+# Максимум пар в одном POST /api/prices/batch
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "500"))
+# Как часто слать keep-alive в SSE, если цены не меняются (секунды)
+SSE_KEEPALIVE = float(os.environ.get("SSE_KEEPALIVE", "15"))
+
 
 class PriceRequest(BaseModel):
     base: str
@@ -41,6 +60,11 @@ class PriceResponse(BaseModel):
     pancake_price: Optional[float]
 
 
+class PriceUpdate(PriceResponse):
+    """Обновление цены в потоке /prices/stream."""
+    name: str
+
+
 class PriceHistoryItem(BaseModel):
     timestamp: datetime
     mexc_bid: Optional[float]
@@ -53,41 +77,143 @@ class PriceHistoryItem(BaseModel):
         from_attributes = True
 
 
-@router.post("/prices", response_model=PriceResponse)
-async def prices(
-    data: PriceRequest,
-    db: Session = Depends(get_db),
-    token = Depends(verify_access_token)
+class OHLC(BaseModel):
+    open: Optional[float]
+    high: Optional[float]
+    low: Optional[float]
+    close: Optional[float]
+
+
+class PriceHistoryBucket(BaseModel):
+    """Агрегированная корзина истории (при resolution / max_points)."""
+    timestamp: datetime
+    count: int
+    mexc_bid: Optional[OHLC]
+    mexc_ask: Optional[OHLC]
+    matcha_price: Optional[OHLC]
+    pancake_price: Optional[OHLC]
+    spread: Optional[OHLC]
+
+
+_RESOLUTION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_resolution(resolution: Optional[str]) -> Optional[int]:
+    """"300" / "30s" / "5m" / "1h" / "1d" -> секунды."""
+    if not resolution:
+        return None
+    value = resolution.strip().lower()
+    try:
+        if value[-1] in _RESOLUTION_UNITS:
+            seconds = int(value[:-1]) * _RESOLUTION_UNITS[value[-1]]
+        else:
+            seconds = int(value)
+    except (ValueError, IndexError):
+        seconds = 0
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail=f"Invalid resolution: {resolution}")
+    return seconds
+
+
+HISTORY_FORMATS = ("json", "ndjson", "columnar")
+
+
+def _history_rows(db: Session, token_id: int, hours: Optional[int], tier: Optional[RollupTier]):
+    """Сырые строки или точки уровня агрегатов — в одном формате."""
+    if tier is not None:
+        return iter_rollup_rows(db, token_id, tier, hours=hours, chunk_size=HISTORY_STREAM_CHUNK)
+    return iter_price_history_rows(db, token_id, hours=hours)
+
+
+def _history_response(
+    token_id: int,
+    format: str,
+    hours: Optional[int] = None,
+    tier: Optional[RollupTier] = None,
 ):
     """
-    Получить цены через прокси и сохранить в историю.
-    Требует валидный токен доступа в заголовке Authorization: Bearer {token}
+    История в потоковом (ndjson) или колоночном (columnar) формате.
+
+    ndjson — по строке JSON на запись, читается серверным курсором в
+    отдельной сессии (сессия из get_db закрывается до начала стриминга).
+    columnar — {"timestamp": [...], "mexc_bid": [...], ...}, timestamp в
+    секундах unix; без ORM-объектов и валидации каждой строки.
+    tier — читать из таблицы агрегатов (см. price_rollups.pick_rollup_tier).
     """
+    if format == "ndjson":
+        def generate():
+            db = SessionLocal()
+            try:
+                lines = []
+                for row in _history_rows(db, token_id, hours, tier):
+                    item = dict(zip(PRICE_COLUMNS, row[1:]))
+                    item["timestamp"] = row[0].isoformat()
+                    lines.append(json.dumps(item))
+                    if len(lines) >= HISTORY_STREAM_CHUNK:
+                        yield "\n".join(lines) + "\n"
+                        lines = []
+                if lines:
+                    yield "\n".join(lines) + "\n"
+            finally:
+                db.close()
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    db = SessionLocal()
+    try:
+        columns: Dict[str, list] = {"timestamp": []}
+        columns.update({name: [] for name in PRICE_COLUMNS})
+        targets = [columns[name] for name in PRICE_COLUMNS]
+        for row in _history_rows(db, token_id, hours, tier):
+            columns["timestamp"].append(row[0].timestamp())
+            for target, value in zip(targets, row[1:]):
+                target.append(value)
+    finally:
+        db.close()
+    return JSONResponse(columns)
+
 
+async def _collect_prices(
+    data: PriceRequest,
+    semaphores: Optional[Dict[str, asyncio.Semaphore]] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Optional[float]]:
+    """
+    Получить цены для одной пары: из хранилища котировок, если они свежие,
+    иначе с бирж через прокси (и сохранить в историю).
+    """
     base = data.base.upper()
+    name = f"{base}-USDT"
 
-    # MEXC
-    mexc_bid, mexc_ask = get_mexc_price(base, "USDT", data.mexc_price_scale, db=db)
+    # Свежая котировка от фонового поллера — отдаём сразу, без бирж и истории
+    cached = quote_store.get_fresh(name, PRICE_QUOTE_MAX_AGE)
+    if cached and cached.matches(data.mexc_price_scale, data.matcha_addr, data.pancake_addr):
+        return cached.prices()
 
-    # Matcha
-    matcha_price = None
-    if data.matcha_addr:
-        matcha_price = get_matcha_price_usdt(
-            data.matcha_addr,
-            data.matcha_decimals or 18,
-            db=db
-        )
+    # MEXC, Matcha и Pancake опрашиваем параллельно с общим дедлайном
+    quotes = await fetch_venue_prices(
+        base,
+        price_scale=data.mexc_price_scale,
+        matcha_addr=data.matcha_addr,
+        matcha_decimals=data.matcha_decimals,
+        pancake_addr=data.pancake_addr,
+        use_proxy=True,
+        semaphores=semaphores,
+        deadline=deadline,
+    )
 
-    # Pancake
-    pancake_price = None
-    if data.pancake_addr:
-        pancake_price = await get_pancake_price_usdt(data.pancake_addr, db=db)
+    quote_store.put(Quote(
+        name=name,
+        mexc_price_scale=data.mexc_price_scale,
+        matcha_address=data.matcha_addr,
+        bsc_address=data.pancake_addr,
+        **quotes,
+    ))
 
     # Сохраняем в историю
-    # Сначала создаем или получаем токен
-    token_obj = create_or_get_token(
-        db,
-        name=f"{base}-USDT",
+    # id пары берём из реестра токенов (новая пара создаётся в БД)
+    token_obj = await token_registry.get_or_create(
+        name,
         base=base,
         quote="USDT",
         mexc_price_scale=data.mexc_price_scale,
@@ -95,30 +221,226 @@ async def prices(
         matcha_decimals=data.matcha_decimals,
         bsc_address=data.pancake_addr
     )
-    
-    # Сохраняем цены в историю
+
+    # Ставим цены в очередь на запись в историю
     if token_obj:
-        save_price_history(
-            db,
-            token_id=token_obj.id,
-            mexc_bid=mexc_bid,
-            mexc_ask=mexc_ask,
-            matcha_price=matcha_price,
-            pancake_price=pancake_price
+        await history_writer.add(token_id=token_obj.id, **quotes)
+
+    return quotes
+
+
+@router.post("/prices", response_model=PriceResponse)
+async def prices(
+    data: PriceRequest,
+    token = Depends(verify_access_token)
+):
+    """
+    Получить цены через прокси и сохранить в историю.
+    Требует валидный токен доступа в заголовке Authorization: Bearer {token}
+    """
+    return await _collect_prices(data)
+
+
+@router.post("/prices/batch", response_model=Dict[str, PriceResponse])
+async def prices_batch(
+    items: List[PriceRequest],
+    token = Depends(verify_access_token)
+):
+    """
+    Получить цены сразу для многих пар за один запрос.
+    Все пары опрашиваются параллельно, число одновременных запросов
+    к каждой площадке ограничено VENUE_CONCURRENCY.
+
+    Возвращает словарь {"SOL-USDT": {...PriceResponse}, ...}.
+    Требует валидный токен доступа.
+    """
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many pairs in batch (max {MAX_BATCH_SIZE})"
         )
 
-    return {
-        "mexc_bid": mexc_bid,
-        "mexc_ask": mexc_ask,
-        "matcha_price": matcha_price,
-        "pancake_price": pancake_price,
+    # Одинаковые пары в одном пакете опрашиваем один раз
+    unique: Dict[str, PriceRequest] = {}
+    for item in items:
+        unique.setdefault(f"{item.base.upper()}-USDT", item)
+
+    # Один дедлайн на весь пакет, ожидание семафоров в него входит
+    semaphores = make_venue_semaphores()
+    deadline = asyncio.get_running_loop().time() + PRICES_DEADLINE
+    results = await asyncio.gather(
+        *(_collect_prices(item, semaphores, deadline) for item in unique.values())
+    )
+    return dict(zip(unique.keys(), results))
+
+
+# ============= Потоковая раздача цен =============
+
+async def _authenticate(authorization: Optional[str]) -> None:
+    """
+    Проверить токен доступа один раз при подключении к потоку.
+    Сессию БД сразу закрываем — соединение может жить часами.
+    """
+    async with AsyncSessionLocal() as db:
+        await verify_access_token(authorization=authorization, db=db)
+
+
+def _parse_names(tokens: Optional[str]) -> List[str]:
+    """"SOL-USDT,btc-usdt" -> ["SOL-USDT", "BTC-USDT"]"""
+    return [t.strip().upper() for t in (tokens or "").split(",") if t.strip()]
+
+
+def _update_message(quote: Quote) -> dict:
+    return PriceUpdate(name=quote.name, **quote.prices()).model_dump()
+
+
+@router.websocket("/prices/stream")
+async def prices_stream(
+    websocket: WebSocket,
+    tokens: Optional[str] = None,
+    token: Optional[str] = None,
+):
+    """
+    WebSocket-поток цен.
+
+    Подключение: /api/prices/stream?tokens=SOL-USDT,BTC-USDT
+    Токен доступа — в заголовке Authorization: Bearer {token}
+    или в параметре ?token= (браузеры не умеют заголовки у WebSocket).
+
+    Сервер присылает {"name": ..., mexc_bid, mexc_ask, matcha_price, pancake_price}
+    каждый раз, когда котировка пары меняется. Сменить набор пар можно
+    сообщением {"subscribe": ["SOL-USDT", ...]}.
+
+    Цены берутся из общего хранилища котировок: один запрос к биржам
+    фонового поллера обслуживает всех подписчиков.
+    """
+    authorization = websocket.headers.get("authorization")
+    if not authorization and token:
+        authorization = f"Bearer {token}"
+    try:
+        await _authenticate(authorization)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+
+    sub = quote_store.subscribe(_parse_names(tokens))
+    receive_task = asyncio.ensure_future(websocket.receive_json())
+    try:
+        while True:
+            get_task = asyncio.ensure_future(sub.queue.get())
+            done, _ = await asyncio.wait(
+                {receive_task, get_task},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            if get_task in done:
+                await websocket.send_json(_update_message(get_task.result()))
+            else:
+                get_task.cancel()
+
+            if receive_task in done:
+                try:
+                    message = receive_task.result()
+                except (ValueError, KeyError):
+                    await websocket.send_json({"error": "Invalid JSON"})
+                    message = None
+                if isinstance(message, dict) and "subscribe" in message:
+                    names = message.get("subscribe") or []
+                    quote_store.unsubscribe(sub)
+                    sub = quote_store.subscribe(_parse_names(",".join(map(str, names))))
+                receive_task = asyncio.ensure_future(websocket.receive_json())
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        receive_task.cancel()
+        quote_store.unsubscribe(sub)
+
+
+@router.get("/prices/stream/sse")
+async def prices_stream_sse(
+    request: Request,
+    tokens: str,
+    authorization: Optional[str] = Header(None),
+):
+    """
+    SSE-поток цен — запасной вариант для клиентов без WebSocket.
+
+    GET /api/prices/stream/sse?tokens=SOL-USDT,BTC-USDT
+    Каждое событие — JSON в формате PriceUpdate.
+    Требует валидный токен доступа (проверяется один раз при подключении).
+    """
+    await _authenticate(authorization)
+    names = _parse_names(tokens)
+
+    async def event_stream():
+        sub = quote_store.subscribe(names)
+        try:
+            while not await request.is_disconnected():
+                try:
+                    quote = await asyncio.wait_for(sub.queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(_update_message(quote))}\n\n"
+        finally:
+            quote_store.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+_OHLC_FIELDS = ("open", "high", "low", "close")
+
+
+def _buckets_response(buckets: List[Dict], format: str):
+    """
+    OHLC-корзины в запрошенном формате. Корзин немного (их число
+    ограничено resolution / max_points), поэтому они уже в памяти.
+
+    ndjson — по строке JSON на корзину (timestamp в ISO).
+    columnar — {"timestamp": [...], "count": [...], "mexc_bid_open": [...], ...},
+    timestamp в секундах unix; у пустой корзины площадки — null.
+    """
+    if format == "json":
+        return buckets
+
+    if format == "ndjson":
+        lines = [
+            json.dumps({**item, "timestamp": item["timestamp"].isoformat()})
+            for item in buckets
+        ]
+        body = "\n".join(lines) + "\n" if lines else ""
+        return StreamingResponse(iter([body]), media_type="application/x-ndjson")
+
+    columns: Dict[str, list] = {
+        "timestamp": [item["timestamp"].timestamp() for item in buckets],
+        "count": [item["count"] for item in buckets],
     }
+    for name in PRICE_COLUMNS:
+        for field in _OHLC_FIELDS:
+            columns[f"{name}_{field}"] = [
+                item[name][field] if item[name] is not None else None for item in buckets
+            ]
+    return JSONResponse(columns)
 
 
-@router.get("/prices/{token_name}/history", response_model=List[PriceHistoryItem])
+@router.get(
+    "/prices/{token_name}/history",
+    response_model=Union[List[PriceHistoryBucket], List[PriceHistoryItem]],
+)
 def get_prices_history(
     token_name: str,
     hours: int = 24,
+    resolution: Optional[str] = None,
+    max_points: Optional[int] = None,
+    format: str = "json",
     db: Session = Depends(get_db),
     token = Depends(verify_access_token)
 ):
@@ -128,18 +450,51 @@ def get_prices_history(
     Параметры:
         token_name: Имя пары (например "SOL-USDT")
         hours: Количество часов истории (по умолчанию 24)
-    
+        resolution: Размер корзины ("30s", "5m", "1h" или секунды)
+        max_points: Не больше N точек — корзина подбирается автоматически
+        format: "json" (по умолчанию), "ndjson" (поток) или "columnar" (массивы)
+
+    Если указан resolution или max_points, возвращаются OHLC-корзины,
+    посчитанные в Postgres, иначе — все сырые записи. format действует
+    и на корзины (см. _buckets_response).
+    Если hours больше срока хранения сырой истории, точки (и корзины)
+    берутся из минутных/15-минутных/часовых агрегатов.
+
     Требует валидный токен доступа.
     """
     from .price_history import get_token_by_name
+
+    if format not in HISTORY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format: {format}")
     
     # Получаем токен по имени
     token_obj = get_token_by_name(db, token_name)
     if not token_obj:
         return []
     
+    bucket_seconds = _parse_resolution(resolution)
+    if bucket_seconds or max_points:
+        tier, bucket_seconds = plan_history_buckets(
+            db, token_obj.id, hours=hours,
+            resolution=bucket_seconds, max_points=max_points,
+        )
+        if tier is not None:
+            buckets = get_rollup_buckets(db, token_obj.id, tier, bucket_seconds, hours=hours)
+        else:
+            buckets = get_price_history_buckets(db, token_obj.id, bucket_seconds, hours=hours)
+        return _buckets_response(buckets, format)
+
+    # Период длиннее сырой истории — берём точки из агрегатов
+    tier = pick_rollup_tier(hours)
+
+    if format != "json":
+        return _history_response(token_obj.id, format, hours=hours, tier=tier)
+
     # Получаем историю
-    history = get_price_history(db, token_obj.id, hours=hours)
+    if tier is not None:
+        history = get_rollup_history(db, token_obj.id, tier, hours=hours)
+    else:
+        history = get_price_history(db, token_obj.id, hours=hours)
     
     return [
         {
@@ -154,9 +509,15 @@ def get_prices_history(
     ]
 
 
-@router.get("/prices/{token_name}/history/all", response_model=List[PriceHistoryItem])
+@router.get(
+    "/prices/{token_name}/history/all",
+    response_model=Union[List[PriceHistoryBucket], List[PriceHistoryItem]],
+)
 def get_all_prices_history(
     token_name: str,
+    resolution: Optional[str] = None,
+    max_points: Optional[int] = None,
+    format: str = "json",
     db: Session = Depends(get_db),
     token = Depends(verify_access_token)
 ):
@@ -165,15 +526,40 @@ def get_all_prices_history(
     
     Параметры:
         token_name: Имя пары (например "SOL-USDT")
-    
+        resolution: Размер корзины ("30s", "5m", "1h" или секунды)
+        max_points: Не больше N точек — корзина подбирается автоматически
+        format: "json" (по умолчанию), "ndjson" (поток) или "columnar" (массивы)
+
+    Для больших историй используйте format=ndjson — память сервера
+    не зависит от объёма истории. С resolution / max_points format
+    действует и на корзины.
+
     Требует валидный токен доступа.
     """
     from .price_history import get_token_by_name
+
+    if format not in HISTORY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format: {format}")
     
     # Получаем токен по имени
     token_obj = get_token_by_name(db, token_name)
     if not token_obj:
         return []
+
+    bucket_seconds = _parse_resolution(resolution)
+    if bucket_seconds or max_points:
+        tier, bucket_seconds = plan_history_buckets(
+            db, token_obj.id,
+            resolution=bucket_seconds, max_points=max_points,
+        )
+        if tier is not None:
+            buckets = get_rollup_buckets(db, token_obj.id, tier, bucket_seconds)
+        else:
+            buckets = get_price_history_buckets(db, token_obj.id, bucket_seconds)
+        return _buckets_response(buckets, format)
+
+    if format != "json":
+        return _history_response(token_obj.id, format)
     
     # Получаем всю историю
     history = get_price_history_all(db, token_obj.id)
@@ -1,13 +1,252 @@
 # backend/proxy_manager.py
 """
 Модуль для управления прокси и применения их к HTTP-клиентам.
+
+Активные прокси держим в памяти (ProxyPool) вместе со статистикой по каждой
+площадке: доля успешных запросов, p50/p95 задержки, ошибки подряд.
+Прокси выбирается случайно с весом по этой статистике; прокси с несколькими
+ошибками подряд уходит в cooldown (circuit breaker). После cooldown через
+него идёт один пробный запрос (half-open): успех возвращает прокси в
+ротацию, ошибка — снова в cooldown. Если живых прокси нет, запрос идёт
+напрямую, а не толпой в один разомкнутый прокси.
+Список перечитывается из БД, только когда его меняют в админке
+(invalidate_proxies) или раз в PROXY_POOL_REFRESH_TTL секунд.
 """
 
+import asyncio
+import os
 import random
-from typing import Optional, List
+import time
+from collections import deque
+from typing import Optional, List, Dict, Tuple
 from sqlalchemy.orm import Session
+from .db import SessionLocal
 from .models import Proxy
 from .logic import log
+from .rate_limiter import venue_scheduler
+
+
+# Страховочное перечитывание списка прокси (если его поменяли мимо админки)
+PROXY_POOL_REFRESH_TTL = float(os.environ.get("PROXY_POOL_REFRESH_TTL", "300"))
+# Сколько ошибок подряд размыкают прокси для площадки
+PROXY_FAILURE_THRESHOLD = int(os.environ.get("PROXY_FAILURE_THRESHOLD", "3"))
+# Базовый и максимальный cooldown (секунды), растёт экспоненциально
+PROXY_COOLDOWN = float(os.environ.get("PROXY_COOLDOWN", "30"))
+PROXY_COOLDOWN_MAX = float(os.environ.get("PROXY_COOLDOWN_MAX", "600"))
+# Пробный запрос, не ответивший за это время, считается потерянным — можно новый
+PROXY_PROBE_TIMEOUT = float(os.environ.get("PROXY_PROBE_TIMEOUT", "30"))
+
+# Сколько последних замеров задержки храним для p50/p95
+_LATENCY_WINDOW = 100
+# Сглаживание доли успешных запросов
+_SUCCESS_ALPHA = 0.1
+
+
+class ProxyStats:
+    """Статистика одного прокси на одной площадке."""
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.success_rate = 1.0  # EWMA, новый прокси считаем здоровым
+        self.latencies: deque = deque(maxlen=_LATENCY_WINDOW)
+        self.cooldown_until = 0.0
+        self.trips = 0
+        # Разомкнут: после cooldown пропускаем только пробный запрос
+        self.half_open = False
+        self.probe_started: Optional[float] = None
+
+    def _trip(self) -> None:
+        self.trips += 1
+        cooldown = min(PROXY_COOLDOWN * 2 ** (self.trips - 1), PROXY_COOLDOWN_MAX)
+        self.cooldown_until = time.monotonic() + cooldown
+        self.consecutive_failures = 0
+        self.half_open = True
+
+    def record(self, ok: bool, latency: float) -> None:
+        self.success_rate += _SUCCESS_ALPHA * ((1.0 if ok else 0.0) - self.success_rate)
+        probe = self.half_open
+        self.probe_started = None
+        if ok:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.trips = 0
+            self.half_open = False
+            self.latencies.append(latency)
+            return
+
+        self.failures += 1
+        self.consecutive_failures += 1
+        # Проба не прошла — сразу обратно в cooldown (длиннее прежнего)
+        if probe or self.consecutive_failures >= PROXY_FAILURE_THRESHOLD:
+            self._trip()
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def in_cooldown(self, now: float) -> bool:
+        return self.cooldown_until > now
+
+    def is_closed(self, now: float) -> bool:
+        """Прокси в обычной ротации."""
+        return not self.half_open and not self.in_cooldown(now)
+
+    def can_probe(self, now: float) -> bool:
+        """Cooldown кончился, и пробный запрос ещё не идёт (или потерян)."""
+        return (
+            self.half_open
+            and not self.in_cooldown(now)
+            and (self.probe_started is None or now - self.probe_started >= PROXY_PROBE_TIMEOUT)
+        )
+
+    def score(self) -> float:
+        """Вес при выборе: чем надёжнее и быстрее прокси, тем больше."""
+        p50 = self.percentile(0.5)
+        latency = max(p50, 0.05) if p50 is not None else 1.0
+        return max(self.success_rate, 0.01) / latency
+
+    def as_dict(self) -> dict:
+        return {
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "success_rate": round(self.success_rate, 4),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "cooldown_left": max(self.cooldown_until - time.monotonic(), 0.0),
+            "half_open": self.half_open,
+            "probing": self.probe_started is not None,
+        }
+
+
+class ProxyPool:
+    """In-memory пул активных прокси со статистикой по площадкам."""
+
+    def __init__(self):
+        self._urls: List[str] = []
+        self._stats: Dict[Tuple[str, str], ProxyStats] = {}
+        self._loaded_at: Optional[float] = None
+
+    def invalidate(self) -> None:
+        """Пометить список как устаревший — перечитаем из БД при следующем выборе."""
+        self._loaded_at = None
+
+    def is_stale(self) -> bool:
+        """Пора ли перечитать список прокси из БД."""
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at >= PROXY_POOL_REFRESH_TTL
+        )
+
+    def reload(self, db: Optional[Session] = None) -> None:
+        """
+        Перечитать активные прокси из БД (синхронно).
+        Без db открывает свою сессию — удобно звать через asyncio.to_thread.
+        """
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            urls = [p.url for p in db.query(Proxy).filter(Proxy.is_active == True).all()]
+        finally:
+            if own_session:
+                db.close()
+        self._urls = urls
+        # Статистику и вёдра лимитов удалённых прокси выбрасываем
+        alive = set(urls)
+        self._stats = {k: v for k, v in self._stats.items() if k[0] in alive}
+        venue_scheduler.retain_proxies(ProxyManager.get_proxy_safe_host(u) for u in urls)
+        self._loaded_at = time.monotonic()
+
+    async def ensure_loaded(self) -> None:
+        """Перечитать список в потоке, если он устарел — не блокирует event loop."""
+        if self.is_stale():
+            await asyncio.to_thread(self.reload)
+
+    def size(self) -> int:
+        """Сколько активных прокси загружено."""
+        return len(self._urls)
+
+    def stats(self, proxy_url: str, venue: str) -> ProxyStats:
+        key = (proxy_url, venue)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ProxyStats()
+        return stats
+
+    def choose(self, db: Optional[Session] = None, venue: str = "default") -> Optional[str]:
+        """
+        Выбрать прокси для площадки.
+
+        - Если у разомкнутого прокси кончился cooldown — этот запрос
+          становится его единственной пробой (half-open).
+        - Иначе случайно с весом по score() среди прокси в ротации,
+          предпочитая те, у кого в ведре площадки (venue_scheduler)
+          есть токен прямо сейчас.
+        - Если в ротации нет никого — None: запрос идёт напрямую.
+
+        С db устаревший список перечитывается синхронно; без db
+        используется то, что уже загружено (см. ensure_loaded).
+        """
+        if db is not None and self.is_stale():
+            self.reload(db)
+        if not self._urls:
+            return None
+
+        now = time.monotonic()
+        candidates = []
+        weights = []
+        ready = []
+        probes = []
+        for url in self._urls:
+            stats = self.stats(url, venue)
+            if stats.can_probe(now):
+                probes.append(url)
+            if not stats.is_closed(now):
+                continue
+            candidates.append(url)
+            weights.append(stats.score())
+            ready.append(venue_scheduler.get(venue, ProxyManager.get_proxy_safe_host(url)).ready())
+
+        if probes:
+            url = min(probes, key=lambda u: self.stats(u, venue).cooldown_until)
+            self.stats(url, venue).probe_started = now
+            return url
+
+        if not candidates:
+            return None
+
+        if any(ready) and not all(ready):
+            weights = [w for w, r in zip(weights, ready) if r]
+            candidates = [u for u, r in zip(candidates, ready) if r]
+        return random.choices(candidates, weights=weights, k=1)[0]
+
+    def report(self, proxy_url: Optional[str], venue: str, ok: bool, latency: float) -> None:
+        """Записать результат запроса через прокси."""
+        if not proxy_url:
+            return
+        self.stats(proxy_url, venue).record(ok, latency)
+
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """Статистика для отладки/метрик: {proxy_host: {venue: {...}}}."""
+        result: Dict[str, Dict[str, dict]] = {}
+        for (url, venue), stats in self._stats.items():
+            host = ProxyManager.get_proxy_safe_host(url)
+            result.setdefault(host, {})[venue] = stats.as_dict()
+        return result
+
+
+# Глобальный пул процесса
+proxy_pool = ProxyPool()
+
+
+def invalidate_proxies() -> None:
+    """Вызывать после изменения таблицы proxies (админка)."""
+    proxy_pool.invalidate()
 
 
 class ProxyManager:
@@ -20,25 +259,24 @@ class ProxyManager:
         """Получить список активных прокси."""
         return self.db.query(Proxy).filter(Proxy.is_active == True).all()
 
-    def get_random_proxy(self) -> Optional[str]:
+    def get_random_proxy(self, venue: str = "default") -> Optional[str]:
         """
-        Получить случайный активный прокси.
+        Получить активный прокси для площадки (с учётом его здоровья).
         Возвращает URL прокси вида:
         - socks5://user:pass@ip:port
         - http://user:pass@ip:port
         """
-        proxies = self.get_active_proxies()
-        if not proxies:
-            return None
-        
-        proxy = random.choice(proxies)
-        return proxy.url
+        return proxy_pool.choose(self.db, venue)
+
+    def report(self, proxy_url: Optional[str], venue: str, ok: bool, latency: float) -> None:
+        """Сообщить пулу результат запроса через прокси."""
+        proxy_pool.report(proxy_url, venue, ok, latency)
 
     def get_proxy_dict(self, proxy_url: Optional[str] = None) -> dict:
         """
         Получить словарь прокси для httpx/requests.
         Если proxy_url не указан, берет случайный из БД.
-        
+
         Возвращает:
         {
             "http://": "socks5://...",
@@ -47,16 +285,17 @@ class ProxyManager:
         """
         if proxy_url is None:
             proxy_url = self.get_random_proxy()
-        
+
         if not proxy_url:
             return {}
-        
+
         return {
             "http://": proxy_url,
             "https://": proxy_url,
         }
 
-    def get_proxy_safe_host(self, proxy_url: str) -> str:
+    @staticmethod
+    def get_proxy_safe_host(proxy_url: str) -> str:
         """
         Убрать логин/пароль из URL прокси для логирования.
         Пример:
@@ -70,10 +309,14 @@ class ProxyManager:
         except Exception:
             return proxy_url
 
-    def log_proxy_usage(self, proxy_url: Optional[str]) -> None:
-        """Залогировать использование прокси."""
+    @classmethod
+    def log_proxy_usage(cls, proxy_url: Optional[str]) -> None:
+        """
+        Залогировать использование прокси. Вызывается на каждый запрос к
+        площадке, поэтому уровень debug: при LOG_LEVEL=info запись не создаётся.
+        """
         if proxy_url:
-            safe_host = self.get_proxy_safe_host(proxy_url)
-            log(f"Using proxy: {safe_host}")
+            safe_host = cls.get_proxy_safe_host(proxy_url)
+            log(f"Using proxy: {safe_host}", level="debug", event="proxy_pick", proxy=safe_host)
         else:
-            log("No proxy available, using direct connection")
+            log("No proxy available, using direct connection", level="debug", event="proxy_pick", proxy=None)
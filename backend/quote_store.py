@@ -0,0 +1,140 @@
+# backend/quote_store.py
+"""
+In-process хранилище последних котировок по каждой паре.
+
+Заполняется фоновым поллером (price_poller.py) и самим /api/prices,
+читается эндпоинтами без похода на биржи.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Iterable, Set
+
+
+@dataclass
+class Quote:
+    """Последняя котировка пары и параметры, с которыми она получена."""
+    name: str
+    mexc_bid: Optional[float] = None
+    mexc_ask: Optional[float] = None
+    matcha_price: Optional[float] = None
+    pancake_price: Optional[float] = None
+
+    # Параметры запроса — котировку отдаём только тому, кто спрашивает то же самое
+    mexc_price_scale: Optional[int] = None
+    matcha_address: Optional[str] = None
+    bsc_address: Optional[str] = None
+
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def age(self) -> float:
+        return time.monotonic() - self.updated_at
+
+    def prices(self) -> Dict[str, Optional[float]]:
+        """Цены в формате PriceResponse."""
+        return {
+            "mexc_bid": self.mexc_bid,
+            "mexc_ask": self.mexc_ask,
+            "matcha_price": self.matcha_price,
+            "pancake_price": self.pancake_price,
+        }
+
+    def same_prices(self, other: Optional["Quote"]) -> bool:
+        return other is not None and self.prices() == other.prices()
+
+    def matches(
+        self,
+        mexc_price_scale: Optional[int],
+        matcha_address: Optional[str],
+        bsc_address: Optional[str],
+    ) -> bool:
+        return (
+            (self.mexc_price_scale or 0) == (mexc_price_scale or 0)
+            and (self.matcha_address or None) == (matcha_address or None)
+            and (self.bsc_address or None) == (bsc_address or None)
+        )
+
+
+class Subscription:
+    """
+    Подписка клиента (WebSocket/SSE) на набор пар.
+    Обновления складываются в ограниченную очередь: медленный клиент
+    теряет самые старые обновления, но не тормозит остальных.
+    """
+
+    def __init__(self, names: Iterable[str], maxsize: int = 256):
+        self.names: Set[str] = set(names)
+        self.queue: "asyncio.Queue[Quote]" = asyncio.Queue(maxsize=maxsize)
+
+    def push(self, quote: Quote) -> None:
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(quote)
+
+
+class QuoteStore:
+    """Словарь name -> Quote. Работает в одном event loop, блокировки не нужны."""
+
+    def __init__(self):
+        self._quotes: Dict[str, Quote] = {}
+        # name -> подписки на эту пару
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    def get(self, name: str) -> Optional[Quote]:
+        return self._quotes.get(name)
+
+    def get_fresh(self, name: str, max_age: float) -> Optional[Quote]:
+        """Вернуть котировку, если она не старше max_age секунд."""
+        quote = self._quotes.get(name)
+        if quote is None or quote.age() > max_age:
+            return None
+        return quote
+
+    def put(self, quote: Quote) -> bool:
+        """
+        Сохранить котировку. Если цены изменились — разослать подписчикам.
+        Возвращает True, если цены изменились.
+        """
+        previous = self._quotes.get(quote.name)
+        self._quotes[quote.name] = quote
+        if quote.same_prices(previous):
+            return False
+        for sub in self._subscribers.get(quote.name, ()):
+            sub.push(quote)
+        return True
+
+    def subscribe(self, names: Iterable[str]) -> Subscription:
+        """Подписаться на обновления пар. Текущие котировки сразу попадают в очередь."""
+        sub = Subscription(names)
+        for name in sub.names:
+            self._subscribers.setdefault(name, set()).add(sub)
+            quote = self._quotes.get(name)
+            if quote is not None:
+                sub.push(quote)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        for name in sub.names:
+            subs = self._subscribers.get(name)
+            if subs is None:
+                continue
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[name]
+
+    def subscriber_count(self) -> int:
+        return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    def remove(self, name: str) -> None:
+        self._quotes.pop(name, None)
+
+    def __len__(self) -> int:
+        return len(self._quotes)
+
+
+# Глобальное хранилище процесса
+quote_store = QuoteStore()
@@ -0,0 +1,298 @@
+# backend/rate_limiter.py
+"""
+Планировщик запросов к внешним API: token bucket на каждую пару
+(площадка, исходящий IP) — свой IP сервера или конкретный прокси.
+
+- Лимит задаётся на один IP (RATE_LIMIT_<VENUE>, запросов в секунду);
+  каждый прокси получает своё ведро, прямые запросы — своё.
+- На 429/418 или Retry-After лимит этого IP урезается вдвое и его запросы
+  ставятся на паузу; после успешных ответов лимит плавно растёт обратно.
+- Ожидающие запросы стоят в очереди с приоритетом: запросы клиентов
+  (PRIORITY_INTERACTIVE) обслуживаются раньше фоновых обновлений.
+
+Приоритет берётся из contextvar request_priority — фоновые циклы
+вызывают set_background_priority() один раз при старте.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, List, Tuple
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "request_priority", default=PRIORITY_INTERACTIVE
+)
+
+# Лимиты на один IP по умолчанию (запросов в секунду)
+_DEFAULT_RATES = {
+    "mexc": 20.0,
+    "mexc_futures": 10.0,
+    "matcha": 5.0,
+    "pancake": 5.0,       # DexScreener: 300 запросов в минуту
+    "coingecko": 0.5,     # публичный API: ~30 запросов в минуту
+}
+RATE_LIMIT_DEFAULT = float(os.environ.get("RATE_LIMIT_DEFAULT", "5"))
+# Запас токенов (в секундах работы на полном лимите) для коротких всплесков
+RATE_LIMIT_BURST_SECONDS = float(os.environ.get("RATE_LIMIT_BURST_SECONDS", "2"))
+# Ниже этой доли исходного лимита не опускаемся
+RATE_LIMIT_MIN_FRACTION = float(os.environ.get("RATE_LIMIT_MIN_FRACTION", "0.05"))
+# Пауза после 429 без Retry-After (секунды)
+RATE_LIMIT_PENALTY = float(os.environ.get("RATE_LIMIT_PENALTY", "5"))
+# На сколько (доля исходного лимита) растёт лимит после каждого успешного ответа
+RATE_LIMIT_RECOVERY_STEP = float(os.environ.get("RATE_LIMIT_RECOVERY_STEP", "0.02"))
+
+# Коды, которыми площадки сообщают о превышении лимита
+THROTTLE_STATUSES = (418, 429)
+
+
+def set_background_priority() -> None:
+    """Пометить текущую задачу (и созданные из неё) как фоновую."""
+    request_priority.set(PRIORITY_BACKGROUND)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: число секунд или HTTP-дата."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class VenueLimiter:
+    """
+    Token bucket одной площадки на одном IP с адаптацией под ответы сервера.
+    Состояние ведра под threading.Lock — им пользуются и async-код,
+    и синхронный cloudscraper из пула потоков.
+    """
+
+    def __init__(self, venue: str, rate: float, proxy: Optional[str] = None):
+        self.venue = venue
+        self.proxy = proxy             # хост прокси; None — свой IP сервера
+        self.base_rate = rate          # лимит на один IP из настроек
+        self.rate = rate               # текущий (адаптивный) лимит
+        self.tokens = self._capacity()
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # Очередь ожидающих async-запросов: (приоритет, порядковый номер, future)
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._interactive_waiting = 0
+
+        self.granted = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _capacity(self) -> float:
+        return max(self.rate * RATE_LIMIT_BURST_SECONDS, 1.0)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.tokens + (now - self.updated) * self.rate,
+            self._capacity(),
+        )
+        self.updated = now
+
+    def ready(self) -> bool:
+        """Есть ли токен прямо сейчас (без паузы и без очереди) — для выбора прокси."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until or self._queue:
+                return False
+            self._refill(now)
+            return self.tokens >= 1.0
+
+    def _try_take(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Взять токен. Возвращает 0 при успехе, иначе сколько секунд подождать."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            # Синхронные фоновые запросы пропускают вперёд ждущих клиентов
+            if priority > PRIORITY_INTERACTIVE and self._interactive_waiting:
+                return 0.05
+            self._refill(now)
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                self.granted += 1
+                return 0.0
+            return (1.0 - self.tokens) / self.rate
+
+    # ------ async ------
+
+    async def acquire(self, priority: Optional[int] = None) -> None:
+        """Дождаться своей очереди (async). Клиентские запросы идут вперёд фоновых."""
+        if priority is None:
+            priority = request_priority.get()
+        if not self._queue and self._try_take(priority) == 0.0:
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        if priority <= PRIORITY_INTERACTIVE:
+            self._interactive_waiting += 1
+        dispatcher = self._dispatcher
+        if dispatcher is None or dispatcher.done() or dispatcher.get_loop() is not loop:
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            if priority <= PRIORITY_INTERACTIVE:
+                self._interactive_waiting -= 1
+            self.waited += time.monotonic() - started
+
+    async def _dispatch(self) -> None:
+        """Раздавать токены ожидающим по приоритету, пока очередь не опустеет."""
+        while self._queue:
+            if self._queue[0][2].done():
+                # Ожидающий отменён (дедлайн запроса)
+                heapq.heappop(self._queue)
+                continue
+            priority = self._queue[0][0]
+            wait = self._try_take(PRIORITY_INTERACTIVE)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                # Отменили, пока ждали токен — возвращаем его
+                with self._lock:
+                    self.tokens += 1.0
+                    self.granted -= 1
+                continue
+            future.set_result(priority)
+
+    # ------ sync (пул потоков) ------
+
+    def acquire_blocking(self, priority: Optional[int] = None) -> None:
+        """То же для синхронного кода (cloudscraper в пуле потоков)."""
+        if priority is None:
+            priority = request_priority.get()
+        started = time.monotonic()
+        while True:
+            wait = self._try_take(priority)
+            if wait == 0.0:
+                break
+            time.sleep(min(wait, 1.0))
+        self.waited += time.monotonic() - started
+
+    # ------ адаптация ------
+
+    def feedback(self, status_code: int, retry_after: Optional[str] = None) -> None:
+        """Учесть ответ площадки: 429/418/Retry-After урезают лимит, успехи возвращают."""
+        delay = parse_retry_after(retry_after)
+        throttled = status_code in THROTTLE_STATUSES
+        with self._lock:
+            if throttled or (delay is not None and status_code >= 500):
+                self.throttled += 1
+                if throttled:
+                    self.rate = max(self.rate / 2, self.base_rate * RATE_LIMIT_MIN_FRACTION)
+                pause = delay if delay is not None else RATE_LIMIT_PENALTY
+                self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+                # Ведро начинает наполняться только после паузы
+                self.tokens = 0.0
+                self.updated = self.blocked_until
+            elif status_code < 400 and self.rate < self.base_rate:
+                self.rate = min(self.rate + self.base_rate * RATE_LIMIT_RECOVERY_STEP, self.base_rate)
+
+        if throttled:
+            from .logic import log
+            log(
+                f"Rate limit {self.venue} via {self.proxy or 'direct'}: HTTP {status_code}, "
+                f"rate -> {self.rate:.2f}/s, pause {pause:.1f}s",
+                level="warning", event="rate_limited", venue=self.venue,
+                proxy=self.proxy, status=status_code,
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "base_rate": self.base_rate,
+                "tokens": round(self.tokens, 2),
+                "queued": len(self._queue),
+                "blocked_for": max(self.blocked_until - time.monotonic(), 0.0),
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited, 3),
+            }
+
+
+class VenueScheduler:
+    """Лимитеры по (площадка, прокси), создаются по первому запросу."""
+
+    def __init__(self):
+        self._limiters: Dict[Tuple[str, Optional[str]], VenueLimiter] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rate_for(venue: str) -> float:
+        env = os.environ.get(f"RATE_LIMIT_{venue.upper()}")
+        if env:
+            return float(env)
+        return _DEFAULT_RATES.get(venue, RATE_LIMIT_DEFAULT)
+
+    def get(self, venue: str, proxy: Optional[str] = None) -> VenueLimiter:
+        """Лимитер площадки для прокси (хост без логина) или для своего IP (None)."""
+        key = (venue, proxy)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    limiter = self._limiters[key] = VenueLimiter(venue, self._rate_for(venue), proxy)
+        return limiter
+
+    async def acquire(self, venue: str, priority: Optional[int] = None) -> None:
+        await self.get(venue).acquire(priority)
+
+    def acquire_blocking(self, venue: str, priority: Optional[int] = None) -> None:
+        self.get(venue).acquire_blocking(priority)
+
+    def feedback(self, venue: str, status_code: int, retry_after: Optional[str] = None) -> None:
+        self.get(venue).feedback(status_code, retry_after)
+
+    def retain_proxies(self, proxies) -> None:
+        """Забыть вёдра прокси, которых больше нет в пуле (свой IP не трогаем)."""
+        alive = set(proxies)
+        with self._lock:
+            self._limiters = {
+                key: limiter for key, limiter in self._limiters.items()
+                if key[1] is None or key[1] in alive
+            }
+
+    def snapshot(self) -> List[dict]:
+        """[{"venue", "proxy", **stats}] — proxy None для своего IP."""
+        return [
+            {"venue": venue, "proxy": proxy, **limiter.stats()}
+            for (venue, proxy), limiter in list(self._limiters.items())
+        ]
+
+
+# Глобальный планировщик процесса
+venue_scheduler = VenueScheduler()
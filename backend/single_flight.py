@@ -0,0 +1,112 @@
+# backend/single_flight.py
+"""
+Объединение одинаковых запросов к биржам (single-flight).
+
+Если несколько клиентов одновременно спрашивают одну и ту же цену,
+наружу уходит один запрос, остальные ждут его результат.
+Успешный результат ещё VENUE_REUSE_WINDOW секунд отдаётся без запроса.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+# Сколько секунд переиспользуем успешный ответ площадки (0 — только объединение)
+VENUE_REUSE_WINDOW = float(os.environ.get("VENUE_REUSE_WINDOW", "1"))
+
+
+def _is_empty(value: Any) -> bool:
+    """None или (None, None) — площадка ничего не вернула, такое не переиспользуем."""
+    if value is None:
+        return True
+    if isinstance(value, tuple):
+        return all(v is None for v in value)
+    return False
+
+
+class SingleFlight:
+    """
+    Ключ -> одна общая задача на всех ожидающих.
+    Работает в одном event loop, блокировки не нужны.
+    """
+
+    def __init__(self, reuse_window: float = VENUE_REUSE_WINDOW):
+        self.reuse_window = reuse_window
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # ключ -> (результат, время получения)
+        self._recent: Dict[Hashable, Tuple[Any, float]] = {}
+        self.calls = 0
+        self.reused = 0
+        self.coalesced = 0
+        self.upstream = 0
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            return
+        value = task.result()
+        if self.reuse_window > 0 and not _is_empty(value):
+            self._recent[key] = (value, time.monotonic())
+
+    def _prune(self, now: float) -> None:
+        """Выкинуть протухшие результаты, чтобы словарь не рос бесконечно."""
+        stale = [k for k, (_, ts) in self._recent.items() if now - ts >= self.reuse_window]
+        for k in stale:
+            del self._recent[k]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Вернуть результат fn() для ключа: из окна переиспользования,
+        из уже идущего запроса или запустив новый.
+        Отмена одного ожидающего (дедлайн) не отменяет общий запрос.
+        """
+        self.calls += 1
+        now = time.monotonic()
+
+        recent = self._recent.get(key)
+        if recent is not None:
+            value, fetched_at = recent
+            if now - fetched_at < self.reuse_window:
+                self.reused += 1
+                return value
+            del self._recent[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            if len(self._recent) > 1024:
+                self._prune(now)
+            self.upstream += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._finish(k, t))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def forget(self, key: Optional[Hashable] = None) -> None:
+        """Сбросить переиспользуемые результаты (все или по ключу)."""
+        if key is None:
+            self._recent.clear()
+        else:
+            self._recent.pop(key, None)
+
+    def stats(self) -> Dict[str, float]:
+        saved = self.reused + self.coalesced
+        return {
+            "calls": self.calls,
+            "upstream": self.upstream,
+            "coalesced": self.coalesced,
+            "reused": self.reused,
+            "inflight": len(self._inflight),
+            "saved_ratio": round(saved / self.calls, 4) if self.calls else 0.0,
+        }
+
+
+# Общий single-flight для запросов цен к площадкам
+venue_flight = SingleFlight()
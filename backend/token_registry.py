@@ -0,0 +1,183 @@
+# backend/token_registry.py
+"""
+In-process реестр торговых пар: имя ("SOL-USDT") -> id и параметры площадок.
+
+Загружается целиком при старте и отдаёт токен без похода в БД.
+Промах (новая пара) — один INSERT ... ON CONFLICT DO NOTHING RETURNING,
+одновременные промахи по одному имени объединяются (single-flight).
+Новые пары приложение добавляет только через get_or_create, реестр при этом
+обновляется сам. Изменения таблицы tokens мимо приложения (SQL, скрипты)
+подхватываются раз в TOKEN_REGISTRY_REFRESH_TTL секунд.
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional, Dict
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal, AsyncSessionLocal
+from .models import Token
+from .logic import log
+from .single_flight import SingleFlight
+
+
+# Страховочное перечитывание реестра (если таблицу поменяли мимо приложения)
+TOKEN_REGISTRY_REFRESH_TTL = float(os.environ.get("TOKEN_REGISTRY_REFRESH_TTL", "300"))
+
+# Поля Token, которые держим в памяти
+_FIELDS = (
+    "id",
+    "name",
+    "base",
+    "quote",
+    "mexc_price_scale",
+    "jupiter_mint",
+    "jupiter_decimals",
+    "bsc_address",
+    "matcha_address",
+    "matcha_decimals",
+    "cg_id",
+    "dexes",
+    "is_active",
+)
+
+
+@dataclass(frozen=True)
+class TokenInfo:
+    """Снимок строки tokens без привязки к сессии."""
+    id: int
+    name: str
+    base: str
+    quote: str = "USDT"
+    mexc_price_scale: Optional[int] = None
+    jupiter_mint: Optional[str] = None
+    jupiter_decimals: Optional[int] = None
+    bsc_address: Optional[str] = None
+    matcha_address: Optional[str] = None
+    matcha_decimals: Optional[int] = None
+    cg_id: Optional[str] = None
+    dexes: Optional[str] = None
+    is_active: Optional[bool] = True
+
+    @classmethod
+    def from_row(cls, row) -> "TokenInfo":
+        return cls(**{f: getattr(row, f) for f in _FIELDS})
+
+
+class TokenRegistry:
+    """Кэш таблицы tokens по имени пары."""
+
+    def __init__(self):
+        self._by_name: Dict[str, TokenInfo] = {}
+        self._loaded_at: Optional[float] = None
+        # Только объединение одновременных промахов, без переиспользования
+        self._creating = SingleFlight(reuse_window=0)
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        Без аргумента — перечитать весь реестр при следующем обращении,
+        с именем — забыть одну пару.
+        """
+        if name is None:
+            self._loaded_at = None
+        else:
+            self._by_name.pop(name, None)
+
+    def is_stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at >= TOKEN_REGISTRY_REFRESH_TTL
+        )
+
+    def reload(self, db: Optional[Session] = None) -> int:
+        """
+        Перечитать tokens из БД (синхронно).
+        Без db открывает свою сессию — удобно звать через asyncio.to_thread.
+        """
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            columns = [getattr(Token, f) for f in _FIELDS]
+            rows = db.execute(select(*columns)).all()
+        finally:
+            if own_session:
+                db.close()
+        self._by_name = {row.name: TokenInfo.from_row(row) for row in rows}
+        self._loaded_at = time.monotonic()
+        return len(self._by_name)
+
+    async def ensure_loaded(self) -> None:
+        """Перечитать реестр в потоке, если он устарел — не блокирует event loop."""
+        if self.is_stale():
+            await asyncio.to_thread(self.reload)
+
+    def get(self, name: str) -> Optional[TokenInfo]:
+        return self._by_name.get(name)
+
+    async def get_or_create(
+        self,
+        name: str,
+        base: str,
+        quote: str = "USDT",
+        **kwargs
+    ) -> Optional[TokenInfo]:
+        """
+        Токен по имени; новую пару создать в БД.
+        Попадание не делает ни одного запроса к БД.
+        Параметры (kwargs) применяются только при создании, как и раньше
+        в create_or_get_token.
+        """
+        await self.ensure_loaded()
+        token = self._by_name.get(name)
+        if token is not None:
+            self.hits += 1
+            return token
+
+        self.misses += 1
+        try:
+            return await self._creating.do(
+                name, lambda: self._upsert(name, base, quote, **kwargs)
+            )
+        except Exception as e:
+            log(f"Error creating/getting token {name}: {e}", level="error")
+            return None
+
+    async def _upsert(self, name: str, base: str, quote: str, **kwargs) -> TokenInfo:
+        """INSERT ... ON CONFLICT (name) DO NOTHING; если строка уже была — SELECT."""
+        columns = [getattr(Token, f) for f in _FIELDS]
+        values = {"name": name, "base": base, "quote": quote, "is_active": True, **kwargs}
+        async with AsyncSessionLocal() as db:
+            insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+            stmt = (
+                insert(Token)
+                .values(**values)
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(*columns)
+            )
+            row = (await db.execute(stmt)).first()
+            created = row is not None
+            if row is None:
+                row = (await db.execute(select(*columns).where(Token.name == name))).one()
+            await db.commit()
+
+        token = TokenInfo.from_row(row)
+        self._by_name[name] = token
+        if created:
+            log(f"Created new token: {name}")
+        return token
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._by_name), "hits": self.hits, "misses": self.misses}
+
+
+# Глобальный реестр процесса
+token_registry = TokenRegistry()
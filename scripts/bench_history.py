@@ -0,0 +1,160 @@
+# scripts/bench_history.py
+"""
+Бенчмарк чтения истории цен одного токена на большой таблице.
+
+Сравнивает наборы индексов:
+  single    — старые одиночные индексы token_id и created_at
+  composite — составной (token_id, created_at)
+  covering  — составной + INCLUDE цен (index-only scan)
+и два способа чтения: ORM-объекты PriceHistory против только нужных колонок
+(get_price_history).
+
+Всё создаётся в отдельной схеме (по умолчанию hydra_bench) и удаляется в конце.
+
+Пример:
+    DATABASE_URL=postgresql://... python scripts/bench_history.py --rows 10000000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from backend.db import DATABASE_URL  # noqa: E402
+from backend.models import PriceHistory  # noqa: E402
+from backend.price_history import get_price_history  # noqa: E402
+from backend import history_partitions  # noqa: E402
+
+
+PRICES = "mexc_bid, mexc_ask, matcha_price, pancake_price, spread"
+VARIANTS = {
+    "single": [
+        "CREATE INDEX bench_token ON price_history (token_id)",
+        "CREATE INDEX bench_created ON price_history (created_at)",
+    ],
+    "composite": [
+        "CREATE INDEX bench_token_created ON price_history (token_id, created_at)",
+    ],
+    "covering": [
+        f"CREATE INDEX bench_token_created_cov ON price_history (token_id, created_at) INCLUDE ({PRICES})",
+    ],
+}
+
+
+def orm_history(db, token_id: int, hours: int):
+    """Старый способ: полные ORM-объекты."""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return db.query(PriceHistory).filter(
+        PriceHistory.token_id == token_id,
+        PriceHistory.created_at >= since,
+    ).order_by(PriceHistory.created_at.asc()).all()
+
+
+def drop_indexes(conn) -> None:
+    for (name,) in conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() "
+        "AND tablename = 'price_history' AND indexname NOT LIKE '%pkey'"
+    )).all():
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+
+def timed(fn, repeat: int):
+    samples = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(fn())
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return rows, statistics.median(samples), samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="price_history read benchmark")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--days", type=float, default=2.0, help="период, на который размазаны строки")
+    parser.add_argument("--hours", default="1,24", help="окна запросов, часы")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--schema", default="hydra_bench")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему в конце")
+    args = parser.parse_args()
+
+    admin = create_engine(DATABASE_URL)
+    with admin.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS "{args.schema}" CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA "{args.schema}"'))
+
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"options": f"-csearch_path={args.schema}"},
+    )
+    Session = sessionmaker(bind=engine)
+
+    try:
+        PriceHistory.__table__.create(engine)
+        now = datetime.now(timezone.utc)
+        span = timedelta(days=args.days)
+        history_partitions.ensure_partitions(engine, since=now - span)
+
+        print(f"Filling {args.rows:,} rows for {args.tokens} tokens over {args.days} days...")
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            drop_indexes(conn)
+            conn.execute(
+                text(
+                    "INSERT INTO price_history (token_id, mexc_bid, mexc_ask, matcha_price, "
+                    "pancake_price, spread, created_at) "
+                    "SELECT 1 + (g % :tokens), p, p + 0.1, p, p, 0.1, "
+                    ":start + (g::bigint * :step) * interval '1 microsecond' "
+                    "FROM (SELECT g, 100 + random() AS p FROM generate_series(0, :rows - 1) g) s"
+                ),
+                {
+                    "tokens": args.tokens,
+                    "rows": args.rows,
+                    "start": now - span,
+                    "step": int(span.total_seconds() * 1_000_000 / args.rows),
+                },
+            )
+        print(f"  done in {time.perf_counter() - started:.1f}s")
+
+        windows = [int(h) for h in args.hours.split(",") if h.strip()]
+        token_id = args.tokens // 2
+
+        print(f"{'indexes':<10} {'read':<8} {'hours':>5} {'rows':>8} {'p50 ms':>9} {'p95 ms':>9}")
+        for variant, ddl in VARIANTS.items():
+            with engine.begin() as conn:
+                drop_indexes(conn)
+                for statement in ddl:
+                    conn.execute(text(statement))
+            # VACUUM вне транзакции — нужен для index-only scan (visibility map)
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("VACUUM ANALYZE price_history"))
+
+            for hours in windows:
+                db = Session()
+                try:
+                    for label, fn in (
+                        ("orm", lambda: orm_history(db, token_id, hours)),
+                        ("columns", lambda: get_price_history(db, token_id, hours=hours)),
+                    ):
+                        rows, p50, p95 = timed(fn, args.repeat)
+                        db.expunge_all()
+                        print(f"{variant:<10} {label:<8} {hours:>5} {rows:>8} {p50:>9.2f} {p95:>9.2f}")
+                finally:
+                    db.close()
+    finally:
+        if not args.keep:
+            with admin.begin() as conn:
+                conn.execute(text(f'DROP SCHEMA IF EXISTS "{args.schema}" CASCADE'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# scripts/loadtest.py
+"""
+Нагрузочный тест /api/prices: сколько запросов в секунду держит сервер
+при разной конкурентности и как растут задержки.
+
+Пример:
+    python scripts/loadtest.py --url http://localhost:8000 --token XXX \
+        --base SOL --concurrency 1,10,50,100 --requests 500
+
+Если event loop не блокируется, пропускная способность растёт вместе с
+конкурентностью, а p50 остаётся примерно на месте.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List
+
+import httpx
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    url: str,
+    payload: dict,
+    concurrency: int,
+    total: int,
+) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                r = await client.post(url, json=payload)
+                if r.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test for /api/prices")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True, help="access token (Bearer)")
+    parser.add_argument("--base", default="SOL")
+    parser.add_argument("--path", default="/api/prices")
+    parser.add_argument("--concurrency", default="1,10,50,100")
+    parser.add_argument("--requests", type=int, default=500, help="requests per level")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    headers = {"Authorization": f"Bearer {args.token}"}
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    url = args.url.rstrip("/") + args.path
+
+    print(f"{'conc':>6} {'reqs':>6} {'err':>5} {'rps':>9} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}")
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=30) as client:
+        for concurrency in levels:
+            res = await run_level(client, url, {"base": args.base}, concurrency, args.requests)
+            print(
+                f"{res['concurrency']:>6} {res['requests']:>6} {res['errors']:>5} "
+                f"{res['rps']:>9.1f} {res['p50_ms']:>8.1f} {res['p95_ms']:>8.1f} {res['p99_ms']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
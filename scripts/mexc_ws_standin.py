@@ -0,0 +1,183 @@
+# scripts/mexc_ws_standin.py
+"""
+Локальный WebSocket-сервер, изображающий MEXC (спот и фьючерсы), для
+проверки backend/mexc_ws.py без выхода в сеть.
+
+Протокол определяется по первому сообщению клиента:
+- спот: {"method": "SUBSCRIPTION", "params": [...]} -> ответ
+  {"id": 0, "code": 0, "msg": "..."} и поток bookTicker {"s", "d": {"b", "a"}};
+- фьючерсы: {"method": "sub.ticker", "param": {"symbol"}} -> ответ
+  {"channel": "rs.sub.ticker", "data": "success"} и поток push.ticker.
+
+Сервер для ручной проверки (приложение с MEXC_WS_ENABLED=1 и
+MEXC_WS_SPOT_URL / MEXC_WS_FUTURES_URL, указывающими на него):
+    python scripts/mexc_ws_standin.py --port 8765
+
+Самопроверка ингестора (флаги live_* только после подтверждения подписки,
+сброс при обрыве, переподключение):
+    DATABASE_URL=sqlite:////tmp/hydra.db python scripts/mexc_ws_standin.py --check
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+import websockets
+
+
+class StandinServer:
+    """Поддельный MEXC: подтверждает подписки и шлёт котировки раз в interval секунд."""
+
+    def __init__(self, interval: float = 0.1, ack_delay: float = 0.0, reject: bool = False):
+        self.interval = interval
+        self.ack_delay = ack_delay
+        self.reject = reject
+        self.connections = set()
+
+    async def handler(self, ws, *_):
+        self.connections.add(ws)
+        try:
+            raw = await ws.recv()
+            first = json.loads(raw)
+            if first.get("method") == "SUBSCRIPTION":
+                await self._spot(ws, first)
+            else:
+                await self._futures(ws, first)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(ws)
+
+    async def _spot(self, ws, message: dict) -> None:
+        params = message.get("params") or []
+        await asyncio.sleep(self.ack_delay)
+        if self.reject:
+            await ws.send(json.dumps({"id": 0, "code": 0, "msg": f"Not Subscribed successfully! [{','.join(params)}]"}))
+            await ws.wait_closed()
+            return
+        await ws.send(json.dumps({"id": 0, "code": 0, "msg": ",".join(params)}))
+        symbols = [p.rsplit("@", 1)[-1] for p in params]
+        while True:
+            for symbol in symbols:
+                bid = round(100 + random.random(), 4)
+                await ws.send(json.dumps({
+                    "c": f"spot@public.bookTicker.v3.api@{symbol}",
+                    "s": symbol,
+                    "d": {"b": str(bid), "a": str(round(bid + 0.01, 4))},
+                }))
+            await asyncio.sleep(self.interval)
+
+    async def _futures(self, ws, first: dict) -> None:
+        symbols = []
+        message = first
+        # Подписки приходят пачкой, по сообщению на символ
+        while True:
+            if message.get("method") == "sub.ticker":
+                symbols.append(message["param"]["symbol"])
+                await asyncio.sleep(self.ack_delay)
+                if self.reject:
+                    await ws.send(json.dumps({"channel": "rs.error", "data": "Contract not exists!"}))
+                else:
+                    await ws.send(json.dumps({"channel": "rs.sub.ticker", "data": "success"}))
+            try:
+                message = json.loads(await asyncio.wait_for(ws.recv(), self.interval))
+            except asyncio.TimeoutError:
+                break
+        if self.reject:
+            await ws.wait_closed()
+            return
+        while True:
+            for symbol in symbols:
+                await ws.send(json.dumps({
+                    "channel": "push.ticker",
+                    "data": {"symbol": symbol, "lastPrice": 100 + random.random(), "amount24": 1e6},
+                }))
+            await asyncio.sleep(self.interval)
+
+    async def drop_all(self) -> None:
+        """Оборвать все соединения (проверка переподключения)."""
+        for ws in list(self.connections):
+            await ws.close()
+
+
+async def _wait_for(predicate, timeout: float) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.02)
+    return predicate()
+
+
+async def check(port: int) -> int:
+    """Прогнать MexcWsIngestor против поддельного сервера и проверить флаги."""
+    os.environ.setdefault("MEXC_WS_BACKOFF_BASE", "0.1")
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from backend.mexc_ws import MexcWsIngestor
+    from backend.mexc_snapshot import mexc_snapshot
+
+    url = f"ws://127.0.0.1:{port}"
+    failures = []
+
+    def expect(name: str, ok: bool) -> None:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    def live() -> bool:
+        return mexc_snapshot.live_spot_connected and mexc_snapshot.live_futures_connected
+
+    server = StandinServer(ack_delay=0.3)
+    async with websockets.serve(server.handler, "127.0.0.1", port):
+        ingestor = MexcWsIngestor(spot_url=url, futures_url=url)
+        await ingestor.set_symbols(["SOL", "BTC"])
+        await asyncio.sleep(0.1)
+        expect("flags stay down until the subscription is acknowledged", not live())
+        expect("flags go up after the ack", await _wait_for(live, 3))
+        expect("live quotes arrive", await _wait_for(lambda: "SOL_USDT" in mexc_snapshot.live_spot, 3))
+
+        await server.drop_all()
+        expect("flags drop on disconnect", await _wait_for(lambda: not live(), 3))
+        expect("live quotes are dropped with the connection", "SOL_USDT" not in mexc_snapshot.live_spot)
+        expect("feed reconnects and resubscribes", await _wait_for(live, 5))
+
+        await ingestor.stop_feeds()
+        expect("flags are down after stop", not live())
+
+    server = StandinServer(reject=True)
+    async with websockets.serve(server.handler, "127.0.0.1", port):
+        ingestor = MexcWsIngestor(spot_url=url, futures_url=url)
+        await ingestor.set_symbols(["SOL"])
+        await asyncio.sleep(1.0)
+        expect("rejected subscription keeps flags down", not live())
+        await ingestor.stop_feeds()
+
+    print("FAILED" if failures else "all checks passed")
+    return 1 if failures else 0
+
+
+async def serve(port: int, interval: float) -> None:
+    server = StandinServer(interval=interval)
+    async with websockets.serve(server.handler, "0.0.0.0", port):
+        print(f"MEXC stand-in on ws://127.0.0.1:{port}")
+        await asyncio.Future()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Поддельный MEXC WebSocket для проверки mexc_ws")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--interval", type=float, default=0.5, help="пауза между пачками котировок, с")
+    parser.add_argument("--check", action="store_true", help="прогнать ингестор против сервера и выйти")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(asyncio.run(check(args.port)))
+    asyncio.run(serve(args.port, args.interval))
+
+
+if __name__ == "__main__":
+    main()